@@ -0,0 +1,26 @@
+#!/usr/bin/env bash
+
+HOME=/home/zagic/nlpfromscratch
+# HOME=/Users/zagic/Work/cph/pycharm_projects/nlpfromscratch
+
+# one command per target: all sources, aligners, trees and binary settings are projected in a single run
+for corpus in bible watchtower; do
+    for target in `cat /home/bplank/preprocess-holy-data/languages/trg-src-${corpus}.txt`; do
+        sources=""
+        for source in `cat /home/bplank/preprocess-holy-data/languages/src-${corpus}.txt`; do
+            if [ "$source" != "$target" ]; then
+                sources="$sources /home/bplank/parse-holy-data/data/2project/${corpus}/$source.2proj.conll"
+            fi
+        done
+        echo "python $HOME/src/projection/project_multi.py" \
+        "--target /home/bplank/parse-holy-data/data/2project/${corpus}/$target.2proj.conll" \
+        "--sources$sources" \
+        "--corpus $corpus" \
+        "--walign_dir /home/bplank/preprocess-holy-data/data/walign" \
+        "--salign_dir /home/bplank/preprocess-holy-data/data/salign" \
+        "--out_dir $HOME/data/projections" \
+        "--aligners ibm1 ibm2 --trees 0 1 --binary 0 1 --use_similarity 0" \
+        "2> $HOME/data/logs/${target}.corpus_${corpus}.proj.log" \
+        >> $HOME/run/commands_project_multi_${corpus}.txt
+    done
+done
@@ -9,6 +9,8 @@ from utils import conll
 from parallel_sentence import SourceSentence, ParallelSentence
 from utils.alignments import read_word_alignments
 from utils.conll import get_next_sentence_and_graph, get_next_sentence
+from utils.alignment_store import open_store_for as open_alignment_store
+from utils.graph_store import open_store_for
 
 import pandas as pd
 
@@ -23,20 +25,29 @@ def read_sents_from_conll(conll_file):
 
 
 def read_parses(conll_file):
+    # use the graph store of the file, if there is one; otherwise parse the text
+    graph_store = open_store_for(conll_file)
+    if graph_store is not None:
+        return [read_parse(forms, weights, pos) for forms, weights, pos in graph_store]
+
     parses = []
     with conll_file.open() as conll_fh:
         for tokens_and_weights_and_pos in conll.sentences(conll_fh, sentence_getter=get_next_sentence_and_graph):
             tokens, weights, pos = tokens_and_weights_and_pos
-            forms = ['ROOT'] + [token.form for token in tokens]
-            pos = ['ROOT'] + pos
+            parses.append(read_parse([token.form for token in tokens], weights, pos))
 
-            assert len(forms) == len(pos)
-            assert len(forms) == weights.shape[0]
-            assert len(forms) == weights.shape[1]
+    return parses
 
-            parses.append((forms, pos, weights))
 
-    return parses
+def read_parse(forms, weights, pos):
+    forms = ['ROOT'] + forms
+    pos = ['ROOT'] + pos
+
+    assert len(forms) == len(pos)
+    assert len(forms) == weights.shape[0]
+    assert len(forms) == weights.shape[1]
+
+    return forms, pos, weights
 
 
 def read_gold_parses(conll_file):
@@ -78,7 +89,9 @@ for pair in args.pairs:
         source_to_target_map[source_sent_id] = (target_sent_id, pair_i)
 
     word_align_file = (args.base_dir / 'walign' / "{}.{}.ibm1.reverse.wal".format(pair, args.corpus))
-    word_align = read_word_alignments(word_align_file)
+    word_align = open_alignment_store(sent_align_file, word_align_file)
+    if word_align is None:
+        word_align = read_word_alignments(word_align_file)
 
     # CONLL file
     src_conll_file = (args.base_dir / 'conll' / '{}.{}.conll'.format(src_lang, args.corpus))
@@ -1,4 +1,5 @@
 import argparse
+import itertools
 import numpy as np
 from collections import Counter
 import utils.conll as conll
@@ -9,7 +10,7 @@ import copy
 
 from utils.is_projective import is_projective
 import networkx as nx
-from dependency_decoding import chu_liu_edmonds
+from mst.decoding import decode_batch, decoders, projective_decoders, decoding_pool, DECODE_BATCH_SIZE
 
 NEGINF = float("-inf")
 ONLYLEAF = set("ADP AUX CONJ DET PUNCT PRT SCONJ".split())
@@ -144,7 +145,34 @@ class DependencyTree(nx.DiGraph):
 
 
 def ud_filter(P, M_in, enforce_function_leaves=True, promote_first_content_to_root=True, enforce_single_root=True,
-              attach_last_punct_to_root=True, punish_punct_nonproj=True):
+              attach_last_punct_to_root=True, punish_punct_nonproj=True, decoder="cle"):
+    M = ud_constrain(P, M_in, enforce_function_leaves, promote_first_content_to_root, enforce_single_root,
+                     attach_last_punct_to_root)
+
+    # 5.- Retrieve PUNCT words that participate in a non projectivity and disable their current head.
+    # This modification does not remove projectivity altogether because the head will still be assigned with CLE
+    # With a projective decoder downstream, there are no non projectivities to punish, and no need to decode here
+    if punish_punct_nonproj and decoder not in projective_decoders:
+        block_punct_nonproj(P, M, decoders[decoder](M))
+    return M
+
+
+def ud_filter_batch(Ps, Ms_in, enforce_function_leaves=True, promote_first_content_to_root=True,
+                    enforce_single_root=True, attach_last_punct_to_root=True, punish_punct_nonproj=True, decoder="cle",
+                    pool=None, processes=None):
+    """ud_filter for many sentences, with the CLE decoding of step 5 done in a single batch, see mst.decoding."""
+    Ms = [ud_constrain(P, M_in, enforce_function_leaves, promote_first_content_to_root, enforce_single_root,
+                       attach_last_punct_to_root) for P, M_in in zip(Ps, Ms_in)]
+
+    if punish_punct_nonproj and decoder not in projective_decoders:
+        for P, M, heads in zip(Ps, Ms, decode_batch(Ms, decoder=decoder, pool=pool, processes=processes)):
+            block_punct_nonproj(P, M, heads)
+    return Ms
+
+
+def ud_constrain(P, M_in, enforce_function_leaves=True, promote_first_content_to_root=True, enforce_single_root=True,
+                 attach_last_punct_to_root=True):
+    """Steps 1-4 of ud_filter, the constraints that do not need a decoded tree."""
     M = copy.copy(M_in)
     P = ["ROOT"] + P  # We assume the POS list has no padding
 
@@ -192,38 +220,39 @@ def ud_filter(P, M_in, enforce_function_leaves=True, promote_first_content_to_ro
                 else:
                     M[-1, x] = M_in[-1, likeliest_root]
 
-    # 5.- Retrieve PUNCT words that participate in a non projectivity and disable their current head.
-    # This modification does not remove projectivity altogether because the head will still be assigned with CLE
-    if punish_punct_nonproj:
-        heads = chu_liu_edmonds(M)
-        heads = heads[0]
-
-        sent = DependencyTree()
-        for n, p in enumerate(P):
-            sent.add_node(n, {'cpostag': p})
-        for n in sent.nodes()[1:]:
-            sent.add_edge(heads[n], n)
-        # print(sent.punct_proj_violations(), is_projective(heads), heads, P)
-        for i in sent.punct_proj_violations():  # block the existing head
-            M[i, heads[i]] = NEGINF
     return M
 
 
+def block_punct_nonproj(P, M, heads):
+    """Step 5 of ud_filter: blocks the current heads of the PUNCT words that participate in a non projectivity.
+
+    :param P: list of POS tags, without root padding
+    :param M: (n+1 x n+1) score matrix, modified in place
+    :param heads: decoded heads of M, -1 for the root
+    """
+    P = ["ROOT"] + P  # We assume the POS list has no padding
+
+    sent = DependencyTree()
+    for n, p in enumerate(P):
+        sent.add_node(n, {'cpostag': p})
+    for n in sent.nodes()[1:]:
+        sent.add_edge(heads[n], n)
+    # print(sent.punct_proj_violations(), is_projective(heads), heads, P)
+    for i in sent.punct_proj_violations():  # block the existing head
+        M[i, heads[i]] = NEGINF
+
+
 def printmatrix(M):
     for r in M:
         print(" ".join([str(x) for x in r]))
 
 
-def main():
-    parser = argparse.ArgumentParser(description="")
-    parser.add_argument("--infile", help='Files with projection tensors and gold parses',
-                        default='/Users/hector/proj/nlpfromscratch/data/conll/en.biblenonproj.conll')
-    args = parser.parse_args()
-
+def read_sentences(infile):
+    """Yields the POS tags and score matrices of the sentences of a file with head:score pairs in the last column."""
     P = []  # list to store POS values
     L = []  # dictionary list to later build a matrix proper
 
-    for line in open(args.infile):
+    for line in open(infile):
         line = line.strip()
         if line:
             parts = line.split("\t")
@@ -242,12 +271,32 @@ def main():
                     R[k] = rowdict[k]
                 M.append(R)
             M = np.array(M)
-            Mfiltered = ud_filter(P, M)
-            # printmatrix(Mfiltered)
-            # print()
+            yield P, M
             P = []  # list to store POS values
             L = []  # dictionary list to later build a matrix proper
 
 
+def main():
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument("--infile", help='Files with projection tensors and gold parses',
+                        default='/Users/hector/proj/nlpfromscratch/data/conll/en.biblenonproj.conll')
+    parser.add_argument("--processes", required=False, help="number of decoding processes, defaults to all CPUs",
+                        type=int)
+    args = parser.parse_args()
+
+    # the sentences are filtered in batches, with the CLE decoding of a batch spread over the pool
+    sentences = read_sentences(args.infile)
+    with decoding_pool(args.processes) as pool:
+        while True:
+            batch = list(itertools.islice(sentences, DECODE_BATCH_SIZE))
+            if not batch:
+                break
+            all_M_filtered = ud_filter_batch([P for P, _ in batch], [M for _, M in batch], pool=pool,
+                                            processes=args.processes)
+            # for Mfiltered in all_M_filtered:
+            #     printmatrix(Mfiltered)
+            #     print()
+
+
 if __name__ == "__main__":
     main()
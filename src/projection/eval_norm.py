@@ -1,75 +1,94 @@
 import argparse
 import numpy as np
-from collections import Counter
-import utils.conll as conll
-import mst.cle as cle
-import string
 import sys
 import time
-import copy
 from pathlib import Path
 from multiprocessing import Pool
 import pandas as pd
-from functools import partial
+import mst.cle as cle
+import utils.normalize as norm
+from mst.decoding import decoders
+from utils.aggregation import aggregate_all, read_source_weights
+from utils.voting import eliminate_all_nan_rows
 
 start_time = time.time()  # timing the script
 
-parser = argparse.ArgumentParser(description="")
+parser = argparse.ArgumentParser(description="Compares vote aggregations by the UAS of the decoded trees on "
+                                             "projection tensors dumped by vote_pos_and_deps.py --dump_npz.")
 parser.add_argument("projection_files", help='Files with projection tensors and gold parses', type=Path, nargs='+')
+parser.add_argument("--aggregations", required=False, nargs="+", default=["secret"],
+                    choices=["secret", "sum", "max", "rank", "standardized", "threshold", "threshold_binary",
+                             "weighted"],
+                    help="aggregations to compare: secret is the standardization of the whole tensor followed by the "
+                         "sum, the others are those of utils.aggregation")
+parser.add_argument("--thresholds", required=False, type=float, nargs="+", default=[0.1],
+                    help="lowest source weights that count for the threshold aggregations")
+parser.add_argument("--source_weights", required=False, type=Path,
+                    help="file with a \"source target weight\" triple per line, for the weighted aggregation")
+parser.add_argument("--softmax", action="store_true",
+                    help="normalize the aggregated matrices with softmax before decoding, as vote_pos_and_deps.py does")
+parser.add_argument("--decoder", required=False, choices=["mdst"] + list(decoders.keys()), default="mdst",
+                    help="decoding engine: mst.cle.mdst, or one of the engines of mst.decoding")
+parser.add_argument("--processes", required=False, type=int, default=20, help="number of processes")
 args = parser.parse_args()
 
+if "weighted" in args.aggregations and not args.source_weights:
+    parser.error("the weighted aggregation needs --source_weights")
 
-def softmax(matrix, temperature=1):
-    m_exp = np.exp(matrix/temperature)
-    return (m_exp.T / m_exp.sum(axis=1)).T
-
-def sum_normalize(T_proj):
-    return T_proj.sum(axis=2)
-
-def threshold_normalize(T_proj, threshold=0.1, binary=False):
-    mask = T_proj < threshold
-    T_proj[mask] = 0.0
-    if binary:
-        T_proj[~mask] = 1.0
-
-    return sum_normalize(T_proj)
+# the aggregations of utils.aggregation to compare: <aggregator, parameters>, the weighted sum gets its weights per file
+configurations = {name: (name, {}) for name in ("sum", "max", "rank", "standardized") if name in args.aggregations}
+for threshold in args.thresholds:
+    if "threshold" in args.aggregations:
+        configurations["threshold_%s" % threshold] = ("threshold", {"threshold": threshold})
+    if "threshold_binary" in args.aggregations:
+        configurations["threshold_%s_binary" % threshold] = ("threshold", {"threshold": threshold, "binary": True})
 
-def row_normalize(M):
-    return (M.T / M.sum(axis=1)).T
 
 def secret_normalize(T_proj):
-    #for i in range(T_proj.shape[2]):
-    #    T_proj[:, :, i] = (T_proj[:, :, i].T * T_proj[:, :, i].sum(axis=1)).T
-
-    T_proj -= T_proj.mean()
+    """Standardizes the whole tensor by its mean and standard deviation, and sums over the sources."""
+    T_proj = T_proj - T_proj.mean()
     T_proj /= T_proj.std()
+    return T_proj.sum(axis=2)
 
 
-    M_norm = sum_normalize(T_proj)
-
-    return M_norm
-
-    #return softmax(M_norm, 1)
-
-def get_prediction_score(filename, normalize_fn):
+def get_prediction_scores(filename):
+    """UAS of every aggregation on a single dumped sentence, all of them aggregated from one loaded tensor."""
     data = np.load(str(filename))
     T_projection = data['projection_tensor']
     source_languages = list(data['source_languages'])
     heads = list(data['heads'])
 
-    # Normalization
-    M_projection = normalize_fn(T_projection)
-    decoded_heads = cle.mdst(M_projection)
+    file_configurations = dict(configurations)
+    if "weighted" in args.aggregations:
+        # the dumps are named after the target, see vote_pos_and_deps.py --dump_npz
+        source_weights = read_source_weights(args.source_weights, Path(filename).name.split(".", 1)[0])
+        file_configurations["weighted"] = ("weighted", {"weights": [source_weights.get(language, 1.0)
+                                                                    for language in source_languages]})
+
+    aggregated = aggregate_all(T_projection, file_configurations)
+    if "secret" in args.aggregations:
+        aggregated["secret"] = secret_normalize(T_projection)
+
+    scores = {}
+    for name, M_projection in aggregated.items():
+        if args.softmax:
+            # normalization, as in vote_pos_and_deps.py
+            M_projection = norm.softmax(M_projection)
+            eliminate_all_nan_rows(M_projection)
+
+        if args.decoder == "mdst":
+            decoded_heads = cle.mdst(M_projection)
+        else:
+            decoded_heads = decoders[args.decoder](M_projection)[1:]
+
+        assert len(heads) == len(decoded_heads)
+        num_correct = sum(pred_head == gold_head for gold_head, pred_head in zip(heads, decoded_heads))
+        scores[name] = num_correct / len(heads)
 
-    assert len(heads) == len(decoded_heads)
-    num_correct = sum(pred_head == gold_head for gold_head, pred_head in zip(heads, decoded_heads))
-    uas = num_correct / len(heads)
-    return uas
+    return scores
 
-pool = Pool(processes=20)
-# normalize_fn = partial(threshold_normalize, threshold=(threshold / 1000)*5)
-normalize_fn = secret_normalize
-score_fn = partial(get_prediction_score, normalize_fn=normalize_fn)
-scores = pool.map(score_fn, args.projection_files)
-print(pd.Series(scores).describe())
 
+pool = Pool(processes=args.processes)
+scores = pool.map(get_prediction_scores, args.projection_files)
+print(pd.DataFrame(scores).describe().transpose())
+print("Execution time: %s sec" % (time.time() - start_time), file=sys.stderr)
@@ -1,159 +1,256 @@
-# This is an implemenation of Tarjan's Implementation of CLE for MST, based on Uri Zwick's lecture notes
+# Minimum directed spanning tree (Chu-Liu-Edmonds) in O(m log n), after Tarjan's contraction scheme as presented
+# in Uri Zwick's lecture notes. The graph is kept in flat arrays: one mergeable (leftist) heap of in-edges per vertex
+# with lazy weight adjustments, and a union-find with path compression over the vertices and contracted supervertices.
 import numpy as np
-import heapq, sys
-from string import ascii_lowercase
-
-
-class Vertex:
-    def __init__(self, w_index, ranking):
-        self.ranking = ranking
-        self.w_index = w_index  #index of word in sentence
-        self.in_edge = None
-        self.const = 0
-        self.prev = None
-        self.next = None
-        self.parent = None
-        self.children = []
-        self.target = []
-        self.P = []  #if ranking, this will be the edge list ordered by rank
-
-    def __str__(self):
-        return str(self.w_index)
-
-    def getPLength(self):
-        return len(self.P)
-
-    def getPNext(self):
-        #		if self.ranking:
-        #			return self.P.pop(0)
-        #		else:
-        if True:
-            return heapq.heappop(self.P)
-
-    def notEmpty(self):
-        return not (len(self.P) == 0)
-
-
-def initialise(M, ranking):
-    #head is row, col is dependent
-    shape = M.shape
-    vertices = []
-    for v in range(shape[0]):  #rows=heads, columns=heads
-        vertices.append(Vertex(v, ranking))
-        for u in range(shape[0]):
-            #			if ranking: #ranking starts at 1
-            #				vertices[v].P.append((M[u][v],(u,v), M[u][v]))
-            #			else:
-            if True:
-                heapq.heappush(vertices[v].P, (M[u][v], (u, v), M[u][v]))
-            #		if ranking:
-            #			sorted(vertices[v].P)
-            #		else: 
-        if True:
-            heapq.heapify(vertices[v].P)
-    return vertices
-
-
-def meldQueues(c, a, vertices, ranking):
-    index = 0
-    while a.notEmpty():
-        temp_next = a.getPNext()
-        if temp_next[1][0] == temp_next[1][1]:  # get rid of simple loops
-            continue
-        next = (weight_naive(temp_next, vertices), temp_next[1], temp_next[2])  #adjust weights
-        #		if ranking:
-        #			while next[0]<c.P[index][0]: #while c's edge is heavier
-        #				index+=1
-        #			c.P.insert(index,next)
-        #			index+=1
-        #		else:
-        if True:
-            heapq.heappush(c.P, next)
-    heapq.heapify(c.P)
-
-
-def find_naive(u):
-    while u.parent is not None:
-        u = u.parent
-    return u
-
-
-def weight_naive(edge, vertices):  #edge is a pair (weight, (source vertex, target vertex))
-    w = edge[2]
-    #print 'weight', edge
-    v = vertices[edge[1][1]]
-    while v.parent is not None:
-        w = w + v.const
-        v = v.parent
-    return w
-
-
-def expand(vertices):
-    R = []
-    root = vertices[0]
-    dismantle(root, R)
-    count = 0
-    while len(R) > 0:
-        c = R.pop(0)
-        uv = c.in_edge
-        v = vertices[uv[1][1]]
-        v.in_edge = uv
-        dismantle(v, R)
-        count += 1
-    #	return [(vertices[x].in_edge[2], (vertices[x].in_edge[1][0],x)) for x in range(len(vertices))]
-    return [vertices[x].in_edge[1][0] for x in range(1, len(vertices))]
-
-
-def dismantle(u, R):  #u is a Vertex
-    while u.parent is not None:
-        u = u.parent
-        for v in u.children:
-            v.parent = None
-            if len(v.children) > 0:
-                R.append(v)
-        del u.children[:]
-
-
-def contract(M, ranking=False):
-    dim = M.shape[0]
-    vertices = initialise(M, ranking)
-    a = vertices[0]
-    count = 0
-    letter = M.shape[0] + 1
-
-    while a.notEmpty():
-        uv = a.getPNext()
-        u = vertices[uv[1][0]]
-        b = find_naive(u)
-        if a is b:  #self loop
-            continue
-        else:
-            a.in_edge = uv
-            a.prev = b
-            if u.in_edge is None:
-                b.next = a
-                a = b  #b is the new first vertex on the path
-            else:
-                count += 1
-                c = Vertex(letter, ranking)  #-1 word index for super vertices
-                letter += 1
-                while a.parent is None:
-                    a.parent = c
-                    c.target.append(a.in_edge[1][1])
-                    a.const = -weight_naive(a.in_edge, vertices)
-                    c.children.append(a)
-                    index = 0
-                    #merging a's priority queue into c's
-                    meldQueues(c, a, vertices, ranking)
-                    a = a.prev
-                for child in c.children:
-                    if child.next is not None:
-                        if child.next not in c.children:
-                            c.next = child.next
-                            child.next.prev = c
-                            break
-                a = c
-    return vertices
+
+NIL = -1
+
+
+class Heaps:
+    """
+    Leftist heaps over the edges of a graph, stored in flat arrays indexed by edge: the edge key (its current,
+    adjusted weight), a lazy delta to be added to all keys in the subtree, the children, and the rank.
+    """
+    def __init__(self, keys):
+        self.key = keys
+        self.delta = [0.0] * len(keys)
+        self.left = [NIL] * len(keys)
+        self.right = [NIL] * len(keys)
+        self.rank = [1] * len(keys)
+
+    def prop(self, a):
+        delta = self.delta[a]
+        if delta:
+            self.key[a] += delta
+            if self.left[a] != NIL:
+                self.delta[self.left[a]] += delta
+            if self.right[a] != NIL:
+                self.delta[self.right[a]] += delta
+            self.delta[a] = 0.0
+
+    def top(self, a):
+        self.prop(a)
+        return self.key[a]
+
+    def merge(self, a, b):
+        if a == NIL:
+            return b
+        if b == NIL:
+            return a
+        self.prop(a)
+        self.prop(b)
+        if self.key[b] < self.key[a]:
+            a, b = b, a
+        self.right[a] = self.merge(self.right[a], b)
+        left, right = self.left[a], self.right[a]
+        if left == NIL or self.rank[left] < self.rank[right]:
+            self.left[a], self.right[a] = right, left
+        self.rank[a] = 1 + (self.rank[self.right[a]] if self.right[a] != NIL else 0)
+        return a
+
+    def pop(self, a):
+        self.prop(a)
+        return self.merge(self.left[a], self.right[a])
+
+
+def build_in_edge_heaps(n, sources, targets, weights):
+    """Creates the heaps of in-edges of all vertices. The in-edges of a vertex, sorted by weight and then by source
+    vertex, form a valid leftist heap as a chain of left children.
+
+    :param n: number of vertices
+    :param sources: array of edge source vertices
+    :param targets: array of edge target vertices
+    :param weights: array of edge weights
+    :return: <source vertices, target vertices, Heaps, heap of each vertex> 4-tuple, the edges ordered by heap position
+    """
+    order = np.lexsort((sources, weights, targets))
+    sources, targets, weights = sources[order], targets[order], weights[order]
+
+    heaps = Heaps(weights.tolist())
+    chained = np.zeros(len(targets), dtype=bool)
+    chained[:-1] = targets[1:] == targets[:-1]
+    heaps.left = np.where(chained, np.arange(1, len(targets) + 1), NIL).tolist()
+
+    heap = [NIL] * (2 * n)
+    for first in np.flatnonzero(np.append(True, targets[1:] != targets[:-1])) if len(targets) else []:
+        heap[targets[first]] = int(first)
+
+    return sources.tolist(), targets.tolist(), heaps, heap
+
+
+def find(uf, u):
+    root = u
+    while uf[root] != root:
+        root = uf[root]
+    while uf[u] != root:  # path compression
+        uf[u], u = root, uf[u]
+    return root
+
+
+def mst(W, root=0):
+    """Minimum spanning arborescence of a complete directed graph.
+
+    :param W: (n x n) edge weights, W[u, v] is the weight of the edge u -> v; NaN edges are used only if unavoidable
+    :param root: root vertex
+    :return: list of the parent of each vertex, -1 for the root
+    """
+    W = np.array(W, dtype=np.float64)
+    n = W.shape[0]
+
+    # missing edges get a weight that makes any tree with fewer of them cheaper
+    missing = np.isnan(W)
+    if missing.any():
+        finite = W[~missing]
+        low, high = (finite.min(), finite.max()) if len(finite) else (0.0, 0.0)
+        W[missing] = high + n * (high - low) + 1.0
+
+    # all edges but loops and the in-edges of the root
+    sources, targets = np.nonzero(~np.eye(n, dtype=bool))
+    keep = targets != root
+    sources, targets = sources[keep], targets[keep]
+
+    return mst_edges(n, sources, targets, W[sources, targets], root)
+
+
+def mst_edges(n, sources, targets, weights, root=0):
+    """Minimum spanning arborescence of a directed graph given by its edges, in O(m log n) for m edges.
+
+    :param n: number of vertices
+    :param sources: array of edge source vertices
+    :param targets: array of edge target vertices
+    :param weights: array of edge weights
+    :param root: root vertex
+    :return: list of the parent of each vertex, -1 for the root
+    """
+    sources, targets, heaps, heap = build_in_edge_heaps(n, np.asarray(sources), np.asarray(targets),
+                                                        np.asarray(weights, dtype=np.float64))
+
+    uf = list(range(2 * n))  # representatives, over vertices and supervertices n, n+1, ...
+    owner = [NIL] * (2 * n)  # the supervertex each (super)vertex was contracted into, not compressed
+    seen = [NIL] * (2 * n)
+    in_edge = [NIL] * (2 * n)
+    cycles = []  # items: (supervertex, [(member, in-edge of the member in the cycle), ...]), in contraction order
+    next_id = n
+
+    seen[root] = root
+    for s in range(n):
+        u = s
+        path, chosen = [], []
+
+        while seen[u] == NIL:
+            # cheapest in-edge of u that is not a loop within u
+            while True:
+                if heap[u] == NIL:
+                    raise ValueError("Vertex %s cannot be reached from the root." % u)
+                e = heap[u]
+                heaps.prop(e)
+                if find(uf, sources[e]) != u:
+                    break
+                heap[u] = heaps.pop(e)
+
+            # the remaining in-edges of u compete with the chosen one from now on
+            heaps.delta[e] -= heaps.key[e]
+            heap[u] = heaps.pop(e)
+
+            path.append(u)
+            chosen.append(e)
+            seen[u] = s
+            u = find(uf, sources[e])
+
+            if seen[u] == s:  # found a cycle, contract it into a new supervertex
+                c = next_id
+                next_id += 1
+                members = []
+                cycle_heap = NIL
+                while True:
+                    w, e = path.pop(), chosen.pop()
+                    cycle_heap = heaps.merge(cycle_heap, heap[w])
+                    uf[w] = c
+                    owner[w] = c
+                    members.append((w, e))
+                    if w == u:
+                        break
+                heap[c] = cycle_heap
+                cycles.append((c, members))
+                u = c
+
+        for w, e in zip(path, chosen):
+            in_edge[w] = e
+
+    # expand the supervertices in reverse contraction order: the in-edge of a supervertex replaces the cycle edge
+    # of the member it enters, the other members keep their cycle edges
+    for c, members in reversed(cycles):
+        e = in_edge[c]
+        entered = targets[e]
+        while owner[entered] != c:
+            entered = owner[entered]
+        for w, cycle_edge in members:
+            in_edge[w] = cycle_edge
+        in_edge[entered] = e
+
+    return [sources[in_edge[v]] if v != root else NIL for v in range(n)]
+
+
+def candidate_edges(n, dependents, heads, scores, root=0):
+    """Turns candidate arcs into minimization edges, adding a fallback arc from the root for every token with a score
+    so low that a tree with fewer fallback arcs always scores higher.
+
+    :param n: number of nodes, tokens and root
+    :param dependents: array of candidate arc dependents
+    :param heads: array of candidate arc heads
+    :param scores: array of candidate arc scores; NaN arcs, loops and arcs into the root are left out
+    :param root: root node
+    :return: <sources, targets, weights> arrays, the candidate arcs first and the n-1 fallback arcs last
+    """
+    dependents, heads = np.asarray(dependents, dtype=np.int64), np.asarray(heads, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    keep = ~np.isnan(scores) & (dependents != heads) & (dependents != root)
+    dependents, heads, scores = dependents[keep], heads[keep], scores[keep]
+
+    low, high = (scores.min(), scores.max()) if len(scores) else (0.0, 0.0)
+    fallback = np.delete(np.arange(n), root)
+
+    sources = np.concatenate([heads, np.full(len(fallback), root)])
+    targets = np.concatenate([dependents, fallback])
+    weights = np.concatenate([-scores, np.full(len(fallback), -low + n * (high - low) + 1.0)])
+
+    return sources, targets, weights
+
+
+def decode_arcs(n, dependents, heads, scores, root=0):
+    """Maximum spanning tree over candidate arcs only, in O(m log n) for m arcs instead of O(n^2).
+
+    Every token also gets a fallback arc from the root, see candidate_edges: tokens without any incoming candidate arc,
+    or only reachable through a cycle of candidate arcs, are attached to the root, and all other tokens get their
+    heads from the candidate arcs.
+
+    :param n: number of nodes, tokens and root
+    :param dependents: array of candidate arc dependents
+    :param heads: array of candidate arc heads
+    :param scores: array of candidate arc scores; NaN arcs are left out
+    :param root: root node
+    :return: list of n heads, -1 for the root
+    """
+    return mst_edges(n, *candidate_edges(n, dependents, heads, scores, root), root)
+
+
+def arcs_from_matrix(M):
+    """Candidate arcs of an (n+1 x n+1) score matrix with dependents on rows and heads on columns: its non-NaN cells.
+
+    :return: <n+1, dependents, heads, scores> 4-tuple, as taken by decode_arcs
+    """
+    dependents, heads = np.nonzero(~np.isnan(M))
+    return M.shape[0], dependents, heads, M[dependents, heads]
+
+
+def arcs_from_arc_list(arcs, num_nodes):
+    """Candidate arcs from a list of arc.Arc objects (u the head, v the dependent), as built by ilp_decode.py.
+
+    :return: <n+1, dependents, heads, scores> 4-tuple, as taken by decode_arcs
+    """
+    return (num_nodes, np.array([arc.v for arc in arcs], dtype=np.int64),
+            np.array([arc.u for arc in arcs], dtype=np.int64), np.array([arc.weight for arc in arcs]))
 
 
 def mdst(M, column_heads=True, ranking=False, maximum=True, greedy=False):
@@ -171,19 +268,16 @@ def mdst(M, column_heads=True, ranking=False, maximum=True, greedy=False):
             if M[i][0] < min:
                 min = M[i][0]
                 index = i
-        #print 'min', min 
+        #print 'min', min
         for i in range(M.shape[0]):
             if i == index:
                 M[i][0] = -100000.0
             else:
                 M[i][0] = 0.0
+    # edge u -> v weighs M[v][u] (dependents on rows), over as many vertices as there are columns
     if column_heads:
-        vertices = contract(M.transpose(), ranking)
+        W = M.transpose()
     else:
-        vertices = contract(M, ranking)
-    return expand(vertices)
-
-
-if __name__ == "__main__":
-    print
-    'other testing script...'
+        W = M
+    dim = W.shape[0]
+    return mst(W[:dim, :dim])[1:]
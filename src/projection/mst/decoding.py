@@ -0,0 +1,135 @@
+# Decoding engines for (n+1 x n+1) score matrices, dependents on rows and heads on columns, and batched decoding
+# of many sentences at once over a process or thread pool.
+import itertools
+import multiprocessing
+from contextlib import contextmanager
+from functools import partial
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from dependency_decoding import chu_liu_edmonds
+from mst.eisner import eisner
+from mst.cle import decode_arcs, arcs_from_matrix
+from mst.kbest import kbest_arcs
+
+
+def decode_cle(M):
+    """Non-projective decoding, maximum spanning tree by Chu-Liu-Edmonds.
+
+    :param M: (n+1 x n+1) score matrix
+    :return: list of n+1 heads, -1 for the root
+    """
+    heads, _ = chu_liu_edmonds(M)
+    return heads
+
+
+def decode_cle_sparse(M):
+    """Non-projective decoding over the candidate arcs only, tokens without a usable candidate head go to the root.
+
+    :param M: (n+1 x n+1) score matrix whose non-NaN cells are the candidate arcs, or <n+1, dependents, heads, scores>
+    :return: list of n+1 heads, -1 for the root
+    """
+    return decode_arcs(*(arcs_from_matrix(M) if isinstance(M, np.ndarray) else M))
+
+
+def decode_kbest(M, k):
+    """The k best non-projective trees, by Lawler's partitioning over the sparse CLE decoder.
+
+    :param M: (n+1 x n+1) score matrix whose non-NaN cells are the candidate arcs, or <n+1, dependents, heads, scores>
+    :param k: number of trees
+    :return: list of up to k <tree score, list of n+1 heads with -1 for the root> pairs, best first
+    """
+    return kbest_arcs(*(arcs_from_matrix(M) if isinstance(M, np.ndarray) else M), k=k)
+
+
+# available decoding engines by name, Eisner's decoder only produces projective trees, the sparse CLE decoder also
+# takes candidate arcs instead of score matrices
+decoders = {"cle": decode_cle,
+            "cle_sparse": decode_cle_sparse,
+            "eisner": eisner}
+projective_decoders = {"eisner"}
+sparse_decoders = {"cle_sparse"}
+
+# number of sentences decoded at once by decode_stream, bounds the score matrices kept in memory
+DECODE_BATCH_SIZE = 1000
+
+
+def unpad(matrices, lengths):
+    """Turns a padded (b x N x N) array of score matrices into a list of (n+1 x n+1) views, given the lengths n."""
+    return [matrices[b, :length + 1, :length + 1] for b, length in enumerate(lengths)]
+
+
+def create_pool(processes=None, threads=False):
+    """Creates a pool for decode_batch; worker processes are forked, threads suit decoders that release the GIL."""
+    if threads:
+        return ThreadPool(processes)
+    return multiprocessing.get_context("fork").Pool(processes)
+
+
+@contextmanager
+def decoding_pool(processes=None, threads=False):
+    """A pool for decoding over a whole run, see create_pool, or None for decoding in the calling process if
+    processes is 1."""
+    if processes == 1:
+        yield None
+    else:
+        with create_pool(processes, threads) as pool:
+            yield pool
+
+
+def decode_batch(matrices, lengths=None, decoder="cle", pool=None, processes=None, threads=False, chunksize=None):
+    """Decodes many sentences at once, spreading them over a pool of workers.
+
+    :param matrices: list of (n+1 x n+1) score matrices, or a padded (b x N x N) array of them if lengths are given;
+        sparse decoders also take <n+1, dependents, heads, scores> candidate arcs
+    :param lengths: sentence lengths n for a padded array of score matrices
+    :param decoder: name of the decoding engine, see decoders
+    :param pool: pool to decode with, e.g., from create_pool; if None, a pool is created for this call
+    :param processes: number of workers of the created pool, 1 to decode in the calling process
+    :param threads: create a thread pool instead of a process pool
+    :param chunksize: number of sentences sent to a worker at once, chosen by the pool if None
+    :return: list of head lists, one per sentence, -1 for the roots
+    """
+    if lengths is not None:
+        matrices = unpad(matrices, lengths)
+
+    return map_sentences(decoders[decoder], matrices, pool, processes, threads, chunksize)
+
+
+def decode_stream(items, decoder="cle", pool=None, batch_size=DECODE_BATCH_SIZE, chunksize=None):
+    """Decodes a stream of sentences in batches of a fixed size, so that only the score matrices of a single batch are
+    kept in memory, see decode_batch.
+
+    :param items: iterable of <payload, score matrix> pairs, the payload is passed through
+    :param decoder: name of the decoding engine, see decoders
+    :param pool: pool to decode with, e.g., from decoding_pool; if None, the sentences are decoded in this process
+    :param batch_size: number of sentences decoded at once
+    :param chunksize: number of sentences sent to a worker at once, chosen by the pool if None
+    :return: yields <payload, list of heads with -1 for the root> pairs, in the order of the items
+    """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+        all_heads = decode_batch([M for _, M in batch], decoder=decoder, pool=pool, processes=1, chunksize=chunksize)
+        for (payload, _), heads in zip(batch, all_heads):
+            yield payload, heads
+
+
+def decode_kbest_batch(matrices, k, pool=None, processes=None, threads=False, chunksize=None):
+    """Decodes the k best trees of many sentences at once, see decode_batch and decode_kbest.
+
+    :return: list of k-best lists, one per sentence
+    """
+    return map_sentences(partial(decode_kbest, k=k), matrices, pool, processes, threads, chunksize)
+
+
+def map_sentences(decode, matrices, pool=None, processes=None, threads=False, chunksize=None):
+    if pool is not None:
+        return pool.map(decode, matrices, chunksize)
+
+    if processes == 1 or len(matrices) < 2:
+        return [decode(M) for M in matrices]
+
+    with create_pool(processes, threads) as pool:
+        return pool.map(decode, matrices, chunksize)
@@ -0,0 +1,72 @@
+# Projective maximum spanning tree decoding after Eisner (1996), in O(n^3). The spans of each width are computed
+# for all start positions and split points at once, so there are only O(n) Python-level steps.
+import numpy as np
+
+
+def eisner(M):
+    """Best projective tree of an (n+1 x n+1) score matrix, dependents on rows and heads on columns; the root may have
+    several dependents. NaN scores are treated as missing edges.
+
+    :param M: (n+1 x n+1) score matrix
+    :return: list of n+1 heads, -1 for the root
+    """
+    N = M.shape[0]
+    S = np.where(np.isnan(M), -np.inf, M).T.copy()  # S[h, d] is the score of the edge h -> d
+    S[:, 0] = -np.inf  # the root has no head
+
+    # complete (C) and incomplete (I) spans headed by their left (right) or right (left) end, and their split points
+    C_right, C_left, I_right, I_left = (np.full((N, N), -np.inf) for _ in range(4))
+    B_C_right, B_C_left, B_I = (np.zeros((N, N), dtype=int) for _ in range(3))
+    np.fill_diagonal(C_right, 0.0)
+    np.fill_diagonal(C_left, 0.0)
+
+    for width in range(1, N):
+        s = np.arange(N - width)[:, None]
+        t = s + width
+        splits = np.arange(width)[None, :]
+
+        # incomplete spans: s -> t or t -> s over complete spans [s, r] and [r+1, t]
+        r = s + splits
+        scores = C_right[s, r] + C_left[r + 1, t]
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(s)), best]
+        s, t = s[:, 0], t[:, 0]
+        I_right[s, t] = best_scores + S[s, t]
+        I_left[s, t] = best_scores + S[t, s]
+        B_I[s, t] = s + best
+
+        # complete spans headed by s: incomplete [s, r] and complete [r, t]
+        r = s[:, None] + 1 + splits
+        scores = I_right[s[:, None], r] + C_right[r, t[:, None]]
+        best = scores.argmax(axis=1)
+        C_right[s, t] = scores[np.arange(len(s)), best]
+        B_C_right[s, t] = s + 1 + best
+
+        # complete spans headed by t: complete [s, r] and incomplete [r, t]
+        r = s[:, None] + splits
+        scores = C_left[s[:, None], r] + I_left[r, t[:, None]]
+        best = scores.argmax(axis=1)
+        C_left[s, t] = scores[np.arange(len(s)), best]
+        B_C_left[s, t] = s + best
+
+    heads = [-1] * N
+    stack = [(0, N - 1, True, True)]  # span, complete or not, headed by its left end or not
+    while stack:
+        s, t, complete, right = stack.pop()
+        if s == t:
+            continue
+        if complete and right:
+            r = B_C_right[s, t]
+            stack += [(s, r, False, True), (r, t, True, True)]
+        elif complete:
+            r = B_C_left[s, t]
+            stack += [(s, r, True, False), (r, t, False, False)]
+        else:
+            if right:
+                heads[t] = s
+            else:
+                heads[s] = t
+            r = B_I[s, t]
+            stack += [(s, r, True, True), (r + 1, t, True, False)]
+
+    return heads
@@ -0,0 +1,85 @@
+# K-best maximum spanning trees by Lawler's partitioning of the solution space, as used by Camerini et al. (1980):
+# the best tree of a subproblem splits its remaining trees into disjoint subproblems, each with one more tree arc
+# excluded and the preceding tree arcs forced. A subproblem is only decoded once its bound makes it to the top of the
+# queue, the bound being the higher of the cost of its parent tree and of the best in-arc of every dependent.
+import heapq
+import itertools
+import numpy as np
+from mst.cle import mst_edges, candidate_edges
+
+
+def kbest_arcs(n, dependents, heads, scores, k, root=0):
+    """The k highest-scoring spanning trees over candidate arcs, with a fallback arc from the root for every token as
+    in mst.cle.decode_arcs.
+
+    :param n: number of nodes, tokens and root
+    :param dependents: array of candidate arc dependents
+    :param heads: array of candidate arc heads
+    :param scores: array of candidate arc scores; NaN arcs are left out
+    :param k: number of trees
+    :param root: root node
+    :return: list of up to k <tree score, list of n heads with -1 for the root> pairs, best first; fallback arcs add a
+        large negative score
+    """
+    sources, targets, weights = candidate_edges(n, dependents, heads, scores, root)
+
+    # one edge per head and dependent, ordered by dependent: a candidate arc from the root replaces the fallback arc
+    keys = targets * n + sources
+    order = np.lexsort((weights, keys))
+    first = np.append(True, keys[order][1:] != keys[order][:-1])
+    sources, targets, weights = sources[order][first], targets[order][first], weights[order][first]
+    edge_ids = {edge: e for e, edge in enumerate(zip(sources.tolist(), targets.tolist()))}
+    dependent_starts = np.flatnonzero(np.append(True, targets[1:] != targets[:-1]))
+
+    def allowed_edges(forced, excluded):
+        allowed = np.ones(len(weights), dtype=bool)
+        allowed[list(excluded)] = False
+        if forced:
+            allowed &= ~np.isin(targets, targets[list(forced)])
+            allowed[list(forced)] = True
+        return allowed
+
+    def bound(allowed):
+        # every dependent takes its best allowed in-arc, regardless of cycles
+        return np.minimum.reduceat(np.where(allowed, weights, np.inf), dependent_starts).sum()
+
+    def solve(allowed):
+        try:
+            parents = mst_edges(n, sources[allowed], targets[allowed], weights[allowed], root)
+        except ValueError:
+            return None  # some dependent has no allowed head left
+        tree = [edge_ids[(parents[v], v)] for v in range(n) if v != root]
+        return weights[tree].sum(), tree
+
+    counter = itertools.count()
+    queue = []  # items: (cost or cost bound, tie breaker, forced edges, excluded edges, tree edges or None)
+
+    solved = solve(allowed_edges((), ()))
+    if solved is not None:
+        queue.append((solved[0], next(counter), (), (), solved[1]))
+
+    best_trees = []
+    while queue and len(best_trees) < k:
+        cost, _, forced, excluded, tree = heapq.heappop(queue)
+
+        if tree is None:
+            solved = solve(allowed_edges(forced, excluded))
+            if solved is not None:
+                heapq.heappush(queue, (solved[0], next(counter), forced, excluded, solved[1]))
+            continue
+
+        tree_heads = [-1] * n
+        for e in tree:
+            tree_heads[targets[e]] = int(sources[e])
+        best_trees.append((float(-cost), tree_heads))
+
+        # partition the rest of the subproblem: exclude the i-th free tree arc, force the free arcs before it
+        forced_edges = set(forced)
+        free = [e for e in tree if e not in forced_edges]
+        for i, e in enumerate(free):
+            child_forced, child_excluded = forced + tuple(free[:i]), excluded + (e,)
+            child_bound = bound(allowed_edges(child_forced, child_excluded))
+            if child_bound < np.inf:
+                heapq.heappush(queue, (max(cost, child_bound), next(counter), child_forced, child_excluded, None))
+
+    return best_trees
@@ -1,6 +1,4 @@
 import argparse
-from collections import Counter
-import utils.alignments as align
 import utils.conll as conll
 import utils.normalize as norm
 from functools import partial
@@ -9,11 +7,21 @@ import time
 from pathlib import Path
 from scipy import sparse
 import numpy as np
-import pyximport; pyximport.install()
-import utils.project_deps as project
+import utils.alignments as align
+try:
+    import pyximport; pyximport.install()
+    from utils.project_deps import project_dependencies_faster
+except ImportError as error:  # no Cython build available, fall back to the vectorized NumPy projection
+    print("Cython projection unavailable (%s), using the NumPy projection" % error, file=sys.stderr)
+    project_dependencies_faster = align.project_dependencies_vectorized
 from utils.coo_matrix_nocheck import CooMatrix
 import utils.dca as dca
-from dependency_decoding import chu_liu_edmonds
+from utils.alignment_store import open_alignments
+from utils.conll_index import IndexedConllFile
+from utils.graph_store import open_store_for
+from utils.projection import project_sentence, get_aligned_pair, ProjectionWriter
+from utils.projection_files import ShardWriter
+from mst.decoding import decode_batch, decoding_pool, DECODE_BATCH_SIZE
 from mst import cle
 
 start_time = time.time()  # timing the script
@@ -26,6 +34,31 @@ normalizers = {"softmax": None,
                "identity": lambda x: x,
                "standardize": norm.standardize}
 
+# the same normalizers for the sparse source graphs, computed over the entries of each row (CooMatrix)
+sparse_normalizers = {"softmax": None,
+                      "rank": partial(norm.sparse_rank, use_integers=False),
+                      "intrank": partial(norm.sparse_rank, use_integers=True),
+                      "stdev": norm.sparse_stdev_norm,
+                      "identity": lambda x: x,
+                      "standardize": norm.sparse_standardize}
+
+
+def evaluate(evaluated_sentences, pool):
+    """Decodes a batch of evaluated sentences and counts the correct heads.
+
+    :param evaluated_sentences: list of <gold heads, target matrix> pairs
+    :param pool: decoding pool, or None to decode in this process
+    :return: <correct heads, all heads> pair
+    """
+    correct, total = 0, 0
+    all_decoded_heads = decode_batch([T for _, T in evaluated_sentences], pool=pool, processes=1)
+    for (gold_heads, _), decoded_heads in zip(evaluated_sentences, all_decoded_heads):
+        decoded_heads = decoded_heads[1:]
+        correct += sum([gold_head == decoded_head for gold_head, decoded_head in zip(gold_heads, decoded_heads)])
+        total += len(gold_heads)
+    return correct, total
+
+
 parser = argparse.ArgumentParser(description="Projects dependency trees from source to target via word alignments.")
 
 parser.add_argument("--source", required=True, help="source CoNLL file", type=Path)
@@ -41,30 +74,38 @@ parser.add_argument('--binary', required=True, choices=[0, 1], help="use binary
 parser.add_argument('--use_similarity', required=True, choices=[0, 1], help="use word alignment-derived language similarity proxy", type=int)
 parser.add_argument("--stop_after", required=False, help="stop after n sentences")
 parser.add_argument("--temperature", required=False, help="softmax temperature", type=float, default=1.0)
+parser.add_argument("--sparse_output", action="store_true", help="write head:score pairs for the projected cells "
+                                                                  "instead of full weight matrix rows")
+parser.add_argument("--streaming", action="store_true", help="read source sentences on demand through a sentence "
+                                                              "index instead of preloading")
+parser.add_argument("--processes", required=False, help="number of processes for decoding in the evaluation, "
+                                                         "defaults to all CPUs", type=int)
+parser.add_argument("--decode_batch_size", required=False, help="number of sentences decoded at once in the "
+                                                                "evaluation", type=int, default=DECODE_BATCH_SIZE)
+parser.add_argument("--shard_output", required=False, help="write the projections to a binary .npz shard instead of "
+                                                           "stdout", type=Path)
 
 args = parser.parse_args()
 
-if args.target_gold:
-    target_gold_handle = args.target_gold.open()
-
 source_language_name = args.source.stem.split(".", 1)[0]  # needed to flag the outputs
 
 # set the normalizers
 normalizers['softmax'] = partial(norm.softmax, temperature=args.temperature)  # we get temp from the command line
-normalize_before_projection = normalizers[args.norm_before]
+sparse_normalizers['softmax'] = partial(norm.sparse_softmax, temperature=args.temperature)
+normalize_before_projection = sparse_normalizers[args.norm_before]  # applied to the sparse source graphs
 normalize_after_projection = normalizers[args.norm_after]
 
-assert args.norm_before == "standardize", "standardize!"
 assert args.norm_after == "identity", "thou shalt not normalize after projection!"
 
 # we don't normalize before projection if predicted trees
 # are projected instead of full graphs
 if args.trees or args.dca:
-    normalize_before_projection = normalizers["identity"]
+    normalize_before_projection = sparse_normalizers["identity"]
 
 # choose projection approach; moderated by args.dca
-projectors = {0: project.project_dependencies_faster,
-              1: dca.project}
+# dca projects a head vector (CooMatrix) instead of a dense target matrix, it is always written as head:score pairs
+projectors = {0: project_dependencies_faster,
+              1: dca.project_heads}
 
 project_dependencies = projectors[args.dca]
 
@@ -75,7 +116,8 @@ source_data_getters = {0: conll.get_next_sentence_and_graph,
 get_source_data = source_data_getters[args.trees]
 
 # get the sentence alignments, word alignments, and source-target similarity estimate
-sentence_alignments, word_alignments, similarity = align.read_alignments(args.sentence_alignment, args.word_alignment)
+# (from the alignment store, if there is an up-to-date one)
+sentence_alignments, word_alignments, similarity = open_alignments(args.sentence_alignment, args.word_alignment)
 
 # get the source and target conll file handlers
 source_file_handle = args.source.open()
@@ -88,101 +130,83 @@ target_sid_counter = -1
 num_correct = 0
 num_total = 0
 
-# read all source sentences
-source_sentences = []
-for source_sentence in conll.sentences(source_file_handle, sentence_getter=get_source_data):
-    source_sentences.append(source_sentence)
-
-# load all target gold sentences, if existing (for evaluation purposes)
-target_gold_sentences = []
+# read all source sentences, unless there is an up-to-date graph store of the source file;
+# in streaming mode, the source sentences are read on demand as the sentence alignment refers to them,
+# seeking through the byte-offset sentence index of the source file (built on first use)
+source_sentences = open_store_for(args.source, trees=args.trees)
+if source_sentences is None and args.streaming:
+    source_sentences = IndexedConllFile(args.source, sentence_getter=get_source_data)
+elif source_sentences is None:
+    source_sentences = []
+    for source_sentence in conll.sentences(source_file_handle, sentence_getter=get_source_data):
+        source_sentences.append(source_sentence)
+
+# target gold sentences, if existing (for evaluation purposes), are read in step with the target sentences
 if args.target_gold:
-    for target_gold_sentence in conll.sentences(target_gold_handle, sentence_getter=conll.get_next_sentence):
-        target_gold_sentences.append(target_gold_sentence)
-
-for target_sentence in conll.sentences(target_file_handle, sentence_getter=conll.get_next_sentence):
-
-    # used for pivoting the alignments
-    target_sid_counter += 1
-
-    if args.stop_after and int(args.stop_after) == target_sid_counter:
-        break
-
-    # target sentence found in sentence alignment, get source sentence id and confidence
-    if target_sid_counter in sentence_alignments:
-        source_sid, sal_confidence = sentence_alignments[target_sid_counter]
-
-    # if target sentence unmatched, just print out dummy to maintain the number of lines/sentences
-    # unmatched = not in alignment or alignment empty
-    if target_sid_counter not in sentence_alignments \
-            or (target_sid_counter, source_sid) not in word_alignments \
-            or word_alignments[(target_sid_counter, source_sid)] is None:
-        for _ in target_sentence:
-            print("_")
-        print()
-        continue
-
-    # get the word alignments and probabilities for sentence pair
-    walign_pairs, walign_probs = word_alignments[(target_sid_counter, source_sid)]
-
-    # now that the sentence ids match and word alignments are in place,
-    # get the sentence, POS, and graph from the source
-    source_sentence, S_sparse, source_pos_tags = source_sentences[source_sid]  # get_source_data(source_file_handle)
-    if not args.trees:
-        S_sparse.standardize()
-
-    # source matrix normalization
-    # S = np.full(S_sparse.shape, fill_value=np.nan)
-    # S[S_sparse.row, S_sparse.col] = S_sparse.data
-    # S = normalize_before_projection(S)
-    # non_nan_mask = np.argwhere(~np.isnan(S))
-    # rows = non_nan_mask[:, 0]
-    # cols = non_nan_mask[:, 1]
-    # S_sparse = CooMatrix(rows, cols, S[rows, cols], S.shape)
-
-    # project parts of speech and dependency labels
-    P = align.project_token_labels(source_pos_tags, walign_pairs, walign_probs)
-    # L = align.project_token_labels(source_dep_labels, walign_pairs, walign_probs)
-
-    # project the dependencies from source to target
-    m = len(source_sentence)
-    n = len(target_sentence)
-
-    # the +1 in the dimensions accommodates for the pseudo-roots
-    A_sparse = align.get_alignment_matrix((m + 1, n + 1), walign_pairs, walign_probs, args.binary)
-    T = project_dependencies(S_sparse, A_sparse)  # We now use sparse matrices
-
-    # normalize the target matrix
-    T = normalize_after_projection(T)
-
-    # TODO Do we need to verify whether this is a good proxy for language similarity?
-    # TODO: Should we think about when we apply the language pair similarity?
-    # apply the pair similarity factor
-    if args.use_similarity:
-        T *= similarity
-
-    # if there is a gold file, perform evaluation
-    if args.target_gold and target_sid_counter < len(target_gold_sentences):
-        gold_heads = [token.head for token in target_gold_sentences[target_sid_counter]]
-        decoded_heads, _ = chu_liu_edmonds(T)
-        decoded_heads = decoded_heads[1:]
-        num_correct += sum([gold_head == decoded_head for gold_head, decoded_head in zip(gold_heads, decoded_heads)])
-        num_total += len(gold_heads)
-
-    # speed-up for the intrinsic evaluation, skips the rest of the projection
-    elif args.target_gold:
-        break
-
-    # print the results
-    for token in target_sentence:
-        # get the POS projections for the current target token
-        # if there are no projections, propagate the dummy tag
-        projected_tags = P.get(token.idx) if token.idx in P else Counter({"_": 0})
-        # projected_labels = L.get(token.idx) if token.idx in L else Counter({"_": 0})
-
-        print("%s\t%s\t%s" % (source_language_name,
-                              " ".join(["{}:{}".format(t[0], t[1]) for t in projected_tags.most_common()]),
-                              # " ".join(["{}:{}".format(l[0], l[1]) for l in projected_labels.most_common()]),
-                              " ".join(map(str, T[token.idx]))))
-    print()
+    target_gold_sentences = conll.SentenceCursor(args.target_gold, sentence_getter=conll.get_next_sentence)
+    evaluated_sentences = []  # items: (gold heads, target matrix), decoded a batch at a time
+
+# buffered output, written through in large chunks, or collected into a binary shard
+if args.shard_output:
+    writer = ShardWriter(args.shard_output)
+else:
+    writer = ProjectionWriter(sys.stdout, sparse=args.sparse_output)
+
+# the gold evaluation decodes a batch of sentences at a time, on a single pool for the whole run; the writer is
+# closed at the end, a binary shard is only written if the projection completes
+with writer, decoding_pool(args.processes if args.target_gold else 1) as pool:
+    for target_sentence in conll.sentences(target_file_handle, sentence_getter=conll.get_next_sentence):
+
+        # used for pivoting the alignments
+        target_sid_counter += 1
+
+        if args.stop_after and int(args.stop_after) == target_sid_counter:
+            break
+
+        # target sentence found in sentence alignment, get source sentence id and word alignments
+        aligned_pair = get_aligned_pair(target_sid_counter, sentence_alignments, word_alignments)
+
+        # if target sentence unmatched, just print out dummy to maintain the number of lines/sentences
+        if aligned_pair is None:
+            writer.write_dummy_sentence(target_sentence)
+            continue
+
+        source_sid, walign_pairs, walign_probs = aligned_pair
+
+        # now that the sentence ids match and word alignments are in place,
+        # get the sentence, POS, and graph from the source
+        source_sentence, S_sparse, source_pos_tags = source_sentences[source_sid]  # get_source_data(source_file_handle)
+
+        # source matrix normalization, directly on the sparse graph
+        S_sparse = normalize_before_projection(S_sparse)
+
+        # project parts of speech and dependencies from source to target, and normalize the target matrix
+        # TODO Do we need to verify whether this is a good proxy for language similarity?
+        # TODO: Should we think about when we apply the language pair similarity?
+        P, T = project_sentence(len(target_sentence), S_sparse, source_pos_tags, walign_pairs, walign_probs,
+                                project_dependencies, binary=args.binary, normalize_after=normalize_after_projection,
+                                similarity=similarity if args.use_similarity else None)
+
+        # if there is a gold file, perform evaluation
+        if args.target_gold and target_gold_sentences.get(target_sid_counter) is not None:
+            gold_heads = [token.head for token in target_gold_sentences[target_sid_counter]]
+            evaluated_sentences.append((gold_heads, T.toarray(fill_value=np.nan) if args.dca else T))
+            if len(evaluated_sentences) == args.decode_batch_size:
+                batch_correct, batch_total = evaluate(evaluated_sentences, pool)
+                num_correct += batch_correct
+                num_total += batch_total
+                evaluated_sentences = []
+
+        # speed-up for the intrinsic evaluation, skips the rest of the projection
+        elif args.target_gold:
+            break
+
+        # print the results
+        writer.write_projected_sentence(source_language_name, target_sentence, P, T)
+
+    if args.target_gold and evaluated_sentences:
+        batch_correct, batch_total = evaluate(evaluated_sentences, pool)
+        num_correct += batch_correct
+        num_total += batch_total
 
 print("Execution time:", (time.time() - start_time), "Correct vs. total:", num_correct, num_total, file=sys.stderr)
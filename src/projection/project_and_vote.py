@@ -0,0 +1,184 @@
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+import utils.conll as conll
+import utils.alignments as align
+import utils.normalize as norm
+import utils.score as score
+try:
+    import pyximport; pyximport.install()
+    from utils.project_deps import project_dependencies_fused
+except ImportError as error:  # no Cython build available, fall back to the vectorized NumPy projection
+    print("Cython projection unavailable (%s), using the NumPy projection" % error, file=sys.stderr)
+    project_dependencies_fused = align.project_dependencies_fused_vectorized
+from utils.alignment_store import open_alignments
+from utils.graph_store import open_store_for
+from utils.projection import get_aligned_pair
+from utils.projection_files import SentenceProjection
+from utils.voting import eliminate_all_nan_rows, vote_pos_tags, mean_coverage, format_voted_sentence, TopSentences
+from mst.decoding import decode_stream, decoding_pool, decoders, DECODE_BATCH_SIZE
+
+# Projects all sources onto the target and votes in a single pass, equivalent to running project.py for each source
+# and vote_pos_and_deps.py on the projection files, but without writing, reading, or stacking the projections:
+# the voted weight matrix of each target sentence is accumulated directly by the fused projection kernel.
+
+start_time = time.time()  # timing the script
+
+
+def language_name(conll_file):
+    return conll_file.stem.split(".", 1)[0]
+
+
+def read_source(source_file, trees):
+    """Reads the sentences, graphs (standardized) or trees, and POS tags of a source file, from its graph store if
+    there is an up-to-date one.
+    """
+    source_sentences = open_store_for(source_file, trees=trees, standardize=not trees)
+    if source_sentences is not None:
+        return source_sentences
+
+    source_data_getter = conll.get_next_sentence_and_tree if trees else conll.get_next_sentence_and_graph
+    with source_file.open() as source_file_handle:
+        source_sentences = list(conll.sentences(source_file_handle, sentence_getter=source_data_getter))
+
+    if not trees:
+        for _, graph, _ in source_sentences:
+            graph.standardize()
+
+    return source_sentences
+
+
+parser = argparse.ArgumentParser(description="Fused projection from multiple sources, voting, and CLE decoding.")
+
+parser.add_argument("--target", required=True, help="target CoNLL file", type=Path)
+parser.add_argument("--sources", required=True, help="source CoNLL files", type=Path, nargs="+")
+parser.add_argument("--corpus", required=True, help="name of corpus, e.g., bible or watchtower")
+parser.add_argument("--walign_dir", required=True, help="directory with word alignment files", type=Path)
+parser.add_argument("--salign_dir", required=True, help="directory with sentence alignment files", type=Path)
+parser.add_argument("--aligner", required=False, help="word aligner", default="ibm1")
+parser.add_argument('--trees', required=True, choices=[0, 1], help="project dependency trees instead of weight matrices", type=int)
+parser.add_argument('--binary', required=True, choices=[0, 1], help="use binary alignments instead of alignment probabilities", type=int)
+parser.add_argument('--use_similarity', required=True, choices=[0, 1], help="use word alignment-derived language similarity proxy", type=int)
+parser.add_argument("--stop_after", required=False, help="stop after n sentences", type=int)
+parser.add_argument('--unit_vote_pos', required=True, choices=[0, 1], help="use unit votes for POS tag voting", type=int)
+parser.add_argument('--pretagged', action='store_true', help="use preassigned target POS tags instead of voted tags")
+parser.add_argument('--skip_untagged', action='store_true', help="skip sentences with untagged tokens")
+parser.add_argument('--decode', action='store_true', help="perform CLE decoding")
+parser.add_argument("--decoder", required=False, choices=decoders.keys(), default="cle",
+                    help="decoding engine: non-projective CLE, CLE over the candidate arcs only, or projective Eisner")
+parser.add_argument("--select_top", required=True, help="take n best sentences by mean coverage", type=int)
+parser.add_argument("--processes", required=False, help="number of decoding processes, defaults to all CPUs", type=int)
+parser.add_argument("--decode_batch_size", required=False, help="number of sentences decoded at once", type=int,
+                    default=DECODE_BATCH_SIZE)
+
+args = parser.parse_args()
+
+pos_vote_casts = {1: math.ceil,
+                  0: lambda x: x}
+pos_vote_caster = pos_vote_casts[args.unit_vote_pos]
+
+target_language_name = language_name(args.target)
+
+# read each source and its alignments with the target once
+sources = []  # items: (source language, source sentences, sentence alignments, word alignments, similarity)
+for source_file in args.sources:
+    source_language_name = language_name(source_file)
+    if source_language_name == target_language_name:
+        continue
+    pair = "{}-{}".format(source_language_name, target_language_name)
+    sentence_alignments, word_alignments, similarity = open_alignments(
+        args.salign_dir / "{}.{}.sal".format(pair, args.corpus),
+        args.walign_dir / "{}.{}.{}.reverse.wal".format(pair, args.corpus, args.aligner))
+    sources.append((source_language_name, read_source(source_file, args.trees),
+                    sentence_alignments, word_alignments, similarity))
+
+print("Reading time:", (time.time() - start_time), file=sys.stderr)
+
+scorer = score.TokenScorer()  # for scoring
+
+selected_sentences = TopSentences(args.select_top)  # the best sentences by mean coverage, for --select_top
+
+
+def voted_sentences():
+    """Yields the voted sentences of the target, <sentence, POS tags, mean coverage> with the normalized weight
+    matrix, for decode_stream.
+    """
+    sentence_count = 0
+
+    with args.target.open() as target_file_handle:
+        for target_sid, current_sentence in enumerate(conll.sentences(target_file_handle,
+                                                                      sentence_getter=conll.get_next_sentence)):
+            token_ids = [token.idx for token in current_sentence]
+
+            # project the POS tags of the aligned sources, and collect their graphs and alignment matrices
+            contributing_projections = []
+            source_graphs, alignment_matrices, source_weights = [], [], []
+
+            for source_language_name, source_sentences, sentence_alignments, word_alignments, similarity in sources:
+                aligned_pair = get_aligned_pair(target_sid, sentence_alignments, word_alignments)
+                if aligned_pair is None:
+                    continue
+
+                source_sid, walign_pairs, walign_probs = aligned_pair
+                _, S_sparse, source_pos_tags = source_sentences[source_sid]
+
+                P = align.project_token_labels(source_pos_tags, walign_pairs, walign_probs)
+                pos_votes = [P[token_id].most_common() if token_id in P else [("_", 0)] for token_id in token_ids]
+                contributing_projections.append(SentenceProjection(source_language_name, pos_votes, None, None, None))
+
+                source_graphs.append(S_sparse)
+                alignment_matrices.append(align.get_alignment_matrix((S_sparse.shape[0], len(current_sentence) + 1),
+                                                                     walign_pairs, walign_probs, args.binary))
+                source_weights.append(similarity if args.use_similarity else 1.0)
+
+            # skip sentences if none of the source languages contributed any projections
+            if not contributing_projections:
+                continue
+
+            # voting for tags
+            current_pos_tags, current_number_of_unaligned_tokens = vote_pos_tags(contributing_projections,
+                                                                                 len(current_sentence), pos_vote_caster)
+
+            its_mean_coverage = mean_coverage(len(sources), len(current_sentence), current_number_of_unaligned_tokens)
+
+            # skip sentences with at least one placeholder "_" POS tag
+            if args.skip_untagged and "_" in current_pos_tags:
+                continue
+
+            sentence_count += 1
+
+            # sum the projected source matrices into a single matrix, the root is not a dependent
+            voted_matrix = project_dependencies_fused(source_graphs, alignment_matrices, source_weights)
+            voted_matrix[0] = 0.0
+
+            # per-row normalize using softmax
+            current_sentence_matrix = norm.softmax(voted_matrix)
+            eliminate_all_nan_rows(current_sentence_matrix)
+
+            yield (current_sentence, current_pos_tags, its_mean_coverage), current_sentence_matrix
+
+            if args.stop_after and args.stop_after == sentence_count:
+                break
+
+
+# decode a batch of the voted sentences at a time, on a single pool for the whole run
+with decoding_pool(args.processes) as pool:
+    if args.decode:
+        decoded_sentences = decode_stream(voted_sentences(), decoder=args.decoder, pool=pool,
+                                          batch_size=args.decode_batch_size)
+    else:
+        decoded_sentences = ((voted_sentence, [-1] + [0 for _ in voted_sentence[0]])
+                             for voted_sentence, _ in voted_sentences())
+
+    for (current_sentence, current_pos_tags, its_mean_coverage), decoded_heads in decoded_sentences:
+        current_sentence_string = format_voted_sentence(current_sentence, decoded_heads[1:], current_pos_tags,
+                                                        pretagged=args.pretagged, scorer=scorer)
+        selected_sentences.add(current_sentence_string, its_mean_coverage)
+
+for sentence_string in selected_sentences:
+    print(sentence_string)
+
+print("Scores:", " ".join(map(str, scorer.get_score_list())), file=sys.stderr)
+print("Execution time: %s sec" % (time.time() - start_time), file=sys.stderr)
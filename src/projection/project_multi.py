@@ -0,0 +1,201 @@
+import argparse
+from functools import partial
+import itertools
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+import utils.conll as conll
+import utils.alignments as align
+try:
+    import pyximport; pyximport.install()
+    from utils.project_deps import project_dependencies_batch
+except ImportError as error:  # no Cython build available, fall back to the vectorized NumPy projection
+    print("Cython projection unavailable (%s), using the NumPy projection" % error, file=sys.stderr)
+    project_dependencies_batch = align.project_dependencies_batch_vectorized
+import utils.dca as dca
+from utils.alignment_store import open_alignments
+from utils.graph_store import open_store_for
+from utils.projection import project_sentence_batch, get_aligned_pair, ProjectionWriter
+from utils.projection_files import ShardWriter
+
+start_time = time.time()  # timing the script
+
+
+def project_dca_batch(source_graphs, alignment_matrices):
+    return [dca.project_heads(S_sparse, A_sparse) for S_sparse, A_sparse in zip(source_graphs, alignment_matrices)]
+
+
+# choose projection approach; moderated by --dca
+projectors = {0: project_dependencies_batch,
+              1: project_dca_batch}
+
+# inputs parsed once in the main process, shared with the forked workers
+shared = {}
+
+
+def language_name(conll_file):
+    return conll_file.stem.split(".", 1)[0]
+
+
+def projection_filename(source, target, corpus, aligner, trees, binary, similarity, dca_flag, shard=False):
+    """Mirrors the output naming of run/project.sh, so that the voting commands remain unchanged.
+    Binary shards get an additional .npz suffix.
+    """
+    filename = "{}-{}.corpus_{}.aligner_{}.trees_{}.binary_{}.similarity_{}".format(source, target, corpus, aligner,
+                                                                                   trees, binary, similarity)
+    if dca_flag:
+        filename += ".dca_1"
+    return filename + (".proj.npz" if shard else ".proj")
+
+
+def read_source(source_file):
+    """Reads a source file once, keeping both the parser graphs and the one-hot trees.
+    If the source file has an up-to-date graph store, the sentences are served from the store instead.
+
+    :param source_file: augmented CoNLL file of the source language
+    :return: {0: sequence of <sentence, standardized graph, POS>, 1: sequence of <sentence, tree, POS>}
+    """
+    graph_store = open_store_for(source_file, standardize=True)
+    if graph_store is not None:
+        return {0: graph_store, 1: open_store_for(source_file, trees=True)}
+
+    graphs = []
+    trees = []
+    with source_file.open() as source_file_handle:
+        for sentence, graph, pos_tags in conll.sentences(source_file_handle,
+                                                         sentence_getter=conll.get_next_sentence_and_graph):
+            graph.standardize()
+            graphs.append((sentence, graph, pos_tags))
+            trees.append((sentence, conll.get_tree_graph(sentence), pos_tags))
+    return {0: graphs, 1: trees}
+
+
+def project_pair(task):
+    """Projects all target sentences from a single source, for a single configuration.
+
+    :param task: <source language, aligner, trees, binary> 4-tuple
+    :return: <output file, number of projected sentences, execution time> 3-tuple
+    """
+    task_start_time = time.time()
+    source_language_name, aligner, trees, binary = task
+    args = shared["args"]
+
+    source_sentences = shared["sources"][source_language_name][trees]
+    sentence_alignments, word_alignments, similarity = shared["alignments"][(source_language_name, aligner)]
+    project_dependencies = projectors[args.dca]
+    if not args.dca:
+        project_dependencies = partial(project_dependencies, num_threads=args.threads)
+
+    output_file = args.out_dir / projection_filename(source_language_name, shared["target_language_name"],
+                                                     args.corpus, aligner, trees, binary, args.use_similarity, args.dca,
+                                                     shard=args.shard_output)
+    num_projected = 0
+
+    # the writers leave no output file behind if the projection fails
+    if args.shard_output:
+        writer = ShardWriter(output_file)
+    else:
+        writer = ProjectionWriter(output_file, sparse=args.sparse_output)
+
+    with writer:
+        # the target sentences are projected in batches, with a single call of the projection function per batch
+        target_sentences = shared["target_sentences"]
+        for batch_begin in range(0, len(target_sentences), args.batch_size):
+            batch_sids = range(batch_begin, min(batch_begin + args.batch_size, len(target_sentences)))
+            aligned_pairs = [get_aligned_pair(target_sid, sentence_alignments, word_alignments)
+                             for target_sid in batch_sids]
+
+            batch = []
+            for target_sid, aligned_pair in zip(batch_sids, aligned_pairs):
+                if aligned_pair is not None:
+                    source_sid, walign_pairs, walign_probs = aligned_pair
+                    _, S_sparse, source_pos_tags = source_sentences[source_sid]
+                    batch.append((len(target_sentences[target_sid]), S_sparse, source_pos_tags,
+                                  walign_pairs, walign_probs))
+
+            projections = iter(project_sentence_batch(batch, project_dependencies, binary=binary,
+                                                      similarity=similarity if args.use_similarity else None))
+
+            for target_sid, aligned_pair in zip(batch_sids, aligned_pairs):
+                if aligned_pair is None:
+                    writer.write_dummy_sentence(target_sentences[target_sid])
+                    continue
+
+                P, T = next(projections)
+                writer.write_projected_sentence(source_language_name, target_sentences[target_sid], P, T)
+                num_projected += 1
+
+    return output_file, num_projected, time.time() - task_start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Projects dependency trees from multiple sources to a single target "
+                                                 "via word alignments, for all configurations in a single run.")
+
+    parser.add_argument("--target", required=True, help="target CoNLL file", type=Path)
+    parser.add_argument("--sources", required=True, help="source CoNLL files", type=Path, nargs="+")
+    parser.add_argument("--corpus", required=True, help="name of corpus, e.g., bible or watchtower")
+    parser.add_argument("--walign_dir", required=True, help="directory with word alignment files", type=Path)
+    parser.add_argument("--salign_dir", required=True, help="directory with sentence alignment files", type=Path)
+    parser.add_argument("--out_dir", required=True, help="directory for the projection files", type=Path)
+    parser.add_argument("--aligners", required=False, help="word aligners", nargs="+", default=["ibm1"])
+    parser.add_argument('--trees', required=True, choices=[0, 1], help="project dependency trees instead of weight "
+                                                                       "matrices", type=int, nargs="+")
+    parser.add_argument('--binary', required=True, choices=[0, 1], help="use binary alignments instead of alignment "
+                                                                        "probabilities", type=int, nargs="+")
+    parser.add_argument('--dca', required=False, choices=[0, 1], help="project using dca", type=int, default=0)
+    parser.add_argument('--use_similarity', required=False, choices=[0, 1], help="use word alignment-derived language "
+                                                                                 "similarity proxy", type=int, default=0)
+    parser.add_argument("--sparse_output", action="store_true", help="write head:score pairs for the projected cells "
+                                                                      "instead of full weight matrix rows")
+    parser.add_argument("--shard_output", action="store_true", help="write binary .npz shards instead of text "
+                                                                     "projection files")
+    parser.add_argument("--batch_size", required=False, help="number of target sentences projected per call",
+                        type=int, default=256)
+    parser.add_argument("--threads", required=False, help="number of projection threads per worker process", type=int,
+                        default=1)
+    parser.add_argument("--processes", required=False, help="number of worker processes", type=int, default=None)
+    parser.add_argument("--stop_after", required=False, help="stop after n target sentences", type=int)
+
+    args = parser.parse_args()
+
+    # dca always projects the trees, not the weight matrices
+    if args.dca:
+        args.trees = [1]
+
+    shared["args"] = args
+    shared["target_language_name"] = language_name(args.target)
+
+    # read the target sentences once
+    with args.target.open() as target_file_handle:
+        shared["target_sentences"] = list(itertools.islice(
+            conll.sentences(target_file_handle, sentence_getter=conll.get_next_sentence), args.stop_after))
+
+    # read each source once
+    shared["sources"] = {}
+    for source_file in args.sources:
+        source_language_name = language_name(source_file)
+        if source_language_name == shared["target_language_name"]:
+            continue
+        shared["sources"][source_language_name] = read_source(source_file)
+
+    # read each pair of sentence and word alignments once
+    shared["alignments"] = {}
+    for source_language_name, aligner in itertools.product(shared["sources"], args.aligners):
+        pair = "{}-{}".format(source_language_name, shared["target_language_name"])
+        shared["alignments"][(source_language_name, aligner)] = open_alignments(
+            args.salign_dir / "{}.{}.sal".format(pair, args.corpus),
+            args.walign_dir / "{}.{}.{}.reverse.wal".format(pair, args.corpus, aligner))
+
+    print("Reading time:", (time.time() - start_time), file=sys.stderr)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    tasks = list(itertools.product(shared["sources"], args.aligners, args.trees, args.binary))
+
+    # the workers are forked, so that they share the parsed inputs instead of re-reading them
+    with multiprocessing.get_context("fork").Pool(processes=args.processes) as pool:
+        for output_file, num_projected, task_time in pool.imap_unordered(project_pair, tasks):
+            print(output_file, "Projected sentences:", num_projected, "Execution time:", task_time, file=sys.stderr)
+
+    print("Execution time:", (time.time() - start_time), file=sys.stderr)
@@ -2,40 +2,51 @@ import argparse
 import numpy as np
 from pathlib import Path
 import utils.conll as conll
-from dependency_decoding import chu_liu_edmonds
+from mst.decoding import decode_stream, decoding_pool, decoders, DECODE_BATCH_SIZE
 
 parser = argparse.ArgumentParser(description="Sagae & Lavie (2006) decoding on delexicalized parses of the target.")
 parser.add_argument("--parses", required=True, help="path to individual CoNLL files", type=Path, nargs="+")
+parser.add_argument("--decoder", required=False, choices=decoders.keys(), default="cle",
+                    help="decoding engine: non-projective CLE, CLE over the candidate arcs only, or projective Eisner")
+parser.add_argument("--processes", required=False, help="number of decoding processes, defaults to all CPUs", type=int)
+parser.add_argument("--decode_batch_size", required=False, help="number of sentences decoded at once", type=int,
+                    default=DECODE_BATCH_SIZE)
 
 args = parser.parse_args()
 vote_handles = [projection_file.open() for projection_file in args.parses]
 
-while True:
 
-    # get sentences and trees for all source parses
-    sentences_and_trees = [conll.get_next_sentence_and_tree_old(handle) for handle in vote_handles]
+def voted_sentences():
+    """Yields the sentence tokens with the summed trees of all source parses, for decode_stream."""
+    while True:
 
-    # save the sentence tokens for later printout
-    the_sentence = sentences_and_trees[0][0]
+        # get sentences and trees for all source parses
+        sentences_and_trees = [conll.get_next_sentence_and_tree_old(handle) for handle in vote_handles]
 
-    # we hit EOF
-    if not the_sentence:
-        break
+        # save the sentence tokens for later printout
+        the_sentence = sentences_and_trees[0][0]
 
-    # instantiate the votes graph
-    votes_graph = np.zeros(sentences_and_trees[0][1].shape)
+        # we hit EOF
+        if not the_sentence:
+            break
 
-    # collect the votes
-    for sentence, tree, _ in sentences_and_trees:  # the last item is the list of POS tags
-        votes_graph += tree
+        # instantiate the votes graph
+        votes_graph = np.zeros(sentences_and_trees[0][1].shape)
 
-    # print(votes_graph)
-    # run MST to get heads
-    decoded_heads, score = chu_liu_edmonds(votes_graph)
+        # collect the votes
+        for sentence, tree, _ in sentences_and_trees:  # the last item is the list of POS tags
+            votes_graph += tree
 
-    it = 1
-    for token in the_sentence:
-        token.head = decoded_heads[it]  # assign the newly-decoded head
-        it += 1
-        print(token)
-    print()
+        yield the_sentence, votes_graph
+
+
+# run MST (or Eisner) to get heads, a batch of sentences at a time
+with decoding_pool(args.processes) as pool:
+    for the_sentence, decoded_heads in decode_stream(voted_sentences(), decoder=args.decoder, pool=pool,
+                                                     batch_size=args.decode_batch_size):
+        it = 1
+        for token in the_sentence:
+            token.head = decoded_heads[it]  # assign the newly-decoded head
+            it += 1
+            print(token)
+        print()
@@ -0,0 +1,50 @@
+import argparse
+import sys
+from collections import defaultdict
+from pathlib import Path
+from utils.alignment_store import open_store_for, alignment_statistics
+
+parser = argparse.ArgumentParser(description="Source reliability table from the alignment stores of all language "
+                                             "pairs, for vote_pos_and_deps.py --aggregate weighted --source_weights.")
+parser.add_argument("--alignments", required=True, nargs="+",
+                    help="sentence and word alignment file pairs, e.g., de-en.bible.sal de-en.bible.ibm1.reverse.wal, "
+                         "with up-to-date alignment stores (python -m utils.alignment_store); the source and target "
+                         "languages are the parts of the word alignment filename before and after the first dash")
+parser.add_argument("--output", required=False, help="output table, defaults to stdout", type=Path)
+args = parser.parse_args()
+
+if len(args.alignments) % 2:
+    parser.error("--alignments takes pairs of sentence and word alignment files")
+
+# the reliability of a source for a target is the similarity estimate that project.py uses, the mean word alignment
+# probability, times the share of target sentences it aligns to at all
+reliabilities = defaultdict(dict)  # target language -> source language -> reliability
+for filename_sa, filename_wa in zip(args.alignments[::2], args.alignments[1::2]):
+    source_language_name, target_language_name = Path(filename_wa).name.split(".", 1)[0].split("-", 1)
+    if source_language_name in reliabilities[target_language_name]:
+        parser.error("%s-%s is given more than once" % (source_language_name, target_language_name))
+
+    store = open_store_for(filename_sa, filename_wa)
+    if store is None:
+        parser.error("no up-to-date alignment store for %s, convert it with python -m utils.alignment_store" %
+                     filename_wa)
+    statistics = alignment_statistics(store)
+
+    reliabilities[target_language_name][source_language_name] = statistics["similarity"] * statistics["aligned_share"]
+
+    print("%s-%s\t%s" % (source_language_name, target_language_name,
+                         " ".join("%s=%s" % item for item in sorted(statistics.items()))), file=sys.stderr)
+
+# scaled to a mean of 1 per target, the weight of sources that are not in the table
+lines = []
+for target_language_name, target_reliabilities in sorted(reliabilities.items()):
+    mean_reliability = sum(target_reliabilities.values()) / len(target_reliabilities)
+    lines.extend("%s %s %r\n" % (source_language_name, target_language_name,
+                                 reliability / mean_reliability if mean_reliability else 1.0)
+                 for source_language_name, reliability in sorted(target_reliabilities.items()))
+
+if args.output:
+    with args.output.open("w") as output_file:
+        output_file.writelines(lines)
+else:
+    sys.stdout.writelines(lines)
@@ -0,0 +1,38 @@
+# Reference decoders by exhaustive search, for sentences of a few tokens only.
+import itertools
+import numpy as np
+from utils.is_projective import is_projective
+
+
+def is_tree(heads):
+    """Whether every token of a list of n+1 heads (the root first) reaches the root without a cycle."""
+    for token in range(1, len(heads)):
+        seen = set()
+        while token != 0:
+            if token in seen:
+                return False
+            seen.add(token)
+            token = heads[token]
+    return True
+
+
+def trees(n, projective=False):
+    """All dependency trees over n tokens, as lists of n+1 heads with -1 for the root."""
+    for token_heads in itertools.product(range(n + 1), repeat=n):
+        heads = [-1] + list(token_heads)
+        if any(head == token for token, head in enumerate(heads)) or not is_tree(heads):
+            continue
+        if projective and not is_projective(token_heads):
+            continue
+        yield heads
+
+
+def tree_score(M, heads):
+    """Score of a tree under an (n+1 x n+1) score matrix, dependents on rows and heads on columns."""
+    return sum(M[token, head] for token, head in enumerate(heads) if token)
+
+
+def best_tree_score(M, projective=False):
+    """Highest score of any (projective) tree that only uses the non-NaN cells of a score matrix."""
+    scores = [tree_score(M, heads) for heads in trees(M.shape[0] - 1, projective=projective)]
+    return np.nanmax(scores)
@@ -0,0 +1,5 @@
+# The modules are imported as the scripts import them, relative to src/projection.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,53 @@
+import numpy as np
+import utils.alignments as align
+from utils.alignment_store import convert, open_alignments, open_store_for
+from utils.projection import get_aligned_pair
+
+
+def write_alignments(random, filename_sa, filename_wa, number_of_lines):
+    """Random hunalign and efmaral files, with repeated target sentences and empty word alignments."""
+    with filename_sa.open("w") as sa_file, filename_wa.open("w") as wa_file:
+        for _ in range(number_of_lines):
+            print(random.randint(20), random.randint(20), "%.3f" % random.rand(), file=sa_file)
+            links = ["%d-%d %.2f" % (random.randint(10), random.randint(10), random.rand())
+                     for _ in range(random.choice([0, 1, 5]))]
+            print(" ".join(links), file=wa_file)
+
+
+def test_alignment_store_serves_the_alignment_files(tmp_path):
+    random = np.random.RandomState(3)
+    filename_sa, filename_wa = tmp_path / "xx-yy.bible.sal", tmp_path / "xx-yy.bible.ibm1.reverse.wal"
+    write_alignments(random, filename_sa, filename_wa, number_of_lines=60)
+
+    sentence_alignments, word_alignments, similarity = align.read_alignments(filename_sa, filename_wa)
+    assert open_store_for(filename_sa, filename_wa) is None
+    convert(filename_sa, filename_wa)
+    store_sentence_alignments, store_word_alignments, store_similarity = open_alignments(filename_sa, filename_wa)
+
+    assert np.isclose(store_similarity, similarity)
+    for target_sid in range(25):
+        assert (target_sid in store_sentence_alignments) == (target_sid in sentence_alignments)
+        if target_sid not in sentence_alignments:
+            continue
+        source_sid, confidence = store_sentence_alignments[target_sid]
+        assert source_sid == sentence_alignments[target_sid][0]
+        assert np.isclose(confidence, sentence_alignments[target_sid][1])
+
+        aligned_pair = get_aligned_pair(target_sid, sentence_alignments, word_alignments)
+        store_aligned_pair = get_aligned_pair(target_sid, store_sentence_alignments, store_word_alignments)
+        assert (store_aligned_pair is None) == (aligned_pair is None)
+        if aligned_pair is not None:
+            assert store_aligned_pair[0] == aligned_pair[0]
+            assert store_aligned_pair[1].tolist() == [list(pair) for pair in aligned_pair[1]]
+            assert np.allclose(store_aligned_pair[2], aligned_pair[2])
+
+
+def test_alignment_store_goes_stale_with_its_files(tmp_path):
+    random = np.random.RandomState(4)
+    filename_sa, filename_wa = tmp_path / "xx-yy.bible.sal", tmp_path / "xx-yy.bible.ibm1.reverse.wal"
+    write_alignments(random, filename_sa, filename_wa, number_of_lines=10)
+    convert(filename_sa, filename_wa)
+    assert open_store_for(filename_sa, filename_wa) is not None
+
+    write_alignments(random, filename_sa, filename_wa, number_of_lines=11)
+    assert open_store_for(filename_sa, filename_wa) is None
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from mst import cle
+from brute_force import is_tree, trees, tree_score, best_tree_score
+
+
+def score_matrix(M):
+    """The (n+1 x n+1) score matrix of an (n x n+1) mdst input, with an empty root row."""
+    return np.vstack([np.zeros(M.shape[1]), M])
+
+
+def test_mdst_finds_the_best_tree():
+    random = np.random.RandomState(11)
+    for n in range(1, 6):
+        for _ in range(20):
+            M = random.randn(n, n + 1)
+            heads = [-1] + list(cle.mdst(M))
+            assert is_tree(heads)
+            assert np.isclose(tree_score(score_matrix(M), heads), best_tree_score(score_matrix(M)))
+
+
+def test_mdst_uses_nan_edges_only_if_unavoidable():
+    random = np.random.RandomState(12)
+    for n in range(2, 6):
+        for _ in range(20):
+            M = random.randn(n, n + 1)
+            M[random.rand(n, n + 1) < 0.4] = np.nan
+            M[:, 0] = random.randn(n)  # every token can attach to the root
+            heads = [-1] + list(cle.mdst(M))
+            assert is_tree(heads)
+            assert np.isclose(tree_score(score_matrix(M), heads), best_tree_score(score_matrix(M)))
+
+
+def test_mst_edges_reports_unreachable_vertices():
+    with pytest.raises(ValueError):
+        cle.mst_edges(3, [0, 1], [1, 1], [1.0, 1.0])  # vertex 2 has no in-edge
+
+
+def fallback_tree_key(M, heads):
+    """<number of fallback arcs, negated score> of a tree over the non-NaN cells and fallback arcs from the root,
+    None if it uses any other arc."""
+    arcs = [(token, head) for token, head in enumerate(heads) if token]
+    fallbacks = [head for token, head in arcs if np.isnan(M[token, head])]
+    if any(fallbacks):
+        return None
+    return len(fallbacks), -sum(M[token, head] for token, head in arcs if not np.isnan(M[token, head]))
+
+
+def test_decode_arcs_matches_the_dense_decoder():
+    random = np.random.RandomState(14)
+    for n in range(1, 6):
+        for _ in range(20):
+            M = random.randn(n + 1, n + 1)
+            heads = cle.decode_arcs(*cle.arcs_from_matrix(M))
+            assert is_tree(heads)
+            assert np.isclose(tree_score(M, heads), best_tree_score(M))
+
+
+def test_decode_arcs_attaches_tokens_without_candidates_to_the_root():
+    random = np.random.RandomState(15)
+    for n in range(1, 6):
+        for _ in range(20):
+            M = random.randn(n + 1, n + 1)
+            M[random.rand(n + 1, n + 1) < 0.6] = np.nan
+            heads = cle.decode_arcs(*cle.arcs_from_matrix(M))
+            assert is_tree(heads)
+            keys = [key for key in (fallback_tree_key(M, tree) for tree in trees(n)) if key is not None]
+            best_fallbacks, best_score = min(keys)
+            fallbacks, score = fallback_tree_key(M, heads)
+            assert fallbacks == best_fallbacks and np.isclose(score, best_score)
@@ -0,0 +1,92 @@
+import numpy as np
+from scipy import sparse
+import utils.dca as dca
+from utils.coo_matrix_nocheck import CooMatrix
+
+
+# the list-based projection that project_heads replaced, as it was before
+def reference_remove_dummies(ttree, orig_target_length):
+    intersection = [i for i in range(orig_target_length + 1, len(ttree) + 1) if i in ttree[:orig_target_length]]
+    while len(intersection) > 0:
+        for x in range(orig_target_length, len(ttree)):  # for all dummies
+            for y in range(orig_target_length):  # for all non-dummies
+                if ttree[y] == (x + 1):
+                    ttree[y] = ttree[x]
+        intersection = [i for i in range(orig_target_length + 1, len(ttree) + 1) if i in ttree[:orig_target_length]]
+
+
+def reference_depths(stree):
+    depths = [-10] * len(stree)  # depth of each node in the tree
+    q = []
+    rootindex = stree.index(0)
+    depths[rootindex] = 0
+    for i in range(len(stree)):  # putting children of root onto queue q
+        if stree[i] == (rootindex + 1):
+            q.append(i)
+    while len(q) > 0:
+        curr = q.pop(0)
+        depths[curr] = depths[stree[curr] - 1] + 1
+        for i in range(len(stree)):
+            if stree[i] == (curr + 1):
+                q.append(i)
+    return depths
+
+
+def reference_project(S_sparse, A_sparse_1):
+    A_sparse = A_sparse_1.tocoo(copy=True)
+
+    align_ts = {(x + 1): [] for x in range(A_sparse.shape[1] - 1)}  # remove pseudo-root
+    align_st = {(x + 1): [] for x in range(A_sparse.shape[0] - 1)}
+    for a in range(len(A_sparse.row)):
+        if A_sparse.row[a] > 0:
+            align_st[A_sparse.row[a]].append(A_sparse.col[a])
+            align_ts[A_sparse.col[a]].append(A_sparse.row[a])
+
+    stree = [-20] * len(S_sparse.row)
+    for x in range(len(S_sparse.row)):
+        stree[S_sparse.row[x] - 1] = S_sparse.col[x]
+    depths = reference_depths(stree)
+
+    tlength = A_sparse.shape[1] - 1
+    ttree = [-10] * tlength  # don't include pseudo-root
+    dca.hua_et_al_2005(align_ts, align_st, depths, stree, ttree)
+    reference_remove_dummies(ttree, tlength)
+    T_matrix = np.zeros(pow(tlength + 1, 2))
+    for x in range(tlength):
+        if ttree[x] > -1:
+            T_matrix[((x + 1) * (tlength + 1)) + ttree[x]] = 1
+
+    T_matrix[T_matrix == 0.0] = np.nan
+    return np.ndarray(shape=(tlength + 1, tlength + 1), buffer=T_matrix, dtype=float)
+
+
+def random_source_tree(random, m):
+    """A source tree over m tokens as CooMatrix, the tokens attached in random order below the earlier ones."""
+    order = random.permutation(m) + 1
+    heads = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, m):
+        heads[order[i]] = order[random.randint(i)]
+    return CooMatrix(np.arange(1, m + 1), heads[1:], np.ones(m), (m + 1, m + 1))
+
+
+def random_alignment(random, m, n, density):
+    """A random (m+1 x n+1) alignment matrix, without the root row and column."""
+    sources, targets = np.nonzero(random.rand(m, n) < density)
+    return sparse.coo_matrix((random.rand(len(sources)), (sources + 1, targets + 1)), shape=(m + 1, n + 1))
+
+
+def test_project_heads_matches_the_list_based_projection():
+    random = np.random.RandomState(16)
+    for _ in range(500):
+        m, n = random.randint(1, 10), random.randint(1, 10)
+        S_sparse = random_source_tree(random, m)
+        A_sparse = random_alignment(random, m, n, density=random.choice([0.1, 0.3, 0.6]))
+        assert np.array_equal(dca.project(S_sparse, A_sparse), reference_project(S_sparse, A_sparse), equal_nan=True)
+
+
+def test_source_depths_match_the_breadth_first_depths():
+    random = np.random.RandomState(17)
+    for _ in range(100):
+        m = random.randint(1, 20)
+        stree = random_source_tree(random, m).col.tolist()
+        assert dca.source_depths(np.array(stree)).tolist() == reference_depths(stree)
@@ -0,0 +1,26 @@
+import numpy as np
+from mst.eisner import eisner
+from utils.is_projective import is_projective
+from brute_force import is_tree, tree_score, best_tree_score
+
+
+def test_eisner_finds_the_best_projective_tree():
+    random = np.random.RandomState(13)
+    for n in range(1, 6):
+        for _ in range(20):
+            M = random.randn(n + 1, n + 1)
+            heads = eisner(M)
+            assert heads[0] == -1 and is_tree(heads) and is_projective(heads[1:])
+            assert np.isclose(tree_score(M, heads), best_tree_score(M, projective=True))
+
+
+def test_eisner_leaves_out_nan_edges():
+    random = np.random.RandomState(14)
+    for n in range(2, 6):
+        for _ in range(20):
+            M = random.randn(n + 1, n + 1)
+            M[random.rand(n + 1, n + 1) < 0.4] = np.nan
+            M[:, 0] = random.randn(n + 1)  # every token can attach to the root
+            heads = eisner(M)
+            assert not np.isnan(tree_score(M, heads))
+            assert np.isclose(tree_score(M, heads), best_tree_score(M, projective=True))
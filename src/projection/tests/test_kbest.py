@@ -0,0 +1,20 @@
+import numpy as np
+from mst.cle import arcs_from_matrix
+from mst.kbest import kbest_arcs
+from brute_force import is_tree, trees, tree_score
+
+
+def test_kbest_arcs_finds_the_best_trees_in_order():
+    random = np.random.RandomState(15)
+    for n in range(1, 6):
+        for k in (1, 3, 10):
+            M = random.randn(n + 1, n + 1)
+            best_scores = sorted((tree_score(M, heads) for heads in trees(n)), reverse=True)[:k]
+
+            best_trees = kbest_arcs(*arcs_from_matrix(M), k=k)
+            assert len(best_trees) == len(best_scores)
+            assert len({tuple(heads) for _, heads in best_trees}) == len(best_trees)
+            for (score, heads), best_score in zip(best_trees, best_scores):
+                assert is_tree(heads)
+                assert np.isclose(score, tree_score(M, heads))
+                assert np.isclose(score, best_score)
@@ -0,0 +1,104 @@
+from functools import partial
+import numpy as np
+import utils.normalize as norm
+from utils.coo_matrix_nocheck import CooMatrix
+
+
+# the per-row normalizers that the vectorized ones replaced, as they were before
+def reference_rank(sentence_matrix, use_integers=False):
+    ranked = np.ones_like(sentence_matrix) * np.nan
+
+    # create rankings
+    if use_integers:
+        ranks = range(1, ranked.shape[1] + 1)
+    else:
+        ranks = [(x+1)/ranked.shape[1] for x in range(ranked.shape[1])]
+
+    for it in range(ranked.shape[0]):
+        mappings = dict(zip(sorted(sentence_matrix[it, ]), ranks))
+        for jt in range(ranked.shape[1]):
+            if np.isnan(sentence_matrix[it, jt]):
+                ranked[it, jt] = np.nan
+            else:
+                ranked[it, jt] = mappings[sentence_matrix[it, jt]]
+
+    if not use_integers:
+        return (ranked.T / np.nansum(ranked, axis=1)).T
+
+    return ranked
+
+
+def reference_stdev_norm(sentence_matrix):
+    normalized = np.zeros_like(sentence_matrix)
+
+    for it in range(normalized.shape[0]):
+        stdev = np.std(sentence_matrix[it, ])
+        mean = np.mean(sentence_matrix[it, ])
+        for jt in range(normalized.shape[1]):
+            normalized[it, jt] = min(max((0.5 + sentence_matrix[it, jt] - float(mean)) / float(stdev), 0.0), 1.0)
+
+    return normalized
+
+
+def random_matrix(random, n):
+    """An (n+1 x n+1) weight matrix with many ties."""
+    return random.randint(-3, 4, size=(n + 1, n + 1)) + random.choice([0.0, 0.5], size=(n + 1, n + 1))
+
+
+def test_normalizers_match_the_per_row_normalizers():
+    random = np.random.RandomState(18)
+    for _ in range(50):
+        M = random_matrix(random, random.randint(1, 10))
+        for use_integers in (False, True):
+            assert np.allclose(norm.rank(M, use_integers=use_integers), reference_rank(M, use_integers=use_integers))
+        rows = M.std(axis=1) > 0  # constant rows are NaN in both, with a warning in the reference
+        assert np.allclose(norm.stdev_norm(M)[rows], reference_stdev_norm(M[rows]))
+
+
+def test_rank_leaves_out_nan_cells():
+    random = np.random.RandomState(19)
+    for _ in range(50):
+        n = random.randint(1, 10)
+        M = random_matrix(random, n)
+        M[random.rand(n + 1, n + 1) < 0.3] = np.nan
+        ranked = norm.rank(M, use_integers=True)
+        for row, ranked_row in zip(M, ranked):
+            weights = row[~np.isnan(row)]
+            assert np.array_equal(np.isnan(ranked_row), np.isnan(row))
+            assert np.array_equal(ranked_row[~np.isnan(row)], reference_rank(weights[None, :], use_integers=True)[0])
+
+
+def test_normalize_batch_matches_single_matrices():
+    random = np.random.RandomState(20)
+    matrices = [random.randn(n + 1, n + 1) for n in random.randint(1, 10, size=20)]
+    for normalizer in (norm.softmax, norm.rank, norm.stdev_norm, norm.standardize):
+        for M, normalized in zip(matrices, norm.normalize_batch(normalizer, matrices)):
+            assert np.allclose(normalized, normalizer(M))
+
+
+def random_graph(random, n, density):
+    """A sparse (n+1 x n+1) graph as CooMatrix, its entries in random order and with ties."""
+    row, col = np.nonzero(random.rand(n + 1, n + 1) < density)
+    order = random.permutation(len(row))
+    data = random.randint(-3, 4, size=len(row)) + random.rand(len(row)).round(1)
+    return CooMatrix(row[order], col[order], data, (n + 1, n + 1))
+
+
+def test_sparse_normalizers_match_the_dense_normalizers():
+    random = np.random.RandomState(21)
+    pairs = [(norm.sparse_softmax, norm.softmax),
+             (partial(norm.sparse_rank, use_integers=False), partial(norm.rank, use_integers=False)),
+             (partial(norm.sparse_rank, use_integers=True), partial(norm.rank, use_integers=True)),
+             (norm.sparse_stdev_norm, norm.stdev_norm),
+             (norm.sparse_standardize, norm.standardize)]
+    for _ in range(50):
+        graph = random_graph(random, random.randint(1, 10), density=random.choice([0.2, 0.5, 1.0]))
+        if not len(graph.data):
+            continue
+        dense = graph.toarray(fill_value=np.nan)
+        for sparse_normalizer, normalizer in pairs:
+            with np.errstate(divide="ignore", invalid="ignore"):  # constant rows and graphs
+                expected = normalizer(dense)
+                normalized = sparse_normalizer(graph)
+            assert np.array_equal(normalized.row, graph.row) and np.array_equal(normalized.col, graph.col)
+            assert np.allclose(normalized.toarray(fill_value=np.nan), expected, equal_nan=True)
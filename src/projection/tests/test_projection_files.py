@@ -0,0 +1,117 @@
+from collections import Counter
+import numpy as np
+import pytest
+from utils.conll import ConllToken
+from utils.coo_matrix_nocheck import CooMatrix
+from utils.projection import ProjectionWriter
+from utils.projection_files import read_projections, parse_block_head_scores, ShardWriter
+
+TAGS = ["NOUN", "VERB", "ADJ", "DET"]
+
+
+def random_projections(random, number_of_sentences, head_vectors=False):
+    """Random target sentences with their projections: <target sentence, POS votes, target matrix> triples, the
+    projections None for unmatched sentences. The target matrices have NaN cells, or are head vectors as CooMatrix.
+    """
+    projections = []
+    for _ in range(number_of_sentences):
+        n = random.randint(1, 8)
+        target_sentence = [ConllToken(idx, "w", "_", "X", "X", "_", 0, "_") for idx in range(1, n + 1)]
+        if random.rand() < 0.2:
+            projections.append((target_sentence, None, None))
+            continue
+
+        P = {idx: Counter({tag: random.rand() for tag in random.choice(TAGS, size=random.randint(1, 3))})
+             for idx in range(1, n + 1) if random.rand() < 0.7}
+        if head_vectors:
+            deps = np.flatnonzero(random.rand(n) < 0.7) + 1
+            T = CooMatrix(deps, random.randint(n + 1, size=len(deps)), np.ones(len(deps)), (n + 1, n + 1))
+        else:
+            T = random.randn(n + 1, n + 1)
+            T[random.rand(n + 1, n + 1) < random.choice([0.0, 0.5, 1.0])] = np.nan
+        projections.append((target_sentence, P, T))
+    return projections
+
+
+def write_projections(writer, projections):
+    for target_sentence, P, T in projections:
+        if P is None:
+            writer.write_dummy_sentence(target_sentence)
+        else:
+            writer.write_projected_sentence("xx", target_sentence, P, T)
+
+
+def check_projections(sentence_projections, projections):
+    sentence_projections = list(sentence_projections)
+    assert len(sentence_projections) == len(projections)
+    for sentence_projection, (target_sentence, P, T) in zip(sentence_projections, projections):
+        if P is None:
+            assert sentence_projection is None
+            continue
+
+        assert sentence_projection.language == "xx"
+        assert [[(tag, float(vote)) for tag, vote in votes] for votes in sentence_projection.pos_votes] == \
+            [P[token.idx].most_common() if token.idx in P else [("_", 0.0)] for token in target_sentence]
+
+        M = T.toarray(fill_value=np.nan) if isinstance(T, CooMatrix) else T
+        deps, heads = np.nonzero(~np.isnan(M[1:]))
+        assert np.array_equal(sentence_projection.deps, deps + 1)
+        assert np.array_equal(sentence_projection.heads, heads)
+        assert np.array_equal(sentence_projection.scores, M[deps + 1, heads])
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("head_vectors", [False, True])
+def test_text_projections_round_trip(tmp_path, sparse, head_vectors):
+    projections = random_projections(np.random.RandomState(6), 100, head_vectors=head_vectors)
+    projection_file = tmp_path / "xx-yy.proj"
+    with ProjectionWriter(projection_file, sparse=sparse, buffer_size=1000) as writer:
+        write_projections(writer, projections)
+    check_projections(read_projections(projection_file), projections)
+
+
+
+@pytest.mark.parametrize("buffer_size", [1, 50, 1 << 20])
+@pytest.mark.parametrize("head_vectors", [False, True])
+def test_shard_projections_round_trip(tmp_path, buffer_size, head_vectors):
+    projections = random_projections(np.random.RandomState(8), 100, head_vectors=head_vectors)
+    shard_file = tmp_path / "xx-yy.proj.npz"
+    with ShardWriter(shard_file, buffer_size=buffer_size) as writer:
+        write_projections(writer, projections)
+    assert list(tmp_path.iterdir()) == [shard_file]
+    check_projections(read_projections(shard_file), projections)
+
+
+def test_shard_writer_keeps_the_previous_shard_on_errors(tmp_path):
+    projections = random_projections(np.random.RandomState(9), 10)
+    shard_file = tmp_path / "xx-yy.proj.npz"
+    with ShardWriter(shard_file) as writer:
+        write_projections(writer, projections)
+
+    with pytest.raises(RuntimeError):
+        with ShardWriter(shard_file, buffer_size=1) as writer:
+            write_projections(writer, random_projections(np.random.RandomState(10), 10))
+            raise RuntimeError
+    assert list(tmp_path.iterdir()) == [shard_file]
+    check_projections(read_projections(shard_file), projections)
+
+
+def test_projection_writer_leaves_no_file_behind_on_errors(tmp_path):
+    projections = random_projections(np.random.RandomState(7), 10)
+    projection_file = tmp_path / "xx-yy.proj"
+    with pytest.raises(RuntimeError):
+        with ProjectionWriter(projection_file, buffer_size=1) as writer:
+            write_projections(writer, projections)
+            raise RuntimeError
+    assert not list(tmp_path.iterdir())
+
+
+def test_malformed_head_scores_rows_are_rejected():
+    deps, heads, scores = parse_block_head_scores(["1:0.5 2:nan", "", "0:1.0"])
+    assert deps.tolist() == [1, 3] and heads.tolist() == [1, 0] and scores.tolist() == [0.5, 1.0]
+    with pytest.raises(ValueError, match="Row 2"):
+        parse_block_head_scores(["0.1 0.2 0.3", "0.1 0.2"])
+    with pytest.raises(ValueError, match="Row 1"):
+        parse_block_head_scores(["0.1 x 0.3", "0.1 0.2 0.3"])
+    with pytest.raises(ValueError, match="Row 2"):
+        parse_block_head_scores(["1:0.5", "2:"])
@@ -0,0 +1,84 @@
+from collections import Counter
+import numpy as np
+import pytest
+from utils.conll import ConllToken
+from utils.projection import ProjectionWriter
+from utils.vote_cache import VoteCache
+
+TAGS = ["NOUN", "VERB", "ADJ"]
+
+
+def write_target(target_file, sentence_lengths):
+    with target_file.open("w") as target_file_handle:
+        for length in sentence_lengths:
+            for idx in range(1, length + 1):
+                print(idx, "w", "_", "X", "X", "_", 0, "_", "_", "_", sep="\t", file=target_file_handle)
+            print(file=target_file_handle)
+
+
+def write_source(random, projection_file, language, sentence_lengths):
+    """A random projection file of a source, with unmatched sentences, tokens without POS votes, and tied votes."""
+    with ProjectionWriter(projection_file, sparse=True) as writer:
+        for length in sentence_lengths:
+            target_sentence = [ConllToken(idx, "w", "_", "X", "X", "_", 0, "_") for idx in range(1, length + 1)]
+            if random.rand() < 0.2:
+                writer.write_dummy_sentence(target_sentence)
+                continue
+            P = {idx: Counter({tag: random.choice([0.5, 1.0]) for tag in random.choice(TAGS, size=2)})
+                 for idx in range(1, length + 1) if random.rand() < 0.8}
+            T = random.rand(length + 1, length + 1).round(2)
+            T[random.rand(length + 1, length + 1) < 0.5] = np.nan
+            writer.write_projected_sentence(language, target_sentence, P, T)
+
+
+def check_votes(cache, fresh_cache):
+    assert len(cache) == len(fresh_cache)
+    for sid in range(len(cache)):
+        pos_tags, unaligned, contributors, arcs, _ = cache.sentence_votes(sid)
+        fresh_pos_tags, fresh_unaligned, fresh_contributors, fresh_arcs, _ = fresh_cache.sentence_votes(sid)
+        assert (pos_tags, unaligned, contributors) == (fresh_pos_tags, fresh_unaligned, fresh_contributors)
+        assert np.array_equal(arcs[0], fresh_arcs[0]) and np.array_equal(arcs[1], fresh_arcs[1])
+        assert np.allclose(arcs[2], fresh_arcs[2])
+
+
+@pytest.mark.parametrize("unit_vote_pos", [0, 1])
+def test_incremental_updates_match_a_fresh_vote(tmp_path, unit_vote_pos):
+    random = np.random.RandomState(23)
+    sentence_lengths = random.randint(1, 8, size=30)
+    target_file = tmp_path / "yy.conll"
+    write_target(target_file, sentence_lengths)
+    sources = {}
+    for language in ("aa", "bb", "cc", "dd"):
+        sources[language] = tmp_path / ("%s-yy.proj" % language)
+        write_source(random, sources[language], language, sentence_lengths)
+
+    cache = VoteCache(tmp_path / "cache")
+    steps = [(["aa", "bb"], None),
+             (["aa", "bb", "cc"], None),  # add
+             (["bb", "cc"], None),  # remove
+             (["dd", "cc", "bb", "aa"], None),  # add and rerank
+             (["dd", "cc", "bb", "aa"], {"bb": 2.0, "dd": 0.5}),  # reweight
+             (["cc", "aa"], {"bb": 2.0})]
+    for step, (languages, source_weights) in enumerate(steps):
+        projection_files = [sources[language] for language in languages]
+        cache.update(projection_files, target_file, unit_vote_pos, "cle", source_weights)
+        cache.save()
+
+        fresh_cache = VoteCache(tmp_path / ("fresh_%d" % step))
+        fresh_cache.update(projection_files, target_file, unit_vote_pos, "cle", source_weights)
+        check_votes(cache, fresh_cache)
+        check_votes(VoteCache(tmp_path / "cache"), fresh_cache)  # as saved
+
+
+def test_unsaved_changes_leave_no_cache_behind(tmp_path):
+    random = np.random.RandomState(24)
+    sentence_lengths = random.randint(1, 8, size=10)
+    target_file, projection_file = tmp_path / "yy.conll", tmp_path / "aa-yy.proj"
+    write_target(target_file, sentence_lengths)
+    write_source(random, projection_file, "aa", sentence_lengths)
+
+    cache = VoteCache(tmp_path / "cache")
+    cache.update([projection_file], target_file, 0, "cle")
+    cache.save()
+    cache.update([], target_file, 0, "cle")  # interrupted before saving
+    assert VoteCache(tmp_path / "cache").meta is None
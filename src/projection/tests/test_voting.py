@@ -0,0 +1,19 @@
+import numpy as np
+from utils.voting import TopSentences
+
+
+def test_top_sentences_match_a_stable_sort(tmp_path):
+    random = np.random.RandomState(22)
+    for _ in range(50):
+        scores = random.randint(0, 5, size=random.randint(0, 40)) / 4  # many ties
+        sentences = ["sentence %d\n" % i for i in range(len(scores))]
+        expected = [sentence for sentence, _ in sorted(zip(sentences, scores), key=lambda item: -item[1])]
+
+        for k in (0, 1, 7, 100):
+            for spill_size in (None, 1, 3, 8):
+                top_sentences = TopSentences(k, spill_size=spill_size, spill_dir=tmp_path)
+                for sentence, score in zip(sentences, scores):
+                    top_sentences.add(sentence, score)
+                assert list(top_sentences) == expected[:k]
+                top_sentences.close()
+                assert not list(tmp_path.iterdir())
@@ -0,0 +1,115 @@
+# Aggregation of the projected weight matrices of k sources into a single matrix, for voting. The projections of a
+# sentence are a (n+1 x n+1 x k) tensor with NaN for the cells a source did not project, or a stack of such tensors.
+# All aggregators work on the last axis, and cells without any projection get 0, just like with the plain sum.
+import warnings
+import numpy as np
+import utils.normalize as norm
+
+
+class StackedVotes:
+    """
+    The projected weights of the sources of a sentence, or of a stack of sentences, with the parts that all the
+    aggregators need computed only once: which cells were projected, and the weights with 0 for the others.
+    """
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.projected = ~np.isnan(tensor)
+        self.scores = np.where(self.projected, tensor, 0.0)
+
+    @property
+    def any_projected(self):
+        """Cells projected by at least one source."""
+        return self.projected.any(axis=-1)
+
+
+def sum_votes(votes):
+    """Sum over the sources, as np.nansum."""
+    return votes.scores.sum(axis=-1)
+
+
+def max_votes(votes):
+    """The highest weight of any source."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # cells without projections
+        return np.where(votes.any_projected, np.nanmax(votes.tensor, axis=-1), 0.0)
+
+
+def weighted_votes(votes, weights):
+    """Sum over the sources, weighted by source.
+
+    :param weights: k source weights, in the order of the sources in the tensor
+    """
+    return votes.scores @ np.asarray(weights, dtype=np.float64)
+
+
+def threshold_votes(votes, threshold=0.1, binary=False):
+    """Sum over the source weights of at least the threshold, or the number of such weights if binary."""
+    above = votes.projected & (votes.scores >= threshold)
+    if binary:
+        return above.sum(axis=-1).astype(np.float64)
+    return np.where(above, votes.scores, 0.0).sum(axis=-1)
+
+
+def rank_votes(votes):
+    """Sum over the per-row rank normalized weights of the sources, see utils.normalize.rank, i.e., a Borda count of
+    the candidate heads of every dependent."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # dependents without projections
+        ranked = np.swapaxes(norm.rank(np.swapaxes(votes.tensor, -1, -2)), -1, -2)
+    return np.nan_to_num(ranked, nan=0.0).sum(axis=-1)
+
+
+def standardized_votes(votes):
+    """Sum over the weights standardized by the mean and standard deviation of all weights of a sentence."""
+    axes = (-3, -2, -1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # sentences without projections
+        standardized = (votes.tensor - np.nanmean(votes.tensor, axis=axes, keepdims=True)) / \
+            np.nanstd(votes.tensor, axis=axes, keepdims=True)
+    return np.where(votes.projected, standardized, 0.0).sum(axis=-1)
+
+
+def read_source_weights(weights_file, target_language):
+    """Reads the source weights for a target language from a table with a "source target weight" triple per line,
+    e.g., the source reliability table of source_reliability.py.
+
+    :param weights_file: path to the weights file
+    :param target_language: target language, the rows of other targets are left out
+    :return: dict of source language -> weight
+    """
+    with open(str(weights_file)) as weights_file_handle:
+        rows = [line.split() for line in weights_file_handle if line.strip()]
+    if any(len(row) != 3 for row in rows):
+        raise ValueError("%s is not a table of \"source target weight\" triples." % weights_file)
+    return {source: float(weight) for source, target, weight in rows if target == target_language}
+
+
+# available aggregators by name, the weighted one needs the source weights
+aggregators = {"sum": sum_votes,
+               "max": max_votes,
+               "weighted": weighted_votes,
+               "threshold": threshold_votes,
+               "rank": rank_votes,
+               "standardized": standardized_votes}
+
+
+def aggregate(tensor, aggregator, **params):
+    """Aggregates the projections of the sources with a single aggregator.
+
+    :param tensor: (n+1 x n+1 x k) tensor of projected weights with NaN for missing projections, or a stack of them
+    :param aggregator: aggregator name, see aggregators
+    :param params: parameters of the aggregator, e.g., weights for the weighted sum
+    :return: (n+1 x n+1) aggregated matrix, or a stack of them
+    """
+    return aggregators[aggregator](StackedVotes(tensor), **params)
+
+
+def aggregate_all(tensor, configurations):
+    """Aggregates the projections of the sources with many aggregators at once, to compare them on the same tensor.
+
+    :param tensor: (n+1 x n+1 x k) tensor of projected weights with NaN for missing projections, or a stack of them
+    :param configurations: dict of configuration name -> <aggregator name, dict of parameters> pair
+    :return: dict of configuration name -> aggregated matrix, or a stack of them
+    """
+    votes = StackedVotes(tensor)
+    return {name: aggregators[aggregator](votes, **params) for name, (aggregator, params) in configurations.items()}
@@ -0,0 +1,237 @@
+import json
+import sys
+from pathlib import Path
+import numpy as np
+import utils.alignments as align
+
+# line-level arrays: target_sid, source_sid, confidence (sentence alignment) and offsets (into the link arrays)
+# link-level arrays: pairs of (source index, target index), 0-indexed as in the .wal file, and probability
+# lookup arrays: keys (target_sid, source_sid packed into int64) sorted, and the line each key points to
+STORE_ARRAYS = ("target_sid", "source_sid", "confidence", "offsets",
+                "pairs", "probability",
+                "keys", "key_lines", "targets", "target_lines")
+
+
+def default_store_path(filename_wa):
+    """The alignment store of a sentence and word alignment pair lives next to the word alignment file."""
+    filename_wa = Path(filename_wa)
+    return filename_wa.with_name(filename_wa.name + ".store")
+
+
+def file_signature(filename):
+    stat = Path(filename).stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def pack_keys(target_sids, source_sids):
+    return (np.asarray(target_sids, dtype=np.int64) << 32) | np.asarray(source_sids, dtype=np.int64)
+
+
+def last_occurrences(keys):
+    """Sorts the keys and finds the last line for each distinct key, i.e., later lines override earlier ones, just
+    like they do in utils.alignments.read_alignments.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    is_last = np.append(sorted_keys[1:] != sorted_keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+    return sorted_keys[is_last], order[is_last].astype(np.int64)
+
+
+def convert(filename_sa, filename_wa, store_path=None):
+    """Reads a sentence alignment file and a word alignment file once and writes them to an alignment store.
+
+    :param filename_sa: sentence alignment filename, hunalign format
+    :param filename_wa: word alignment filename, efmaral/fast_align format
+    :param store_path: output directory, defaults to the word alignment filename with a .store suffix
+    :return: path to the alignment store
+    """
+    store_path = Path(store_path) if store_path else default_store_path(filename_wa)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    target_sids, source_sids, confidences = [], [], []
+    offsets = [0]
+    pairs, probabilities = [], []
+    similarity = 0.0
+
+    for line_sa, line_wa in zip(open(filename_sa), open(filename_wa)):
+        sa_items = line_sa.strip().split()
+        wa_items = line_wa.strip().split()
+
+        source_sids.append(int(sa_items[0]))
+        target_sids.append(int(sa_items[1]))
+        confidences.append(float(sa_items[2]))
+
+        for pair in wa_items[::2]:
+            sid, tid = pair.split("-")
+            pairs.append((int(sid), int(tid)))
+        line_probabilities = [float(p) for p in wa_items[1::2]]
+        probabilities.extend(line_probabilities)
+        similarity += sum(line_probabilities)
+
+        offsets.append(len(probabilities))
+
+    arrays = {"target_sid": np.array(target_sids, dtype=np.int32),
+              "source_sid": np.array(source_sids, dtype=np.int32),
+              "confidence": np.array(confidences, dtype=np.float32),
+              "offsets": np.array(offsets, dtype=np.int64),
+              "pairs": np.array(pairs, dtype=np.int32).reshape(-1, 2),
+              "probability": np.array(probabilities, dtype=np.float32)}
+
+    arrays["keys"], arrays["key_lines"] = last_occurrences(pack_keys(arrays["target_sid"], arrays["source_sid"]))
+    arrays["targets"], arrays["target_lines"] = last_occurrences(arrays["target_sid"].astype(np.int64))
+
+    for name in STORE_ARRAYS:
+        np.save(str(store_path / (name + ".npy")), arrays[name])
+
+    # the similarity estimate is kept at full precision, as it is computed in utils.alignments.read_alignments
+    meta = {"sentence_alignment": file_signature(filename_sa),
+            "word_alignment": file_signature(filename_wa),
+            "similarity": similarity / len(probabilities) if probabilities else 0.0}
+
+    with (store_path / "meta.json").open("w") as meta_file:
+        json.dump(meta, meta_file)
+
+    return store_path
+
+
+def open_store_for(filename_sa, filename_wa):
+    """Opens the alignment store of a sentence and word alignment pair, if it exists and is up to date.
+
+    :param filename_sa: sentence alignment filename
+    :param filename_wa: word alignment filename
+    :return: AlignmentStore or None
+    """
+    store_path = default_store_path(filename_wa)
+    meta_file = store_path / "meta.json"
+
+    if not meta_file.is_file():
+        return None
+
+    with meta_file.open() as meta_handle:
+        meta = json.load(meta_handle)
+
+    if meta["sentence_alignment"] != file_signature(filename_sa) or \
+            meta["word_alignment"] != file_signature(filename_wa):
+        return None
+
+    return AlignmentStore(store_path)
+
+
+def open_alignments(filename_sa, filename_wa):
+    """Drop-in replacement for utils.alignments.read_alignments that serves the alignments from the alignment store
+    if there is an up-to-date one, and reads the text files otherwise.
+
+    :param filename_sa: sentence alignment filename, hunalign format
+    :param filename_wa: word alignment filename, efmaral/fast_align format
+    :return: sentence alignments, word alignments, and the language similarity estimate
+    """
+    store = open_store_for(filename_sa, filename_wa)
+    if store is None:
+        return align.read_alignments(filename_sa, filename_wa)
+
+    return store.sentence_alignments, store.word_alignments, store.similarity
+
+
+def alignment_statistics(store):
+    """Statistics of a language pair over its whole alignment store, computed on the store arrays at once.
+
+    :param store: AlignmentStore
+    :return: dict of the number of target sentences, the share of them with a non-empty word alignment, and the mean
+        word alignment probability, i.e., the similarity estimate
+    """
+    links = np.diff(store.offsets)[store.target_lines]
+    return {"target_sentences": len(links),
+            "aligned_share": float((links > 0).mean()) if len(links) else 0.0,
+            "similarity": store.similarity}
+
+
+class AlignmentStore:
+    """
+    Memory-mapped sentence and word alignments of a language pair. Word alignments of a line are zero-copy
+    views: an (k x 2) array of 0-indexed (source, target) index pairs and an array of k probabilities.
+    """
+    def __init__(self, store_path):
+        store_path = Path(store_path)
+        for name in STORE_ARRAYS:
+            setattr(self, name, np.load(str(store_path / (name + ".npy")), mmap_mode="r"))
+
+        with (store_path / "meta.json").open() as meta_file:
+            self.similarity = json.load(meta_file)["similarity"]
+
+        self.sentence_alignments = SentenceAlignments(self)
+        self.word_alignments = WordAlignments(self)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, line):
+        """Word alignments of a line as (source id + 1, target id + 1, probability) triples, the format of
+        utils.alignments.read_word_alignments.
+        """
+        pairs, probabilities = self.get_line(line)
+        return list(zip((pairs[:, 0] + 1).tolist(), (pairs[:, 1] + 1).tolist(), probabilities.tolist()))
+
+    def get_line(self, line):
+        begin, end = self.offsets[line], self.offsets[line + 1]
+        return self.pairs[begin:end], self.probability[begin:end]
+
+    def find_line(self, target_sid, source_sid):
+        """Random access by sentence pair; returns the line of the pair or None."""
+        return self._lookup(self.keys, self.key_lines, int(pack_keys(target_sid, source_sid)))
+
+    def find_target_line(self, target_sid):
+        return self._lookup(self.targets, self.target_lines, target_sid)
+
+    def get_word_alignments(self, target_sid, source_sid):
+        """Returns the word alignment pairs and probabilities of a sentence pair, or None if the pair is not aligned
+        or its alignment is empty.
+        """
+        line = self.find_line(target_sid, source_sid)
+        if line is None or self.offsets[line] == self.offsets[line + 1]:
+            return None
+        return self.get_line(line)
+
+    @staticmethod
+    def _lookup(keys, lines, key):
+        position = np.searchsorted(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return int(lines[position])
+        return None
+
+
+class SentenceAlignments:
+    """Read-only dictionary view of the sentence alignments: target sid -> [source sid, confidence]."""
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, target_sid):
+        return self.store.find_target_line(target_sid) is not None
+
+    def __getitem__(self, target_sid):
+        line = self.store.find_target_line(target_sid)
+        if line is None:
+            raise KeyError(target_sid)
+        return [int(self.store.source_sid[line]), float(self.store.confidence[line])]
+
+
+class WordAlignments:
+    """Read-only dictionary view of the word alignments: (target sid, source sid) -> (pairs, probabilities)."""
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, key):
+        return self.store.find_line(*key) is not None
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.store.get_word_alignments(*key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+# one-time conversion: python -m utils.alignment_store de-en.bible.sal de-en.bible.ibm1.reverse.wal [...]
+if __name__ == "__main__":
+    for filename_sa, filename_wa in zip(sys.argv[1::2], sys.argv[2::2]):
+        print(convert(filename_sa, filename_wa), file=sys.stderr)
@@ -51,49 +51,110 @@ def get_alignment_matrix(shape, pairs, probabilities, binary=False):
     if len(pairs) != len(probabilities):
         raise Exception("Mismatch in sizes of pairs (%s) and probabilities (%s)" % (len(pairs), len(probabilities)))
 
-    src_indices = []
-    trg_indices = []
-
-    for it in range(len(pairs)):
-        source_id, target_id = pairs[it]
-        src_indices.append(source_id + 1)  # word alignments are 0-indexed, here we move to CoNLL indexing (+1)
-        trg_indices.append(target_id + 1)
-
+    # word alignments are 0-indexed, here we move to CoNLL indexing (+1)
     # root always aligns to root, accommodate for that
-    src_indices.append(0)
-    trg_indices.append(0)
-    probabilities.append(1.0)
+    pairs = np.asarray(pairs, dtype=np.int32).reshape(-1, 2)
+    src_indices = np.append(pairs[:, 0] + 1, 0)
+    trg_indices = np.append(pairs[:, 1] + 1, 0)
 
     if binary:
-        probabilities = np.ones_like(probabilities)
+        probabilities = np.ones(len(src_indices))
+    else:
+        probabilities = np.append(np.asarray(probabilities, dtype=np.float64), 1.0)
 
     matrix = sparse.coo_matrix((probabilities, (src_indices, trg_indices)), shape=shape)
 
     return matrix.tocsr()
 
 
-def project_dependencies_to_target(S, A):  # TODO Matrix S must be normalized, i.e., negative values are not allowed!
+def project_dependencies_to_target(S, A, block_size=1 << 22):  # TODO Matrix S must be normalized, i.e., negative values are not allowed!
     """Projects source graph to target graph via source-target word alignment.
 
+    The target graph is the max-product projection T[t_d, t_h] = max_{d, h} A[d, t_d] * S[d, h] * A[h, t_h], with
+    NaN products left out. As the alignment probabilities are non-negative, the maximum factorizes as
+    max_d A[d, t_d] * (max_h S[d, h] * A[h, t_h]), which is computed by broadcasting in two reductions,
+    O(m^2 n + m n^2) instead of O(m^2 n^2). Source dependents are processed in chunks to bound the memory.
+
     :param S: source graph (m+1 x m+1 matrix)
     :param A: word alignment matrix (m+1 x n+1)
+    :param block_size: maximum number of elements of the temporary arrays
     :return: target graph
     """
+    S = np.asarray(S, dtype=np.float64)
+    A = A.toarray() if sparse.issparse(A) else np.asarray(A, dtype=np.float64)
     m_plus_one, n_plus_one = A.shape
 
-    T = np.ones(shape=(n_plus_one, n_plus_one)) * np.nan  # target graph
-    T_edge = np.ones_like(T) * np.nan
+    # C[d, t_h] = max_h S[d, h] * A[h, t_h], the best scoring head of d in terms of target heads
+    C = np.full((m_plus_one, n_plus_one), np.nan)
+    chunk = max(1, block_size // (m_plus_one * n_plus_one))
+    for begin in range(0, m_plus_one, chunk):
+        end = min(begin + chunk, m_plus_one)
+        with np.errstate(invalid="ignore"):
+            C[begin:end] = np.fmax.reduce(S[begin:end, :, None] * A[None, :, :], axis=1)
+
+    # T[t_d, t_h] = max_d A[d, t_d] * C[d, t_h]
+    T = np.full((n_plus_one, n_plus_one), np.nan)  # target graph
+    chunk = max(1, block_size // (n_plus_one * n_plus_one))
+    for begin in range(0, m_plus_one, chunk):
+        end = min(begin + chunk, m_plus_one)
+        with np.errstate(invalid="ignore"):
+            np.fmax(T, np.fmax.reduce(A[begin:end, :, None] * C[begin:end, None, :], axis=0), out=T)
+    return T
+
 
-    # for each dependent d in source graph (dependents are rows!)
-    for d in range(m_plus_one):
-            # and for each head of dependent d (heads are columns!)
-            for h in range(m_plus_one):
-                np.dot(A[d].reshape(-1, 1), A[h].reshape(1, -1), out=T_edge)
-                T_edge *= S[d, h]  # multiply by confidence of edge h->d from the source parse
-                np.fmax(T, T_edge, out=T)
+def project_dependencies_vectorized(S_sparse, A_sparse, block_size=1 << 22):
+    """NumPy counterpart of utils.project_deps.project_dependencies_faster, for when the Cython build is not available.
+    Only the stored source edges and alignments take part in the projection, and target self-loops are left out.
+
+    :param S_sparse: source graph (m+1 x m+1) as CooMatrix
+    :param A_sparse: word alignment matrix (m+1 x n+1) in CSR format
+    :param block_size: maximum number of elements of the temporary arrays
+    :return: (n+1 x n+1) target graph, NaN for cells without projections
+    """
+    S = np.full(S_sparse.shape, np.nan)
+    S[S_sparse.row, S_sparse.col] = S_sparse.data
+
+    A_coo = A_sparse.tocoo()
+    A = np.full(A_coo.shape, np.nan)
+    A[A_coo.row, A_coo.col] = A_coo.data
+
+    T = project_dependencies_to_target(S, A, block_size)
+    np.fill_diagonal(T, np.nan)
     return T
 
 
+def project_dependencies_batch_vectorized(source_graphs, alignment_matrices, num_threads=None):
+    """NumPy counterpart of utils.project_deps.project_dependencies_batch; projects the pairs one by one.
+
+    :param source_graphs: list of source graphs (m+1 x m+1) as CooMatrix
+    :param alignment_matrices: list of word alignment matrices (m+1 x n+1) in CSR format
+    :param num_threads: ignored
+    :return: list of (n+1 x n+1) target graphs
+    """
+    return [project_dependencies_vectorized(S, A) for S, A in zip(source_graphs, alignment_matrices)]
+
+
+def project_dependencies_fused_vectorized(source_graphs, alignment_matrices, source_weights=None):
+    """NumPy counterpart of utils.project_deps.project_dependencies_fused; accumulates the voted weight matrix
+    source by source.
+
+    :param source_graphs: list of source graphs (m+1 x m+1) as CooMatrix, one per source
+    :param alignment_matrices: list of word alignment matrices (m+1 x n+1) in CSR format, one per source
+    :param source_weights: list of per-source weights the target graphs are multiplied with, if any
+    :return: (n+1 x n+1) voted weight matrix, zero for cells without projections
+    """
+    n_plus_one = alignment_matrices[0].shape[1]
+    voted = np.zeros((n_plus_one, n_plus_one))
+
+    for k, (S, A) in enumerate(zip(source_graphs, alignment_matrices)):
+        T = project_dependencies_vectorized(S, A)
+        if source_weights is not None:
+            T *= source_weights[k]
+        voted += np.nan_to_num(T, nan=0.0)
+
+    return voted
+
+
 def project_token_labels(source_labels, wa_pairs, wa_probs):
     """Projects the token labels from source to target tokens in a sentence.
 
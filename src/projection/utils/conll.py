@@ -1,3 +1,4 @@
+from pathlib import Path
 from utils.coo_matrix_nocheck import CooMatrix
 import numpy as np
 
@@ -106,26 +107,28 @@ def get_next_sentence_and_tree(conll_file_handle):
     """
     next_sentence = []
     parts_of_speech = []
-    head_indices = []
-    dep_indices = []
-    confidences = []
 
     line = conll_file_handle.readline().strip().split()
 
-    it = 0
     while line:
-        it += 1
         next_sentence.append(ConllToken.from_list(line[:8]))
-        head_indices.append(int(line[6]))
-        dep_indices.append(it)
-        confidences.append(1.0)
         parts_of_speech.append(line[3])
         line = conll_file_handle.readline().strip().split()
 
-    next_graph = CooMatrix(dep_indices, head_indices, confidences,
-                           shape=(len(next_sentence) + 1, len(next_sentence) + 1))
+    return next_sentence, get_tree_graph(next_sentence), parts_of_speech
 
-    return next_sentence, next_graph, parts_of_speech
+
+def get_tree_graph(sentence):
+    """Creates the one-hot graph of the parse tree of a sentence, i.e., an edge with confidence 1.0 for each head.
+
+    :param sentence: list of tokens
+    :return: (n+1 x n+1) sentence dependency tree as CooMatrix
+    """
+    dep_indices = [token.idx for token in sentence]
+    head_indices = [token.head for token in sentence]
+    confidences = [1.0] * len(sentence)
+
+    return CooMatrix(dep_indices, head_indices, confidences, shape=(len(sentence) + 1, len(sentence) + 1))
 
 
 def get_next_sentence_and_tree_old(conll_file_handle):
@@ -185,3 +188,51 @@ def sentences(conll_file_handle, sentence_getter):
         if not next_sentence or not next_sentence[0]:  # subscript accommodates for getters returning tuples
             break
         yield next_sentence
+
+
+class SentenceCursor:
+    """
+    On-demand access to the sentences of a CoNLL-style file by sentence id, without loading the file.
+    Sentences are read with a forward-only reader, so requests in increasing sentence id order (e.g., following
+    a monotone sentence alignment) are served in a single pass over the file. A request for an earlier sentence
+    rewinds the file. Only the last sentence read is kept in memory.
+    """
+    def __init__(self, conll_file, sentence_getter):
+        self.conll_file = Path(conll_file)
+        self.sentence_getter = sentence_getter
+        self.conll_file_handle = None
+        self.rewind()
+
+    def rewind(self):
+        if self.conll_file_handle:
+            self.conll_file_handle.close()
+        self.conll_file_handle = self.conll_file.open()
+        self.next_sid = 0
+        self.current_sid = -1
+        self.current = None
+
+    def get(self, sid):
+        """Returns the sentence with the given id, or None if the file has fewer sentences."""
+        if sid == self.current_sid:
+            return self.current
+
+        if sid < self.next_sid:
+            self.rewind()
+
+        while self.next_sid <= sid:
+            next_sentence = self.sentence_getter(self.conll_file_handle)
+            if not next_sentence or not next_sentence[0]:  # subscript accommodates for getters returning tuples
+                return None
+            self.current_sid, self.current = self.next_sid, next_sentence
+            self.next_sid += 1
+
+        return self.current
+
+    def __getitem__(self, sid):
+        sentence = self.get(sid)
+        if sentence is None:
+            raise IndexError("Sentence id %s out of range." % sid)
+        return sentence
+
+    def close(self):
+        self.conll_file_handle.close()
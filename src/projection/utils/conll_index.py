@@ -0,0 +1,125 @@
+import io
+import sys
+from pathlib import Path
+import numpy as np
+
+
+def default_index_path(conll_file):
+    """The sentence index of a CoNLL file lives next to it, e.g., en.2proj.conll -> en.2proj.conll.sidx.npz"""
+    conll_file = Path(conll_file)
+    return conll_file.with_name(conll_file.name + ".sidx.npz")
+
+
+def build_index(conll_file, index_path=None):
+    """Scans a CoNLL-style file once and writes the byte offset and byte length of each sentence to a sidecar index,
+    together with the size and modification time of the file for validation.
+
+    :param conll_file: CoNLL-style file, sentences separated by empty lines
+    :param index_path: output file, defaults to the CoNLL filename with a .sidx.npz suffix
+    :return: <offsets, lengths> pair of int64 arrays
+    """
+    conll_file = Path(conll_file)
+    index_path = Path(index_path) if index_path else default_index_path(conll_file)
+
+    offsets = []
+    lengths = []
+    position = 0
+    sentence_start = None
+
+    with conll_file.open("rb") as conll_file_handle:
+        for line in conll_file_handle:
+            if line.strip():
+                if sentence_start is None:
+                    sentence_start = position
+            elif sentence_start is not None:
+                offsets.append(sentence_start)
+                lengths.append(position - sentence_start)
+                sentence_start = None
+            position += len(line)
+
+    # last sentence without a trailing empty line
+    if sentence_start is not None:
+        offsets.append(sentence_start)
+        lengths.append(position - sentence_start)
+
+    offsets = np.array(offsets, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+
+    stat = conll_file.stat()
+    with index_path.open("wb") as index_file:
+        np.savez(index_file, offsets=offsets, lengths=lengths, size=stat.st_size, mtime=stat.st_mtime)
+
+    return offsets, lengths
+
+
+def load_index(conll_file, index_path=None):
+    """Loads the sentence index of a CoNLL file, (re)building it if it is missing or out of date with the file.
+
+    :param conll_file: CoNLL-style file
+    :param index_path: index file, defaults to the CoNLL filename with a .sidx.npz suffix
+    :return: <offsets, lengths> pair of int64 arrays
+    """
+    conll_file = Path(conll_file)
+    index_path = Path(index_path) if index_path else default_index_path(conll_file)
+
+    if index_path.is_file():
+        stat = conll_file.stat()
+        with np.load(str(index_path)) as index:
+            if int(index["size"]) == stat.st_size and float(index["mtime"]) == stat.st_mtime:
+                return index["offsets"], index["lengths"]
+
+    return build_index(conll_file, index_path)
+
+
+class IndexedConllFile:
+    """
+    Random access to the sentences of a CoNLL-style file through its byte-offset sentence index. A sentence is read
+    by seeking to its offset and parsing exactly its bytes with the given sentence getter.
+    """
+    def __init__(self, conll_file, sentence_getter, index_path=None):
+        self.conll_file = Path(conll_file)
+        self.sentence_getter = sentence_getter
+        self.offsets, self.lengths = load_index(self.conll_file, index_path)
+        self.conll_file_handle = self.conll_file.open("rb")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def seek(self, sid):
+        """Positions the underlying binary file handle at the beginning of sentence sid."""
+        self.conll_file_handle.seek(int(self.offsets[sid]))
+
+    def read_sentence_block(self, sid):
+        """Returns the raw text of sentence sid."""
+        self.seek(sid)
+        return self.conll_file_handle.read(int(self.lengths[sid])).decode("utf-8")
+
+    def __getitem__(self, sid):
+        if not 0 <= sid < len(self):
+            raise IndexError("Sentence id %s out of range." % sid)
+        return self.sentence_getter(io.StringIO(self.read_sentence_block(sid)))
+
+    def get(self, sid):
+        return self[sid] if 0 <= sid < len(self) else None
+
+    def get_batch(self, sids):
+        """Reads a batch of arbitrary sentence ids in sorted-offset order, i.e., with forward seeks only.
+
+        :param sids: iterable of sentence ids
+        :return: list of sentences in the order of the requested ids
+        """
+        sids = list(sids)
+        sentences = {}
+        for sid in sorted(set(sids)):
+            sentences[sid] = self[sid]
+        return [sentences[sid] for sid in sids]
+
+    def close(self):
+        self.conll_file_handle.close()
+
+
+# one-time indexing: python -m utils.conll_index en.2proj.conll [de.2proj.conll ...]
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        offsets, _ = build_index(filename)
+        print(filename, len(offsets), "sentences", file=sys.stderr)
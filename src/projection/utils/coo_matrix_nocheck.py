@@ -3,13 +3,26 @@ import numpy as np
 class CooMatrix:
     """
     Simple reimplementation of scipy.sparse.coo_matrix for convenience.
+    Arrays of the right type are not copied, so the matrix can be a view into a memory-mapped graph store.
     """
     def __init__(self, row, col, data, shape):
-        self.row = np.array(row, dtype=np.int32)
-        self.col = np.array(col, dtype=np.int32)
-        self.data = np.array(data)
+        self.row = np.asarray(row, dtype=np.int32)
+        self.col = np.asarray(col, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float64)
         self.shape = shape
 
     def standardize(self):
-        self.data -= self.data.mean()
+        # not in place, the data might be a read-only view
+        self.data = self.data - self.data.mean()
         self.data /= self.data.std()
+
+    def __imul__(self, factor):
+        # not in place either, see standardize
+        self.data = self.data * factor
+        return self
+
+    def toarray(self, fill_value=0.0):
+        """Dense matrix, fill_value in the cells without an entry."""
+        matrix = np.full(self.shape, fill_value)
+        matrix[self.row, self.col] = self.data
+        return matrix
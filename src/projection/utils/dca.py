@@ -20,13 +20,10 @@ def hua_et_al_2005_nodummies(align_ts, align_st, depths, stree, ttree):
 
 
 def remove_dummies(ttree, orig_target_length):
-    intersection = [i for i in range(orig_target_length + 1, len(ttree) + 1) if i in ttree[:orig_target_length]]
-    while len(intersection) > 0:
-        for x in range(orig_target_length, len(ttree)):  # for all dummies
-            for y in range(orig_target_length):  # for all non-dummies
-                if ttree[y] == (x + 1):
-                    ttree[y] = ttree[x]
-        intersection = [i for i in range(orig_target_length + 1, len(ttree) + 1) if i in ttree[:orig_target_length]]
+    # replace each dummy head by the first non-dummy up the chain of dummy heads
+    for y in range(orig_target_length):
+        while ttree[y] > orig_target_length:
+            ttree[y] = ttree[ttree[y] - 1]
 
 
 def setroot(stree, ttree, align_st):
@@ -105,43 +102,8 @@ def getAlignments(align_data, slength, tlength):
     return align_ts, align_st
 
 
-def getAlignmentsSparse(A_sparse):
-    # returns adj list of alignments
-    # 1) target node --> [source nodes]
-    # 2) source node --> [target nodes]
-    # the indices of nodes in adj lists are same as the id from the conll files!
-    align_ts = {(x + 1): [] for x in range(A_sparse.shape[1] - 1)}  # remove pseudo-root
-    align_st = {(x + 1): [] for x in range(A_sparse.shape[0] - 1)}
-    for a in range(len(A_sparse.row)):
-        if A_sparse.row[a] > 0:
-            align_st[A_sparse.row[a]].append(A_sparse.col[a])
-            align_ts[A_sparse.col[a]].append(A_sparse.row[a])
-    return align_ts, align_st
-
-
-def makeSourceTreeSparse(S_sparse):
-    stree = [-20] * len(S_sparse.row)
-    for x in range(len(S_sparse.row)):
-        stree[S_sparse.row[x] - 1] = S_sparse.col[x]
-    depths = getDepths(stree)
-    return stree, depths
-
-
 def getDepths(stree):
-    depths = [-10] * len(stree)  # depth of each node in the tree
-    q = []
-    rootindex = stree.index(0)
-    depths[rootindex] = 0
-    for i in range(len(stree)):  # putting children of root onto queue q
-        if stree[i] == (rootindex + 1):
-            q.append(i)
-    while len(q) > 0:
-        curr = q.pop(0)
-        depths[curr] = depths[stree[curr] - 1] + 1
-        for i in range(len(stree)):
-            if stree[i] == (curr + 1):
-                q.append(i)
-    return depths
+    return source_depths(np.array(stree)).tolist()
 
 
 def makeSourceTree(s_sent):
@@ -343,25 +305,115 @@ def iterateThroughDir_Bible():
     printScores('bible_scores_all', scores)
 
 
-def project(S_sparse, A_sparse_1):
-    # takes two CooMatrix objects (coo_matrix_nocheck.py), returns projection
-    # S_sparse must be just a tree (a single one per column)
-    # return a numpy matrix (n+1)x(n+1) first row is all zeroes
-
-    A_sparse = A_sparse_1.tocoo(copy=True)
-
-    align_ts, align_st = getAlignmentsSparse(A_sparse)
-    stree, depths = makeSourceTreeSparse(S_sparse)
-    ttree = [-10] * (A_sparse.shape[1] - 1)  # don't include pseudo-root
-    tlength = A_sparse.shape[1] - 1
-    hua_et_al_2005_nodummies(align_ts, align_st, depths, stree, ttree)
-    T_matrix = np.zeros(pow(tlength + 1, 2))
-    for x in range(tlength):
-        if ttree[x] > -1:
-            T_matrix[((x + 1) * (tlength + 1)) + ttree[x]] = 1
-
-    T_matrix[T_matrix == 0.0] = np.nan
-    return np.ndarray(shape=(tlength + 1, tlength + 1), buffer=T_matrix, dtype=float)
+def source_depths(stree):
+    """Depths of the source tokens in the subtree of the first token attached to the root, -10 for all other tokens.
+    Computed by pointer jumping, in O(log m) vectorized steps.
+
+    :param stree: array of source heads, 0 for the root
+    :return: array of depths
+    """
+    roots = np.flatnonzero(stree == 0)
+    if not len(roots):
+        raise ValueError("Source tree without a root.")
+
+    # ancestors 2^i steps up and distances to them, tokens without a token head point to themselves
+    positions = np.arange(len(stree))
+    ancestors = np.where(stree > 0, stree - 1, positions)
+    distances = (stree > 0).astype(np.int64)
+    for _ in range(len(stree).bit_length()):
+        distances += distances[ancestors]
+        ancestors = ancestors[ancestors]
+
+    return np.where(ancestors == roots[0], distances, -10)
+
+
+def project(S_sparse, A_sparse):
+    """Projects a source tree by direct correspondence (Hua et al. 2005), see project_heads.
+
+    :return: (n+1 x n+1) target matrix, 1.0 for the projected head of each target token and NaN elsewhere
+    """
+    return project_heads(S_sparse, A_sparse).toarray(fill_value=np.nan)
+
+
+def project_heads(S_sparse, A_sparse):
+    """Projects a source tree by direct correspondence (Hua et al. 2005), over the integer arrays of the alignment.
+
+    The target tokens are 1..n, dummy target nodes n+1.. are added for unaligned source tokens (in source order) and
+    then for source tokens aligned to several target tokens (in source order), as by hua_et_al_2005_nodummies, whose
+    results this reproduces in linear time.
+
+    :param S_sparse: (m+1 x m+1) source tree as CooMatrix, a single head per dependent
+    :param A_sparse: (m+1 x n+1) alignment matrix, scipy sparse
+    :return: (n+1 x n+1) target head vector as CooMatrix, an entry of confidence 1.0 from each target token with a
+        projected head to that head, ordered by token
+    """
+    A_sparse = A_sparse.tocoo()
+    m, n = A_sparse.shape[0] - 1, A_sparse.shape[1] - 1
+
+    aligned = A_sparse.row > 0
+    sources, targets = A_sparse.row[aligned].astype(np.int64), A_sparse.col[aligned].astype(np.int64)
+
+    stree = np.full(len(S_sparse.row), -20, dtype=np.int64)
+    stree[S_sparse.row - 1] = S_sparse.col
+    depths = source_depths(stree)
+
+    # alignments grouped by source and by target, each in alignment order
+    by_source, by_target = np.argsort(sources, kind="stable"), np.argsort(targets, kind="stable")
+    source_counts = np.bincount(sources, minlength=m + 1)
+    target_counts = np.bincount(targets, minlength=n + 1)
+    source_firsts = np.zeros(m + 1, dtype=np.int64)
+    source_starts = np.searchsorted(sources[by_source], np.arange(m + 1))
+    source_firsts[source_counts > 0] = targets[by_source][source_starts[source_counts > 0]]
+
+    # dummy nodes of the unaligned and of the one-to-many source tokens
+    unaligned = np.flatnonzero(source_counts[1:] == 0) + 1
+    one_to_many = np.flatnonzero(source_counts[1:] > 1) + 1
+    unaligned_dummies = n + 1 + np.arange(len(unaligned))
+    one_to_many_dummies = n + 1 + len(unaligned) + np.arange(len(one_to_many))
+
+    ttree = np.full(n + 1 + len(unaligned) + len(one_to_many), -10, dtype=np.int64)  # heads by node id, 0 unused
+    source_firsts[unaligned] = unaligned_dummies
+    source_counts = np.maximum(source_counts, 1)
+
+    # one-to-one: the single source of the node, aligned only to the node, has the root or a singly aligned head
+    single = target_counts[targets] == 1
+    nodes = np.concatenate([targets[single], unaligned_dummies])
+    node_sources = np.concatenate([sources[single], unaligned])
+    heads = stree[node_sources - 1]
+    one_to_one = (source_counts[node_sources] == 1) & \
+                 np.where(heads > 0, source_counts[np.maximum(heads, 0)] == 1, heads == 0)
+    ttree[nodes[one_to_one]] = np.where(heads > 0, source_firsts[np.maximum(heads, 0)], 0)[one_to_one]
+
+    # one-to-many: the targets of the source token are headed by its dummy, the last such source token wins
+    multiple = source_counts[sources] > 1
+    last_sources = np.zeros(n + 1, dtype=np.int64)
+    np.maximum.at(last_sources, targets[multiple], sources[multiple])
+    dummy_by_source = np.zeros(m + 1, dtype=np.int64)
+    dummy_by_source[one_to_many] = one_to_many_dummies
+    headed = np.flatnonzero(last_sources)
+    ttree[headed] = dummy_by_source[last_sources[headed]]
+    source_firsts[one_to_many] = one_to_many_dummies
+
+    # many-to-one: of the sources of the target token, the first shallowest one projects its head
+    grouped_sources, grouped_targets = sources[by_target], targets[by_target]
+    shallowest = np.lexsort((np.arange(len(grouped_targets)), depths[grouped_sources - 1], grouped_targets))
+    firsts = shallowest[np.append(True, grouped_targets[shallowest][1:] != grouped_targets[shallowest][:-1])] \
+        if len(shallowest) else shallowest
+    many_to_one = target_counts[grouped_targets[firsts]] > 1
+    nodes, heads = grouped_targets[firsts][many_to_one], stree[grouped_sources[firsts][many_to_one] - 1]
+    ttree[nodes] = np.where(heads > 0, source_firsts[np.maximum(heads, 0)], 0)
+
+    # remove the dummies: follow the dummy heads by pointer jumping until they reach a non-dummy
+    dummy_heads = ttree[n + 1:]
+    for _ in range(len(dummy_heads).bit_length()):
+        chained = dummy_heads > n
+        dummy_heads[chained] = dummy_heads[dummy_heads[chained] - n - 1]
+    target_heads = ttree[1:n + 1]
+    dummy_headed = target_heads > n
+    target_heads[dummy_headed] = dummy_heads[target_heads[dummy_headed] - n - 1]
+
+    projected = np.flatnonzero(target_heads > -1)
+    return CooMatrix(projected + 1, target_heads[projected], np.ones(len(projected)), (n + 1, n + 1))
 
 
 def get_arguments(parser=None):
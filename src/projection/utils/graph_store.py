@@ -0,0 +1,150 @@
+import json
+import sys
+from pathlib import Path
+import numpy as np
+import utils.conll as conll
+from utils.coo_matrix_nocheck import CooMatrix
+
+# edge-level arrays: row (dependent), col (head), data (confidence), concatenated over all sentences
+# token-level arrays: heads, pos, forms, concatenated over all sentences
+# sentence-level arrays: edge_offsets and token_offsets, each of length number of sentences + 1
+STORE_ARRAYS = ("row", "col", "data", "heads", "pos", "forms", "edge_offsets", "token_offsets")
+
+
+def default_store_path(conll_file):
+    """The graph store of a CoNLL file lives next to it, e.g., en.2proj.conll -> en.2proj.conll.graphs"""
+    conll_file = Path(conll_file)
+    return conll_file.with_name(conll_file.name + ".graphs")
+
+
+def file_signature(conll_file):
+    stat = Path(conll_file).stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def convert(conll_file, store_path=None):
+    """Parses an augmented CoNLL file (lines 9-end contain graph data) once and writes it to a graph store.
+
+    :param conll_file: augmented CoNLL file
+    :param store_path: output directory, defaults to the CoNLL filename with a .graphs suffix
+    :return: path to the graph store
+    """
+    store_path = Path(store_path) if store_path else default_store_path(conll_file)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    rows, cols, data = [], [], []
+    heads, pos, forms = [], [], []
+    edge_offsets = [0]
+    token_offsets = [0]
+
+    with Path(conll_file).open() as conll_file_handle:
+        for sentence, graph, pos_tags in conll.sentences(conll_file_handle,
+                                                         sentence_getter=conll.get_next_sentence_and_graph):
+            rows.append(graph.row)
+            cols.append(graph.col)
+            data.append(graph.data)
+            heads.extend(token.head for token in sentence)
+            forms.extend(token.form for token in sentence)
+            pos.extend(pos_tags)
+            edge_offsets.append(edge_offsets[-1] + len(graph.data))
+            token_offsets.append(token_offsets[-1] + len(sentence))
+
+    arrays = {"row": np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+              "col": np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32),
+              "data": np.concatenate(data) if data else np.zeros(0, dtype=np.float64),
+              "heads": np.array(heads, dtype=np.int32),
+              "pos": np.array(pos, dtype=str),
+              "forms": np.array(forms, dtype=str),
+              "edge_offsets": np.array(edge_offsets, dtype=np.int64),
+              "token_offsets": np.array(token_offsets, dtype=np.int64)}
+
+    for name in STORE_ARRAYS:
+        np.save(str(store_path / (name + ".npy")), arrays[name])
+
+    with (store_path / "meta.json").open("w") as meta_file:
+        json.dump(file_signature(conll_file), meta_file)
+
+    return store_path
+
+
+def open_store_for(conll_file, trees=False, standardize=False):
+    """Opens the graph store of a CoNLL file, if it exists and is up to date with the file.
+
+    :param conll_file: augmented CoNLL file
+    :param trees: serve one-hot parse trees instead of weight graphs
+    :param standardize: serve standardized weight graphs
+    :return: GraphStore or None
+    """
+    store_path = default_store_path(conll_file)
+    meta_file = store_path / "meta.json"
+
+    if not meta_file.is_file():
+        return None
+
+    with meta_file.open() as meta_handle:
+        if json.load(meta_handle) != file_signature(conll_file):
+            return None
+
+    return GraphStore(store_path, trees=trees, standardize=standardize)
+
+
+class GraphStore:
+    """
+    Memory-mapped sentence graphs, indexed by sentence id. Items mimic the output of
+    conll.get_next_sentence_and_graph (or conll.get_next_sentence_and_tree if trees=True), i.e., they are
+    <word forms, graph, POS tags> 3-tuples, where the graph is a CooMatrix with zero-copy views as data.
+    Standardization, if requested, happens on access and leaves the store untouched.
+    """
+    def __init__(self, store_path, trees=False, standardize=False):
+        store_path = Path(store_path)
+        for name in STORE_ARRAYS:
+            setattr(self, name, np.load(str(store_path / (name + ".npy")), mmap_mode="r"))
+        self.trees = trees
+        self.standardize = standardize
+
+    def __len__(self):
+        return len(self.edge_offsets) - 1
+
+    def __getitem__(self, sid):
+        if not 0 <= sid < len(self):
+            raise IndexError("Sentence id %s out of range." % sid)
+
+        if self.trees:
+            graph = self.get_tree(sid)
+        else:
+            graph = self.get_graph(sid)
+            if self.standardize:
+                graph.standardize()
+
+        return self.get_forms(sid), graph, self.get_pos_tags(sid)
+
+    def __iter__(self):
+        for sid in range(len(self)):
+            yield self[sid]
+
+    def get_length(self, sid):
+        return int(self.token_offsets[sid + 1] - self.token_offsets[sid])
+
+    def get_graph(self, sid):
+        """Returns the (n+1 x n+1) weight graph of a sentence, without copying the edge arrays."""
+        begin, end = self.edge_offsets[sid], self.edge_offsets[sid + 1]
+        n = self.get_length(sid)
+        return CooMatrix(self.row[begin:end], self.col[begin:end], self.data[begin:end], shape=(n + 1, n + 1))
+
+    def get_tree(self, sid):
+        """Returns the (n+1 x n+1) one-hot graph of the parse tree of a sentence."""
+        begin, end = self.token_offsets[sid], self.token_offsets[sid + 1]
+        n = int(end - begin)
+        return CooMatrix(np.arange(1, n + 1), self.heads[begin:end], np.ones(n), shape=(n + 1, n + 1))
+
+    def get_pos_tags(self, sid):
+        return self.pos[self.token_offsets[sid]:self.token_offsets[sid + 1]].tolist()
+
+    def get_forms(self, sid):
+        return self.forms[self.token_offsets[sid]:self.token_offsets[sid + 1]].tolist()
+
+
+# one-time conversion: python -m utils.graph_store en.2proj.conll [de.2proj.conll ...]
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        print(convert(filename), file=sys.stderr)
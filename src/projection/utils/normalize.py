@@ -1,86 +1,189 @@
 import sys
+import warnings
 import pandas as pd
 import numpy as np
+from utils.coo_matrix_nocheck import CooMatrix
 
 def softmax(sentence_matrix, temperature=1.0):
     """Softmax normalization.
 
-    :param sentence_matrix: (n+1 x n+1) weight matrix from the parser
+    :param sentence_matrix: (n+1 x n+1) weight matrix from the parser, or a stack of them
     :param temperature: softmax temperature
     :return: softmaxed weight matrix
     """
     m_exp = np.exp(sentence_matrix/temperature)
-    return (m_exp.T / np.nansum(m_exp, axis=1)).T
+    return m_exp / np.nansum(m_exp, axis=-1, keepdims=True)
 
 
 def rank(sentence_matrix, use_integers=False):
-    """
-    TODO
-    :param sentence_matrix: (n+1 x n+1) weight matrix from the parser
+    """Per-row rank normalization, the lowest weight of a row gets rank 1; tied weights all get the highest of their
+    ranks, and NaN cells stay NaN without taking up ranks.
+
+    :param sentence_matrix: (n+1 x n+1) weight matrix from the parser, or a stack of them
+    :param use_integers: keep the integer ranks, instead of fractional ranks normalized to sum to 1 per row
     :return: ranked weight matrix
     """
-    ranked = np.ones_like(sentence_matrix) * np.nan
-
-    # create rankings
-    if use_integers:
-        ranks = range(1, ranked.shape[1] + 1)
-    else:
-        ranks = [(x+1)/ranked.shape[1] for x in range(ranked.shape[1])]
+    columns = sentence_matrix.shape[-1]
 
-    for it in range(ranked.shape[0]):
+    # NaNs are sorted last, so that they do not affect the ranks of the weights
+    order = np.argsort(sentence_matrix, axis=-1, kind="stable")
+    sorted_weights = np.take_along_axis(sentence_matrix, order, axis=-1)
 
+    # the rank of a sorted position is the last position of its run of equal weights, plus 1
+    run_ends = np.ones(sentence_matrix.shape, dtype=bool)
+    run_ends[..., :-1] = sorted_weights[..., 1:] != sorted_weights[..., :-1]
+    positions = np.where(run_ends, np.arange(columns), columns)
+    sorted_ranks = np.minimum.accumulate(positions[..., ::-1], axis=-1)[..., ::-1] + 1
 
-        mappings = dict(zip(sorted(sentence_matrix[it, ]), ranks))
-        #mappings[np.nan] = np.nan
-        for jt in range(ranked.shape[1]):
-            if np.isnan(sentence_matrix[it, jt]):
-                ranked[it, jt] = np.nan
-            else:
-                ranked[it, jt] = mappings[sentence_matrix[it, jt]]
+    ranked = np.empty(sentence_matrix.shape)
+    np.put_along_axis(ranked, order, sorted_ranks if use_integers else sorted_ranks / columns, axis=-1)
+    ranked[np.isnan(sentence_matrix)] = np.nan
 
     if not use_integers:
-        return (ranked.T / np.nansum(ranked, axis=1)).T
+        return ranked / np.nansum(ranked, axis=-1, keepdims=True)
 
     return ranked
 
 
 def stdev_norm(sentence_matrix):
-    """
-    TODO
-    :param sentence_matrix:
-    :return:
-    """
-    normalized = np.zeros_like(sentence_matrix)
+    """Per-row normalization by mean and standard deviation of the non-NaN weights, shifted by 0.5 and clipped
+    to [0, 1].
 
-    for it in range(normalized.shape[0]):
-        stdev = np.std(sentence_matrix[it, ])
-        mean = np.mean(sentence_matrix[it, ])
-        for jt in range(normalized.shape[1]):
-            normalized[it, jt] = clip((0.5 + sentence_matrix[it, jt] - float(mean)) / float(stdev))
-
-    return normalized
+    :param sentence_matrix: (n+1 x n+1) weight matrix from the parser, or a stack of them
+    :return: normalized weight matrix, NaN cells stay NaN
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # all-NaN rows and constant rows
+        mean = np.nanmean(sentence_matrix, axis=-1, keepdims=True)
+        stdev = np.nanstd(sentence_matrix, axis=-1, keepdims=True)
+        return np.clip((0.5 + sentence_matrix - mean) / stdev, 0.0, 1.0)
 
 
 def standardize(sentence_matrix):
+    """Standardization by mean and standard deviation of all non-NaN weights of the matrix, per matrix of a stack."""
     normalized = sentence_matrix.copy()
-    normalized -= np.nanmean(normalized)
-    normalized /= np.nanstd(normalized)
+    normalized -= np.nanmean(normalized, axis=(-2, -1), keepdims=True)
+    normalized /= np.nanstd(normalized, axis=(-2, -1), keepdims=True)
 
     return normalized
 
 
+def normalize_batch(normalizer, sentence_matrices):
+    """Normalizes many sentence matrices of different sizes at once, as a single NaN-padded stack. Works with the
+    normalizers above, as they ignore the NaN padding.
+
+    :param normalizer: normalization function
+    :param sentence_matrices: list of (n+1 x n+1) weight matrices
+    :return: list of normalized weight matrices, views into the normalized stack
+    """
+    if not sentence_matrices:
+        return []
+
+    size = max(matrix.shape[0] for matrix in sentence_matrices)
+    stack = np.full((len(sentence_matrices), size, size), np.nan)
+    for b, matrix in enumerate(sentence_matrices):
+        stack[b, :matrix.shape[0], :matrix.shape[1]] = matrix
+
+    normalized = normalizer(stack)
+    return [normalized[b, :matrix.shape[0], :matrix.shape[1]] for b, matrix in enumerate(sentence_matrices)]
+
+
+def row_segments(graph):
+    """Groups the entries of a CooMatrix by row.
+
+    :param graph: CooMatrix
+    :return: <entry order by row, start of each row segment in that order, row segment of each ordered entry> 3-tuple
+    """
+    order = np.argsort(graph.row, kind="stable")
+    rows = graph.row[order]
+    starts = np.flatnonzero(np.append(True, rows[1:] != rows[:-1])) if len(rows) else np.zeros(0, dtype=np.int64)
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(rows))))
+    return order, starts, segments
+
+
+def with_data(graph, order, sorted_data):
+    """The graph with new data, given in the order of row_segments."""
+    data = np.empty(len(sorted_data))
+    data[order] = sorted_data
+    return CooMatrix(graph.row, graph.col, data, graph.shape)
+
+
+def sparse_softmax(graph, temperature=1.0):
+    """Softmax over the entries of each row of a sparse graph, as softmax on the dense graph with NaN elsewhere.
+
+    :param graph: CooMatrix
+    :param temperature: softmax temperature
+    :return: normalized CooMatrix
+    """
+    order, starts, segments = row_segments(graph)
+    if not len(starts):
+        return graph
+    m_exp = np.exp(graph.data[order] / temperature)
+    return with_data(graph, order, m_exp / np.add.reduceat(m_exp, starts)[segments])
+
+
+def sparse_rank(graph, use_integers=False):
+    """Rank normalization over the entries of each row of a sparse graph, as rank on the dense graph with NaN
+    elsewhere.
+
+    :param graph: CooMatrix
+    :param use_integers: keep the integer ranks, instead of fractional ranks normalized to sum to 1 per row
+    :return: normalized CooMatrix
+    """
+    order, starts, segments = row_segments(graph)
+    if not len(starts):
+        return graph
+
+    # order the entries by weight within each row
+    order = order[np.lexsort((graph.data[order], segments))]
+    weights = graph.data[order]
+
+    # the rank of an entry is the last position of its run of equal weights within the row, plus 1
+    run_ends = np.ones(len(weights), dtype=bool)
+    run_ends[:-1] = (weights[1:] != weights[:-1]) | (segments[1:] != segments[:-1])
+    positions = np.where(run_ends, np.arange(len(weights)), len(weights))
+    ranks = np.minimum.accumulate(positions[::-1])[::-1] - starts[segments] + 1
+
+    if use_integers:
+        return with_data(graph, order, ranks.astype(np.float64))
+
+    ranks = ranks / graph.shape[1]
+    return with_data(graph, order, ranks / np.add.reduceat(ranks, starts)[segments])
+
+
+def sparse_stdev_norm(graph):
+    """Normalization by mean and standard deviation of the entries of each row of a sparse graph, as stdev_norm on the
+    dense graph with NaN elsewhere.
+
+    :param graph: CooMatrix
+    :return: normalized CooMatrix
+    """
+    order, starts, segments = row_segments(graph)
+    if not len(starts):
+        return graph
+
+    weights = graph.data[order]
+    counts = np.diff(np.append(starts, len(weights)))
+    mean = (np.add.reduceat(weights, starts) / counts)[segments]
+    stdev = np.sqrt(np.add.reduceat((weights - mean) ** 2, starts) / counts)[segments]
+
+    with np.errstate(divide="ignore", invalid="ignore"):  # constant rows
+        return with_data(graph, order, np.clip((0.5 + weights - mean) / stdev, 0.0, 1.0))
+
+
+def sparse_standardize(graph):
+    """Standardization by mean and standard deviation of all entries of a sparse graph, see CooMatrix.standardize.
+    A new CooMatrix is returned, so that the graph can be shared, e.g., by several target sentences.
+    """
+    data = graph.data - graph.data.mean()
+    data /= data.std()
+    return CooMatrix(graph.row, graph.col, data, graph.shape)
+
+
 def quantilize(sentence_matrix):
     pass
 
 
-def clip(x):  # helper shit
-    if x < 0:
-        return 0.0
-    elif x > 1:
-        return 1.0
-    else:
-        return x
-
 # softmax normalization by AJ
 if __name__ == "__main__":
 
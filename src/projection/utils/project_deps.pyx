@@ -1,4 +1,8 @@
+import os
 import cython
+from cython.parallel import prange
+from libc.math cimport NAN
+from libc.stdint cimport int64_t
 import numpy as np
 
 @cython.boundscheck(False)
@@ -17,10 +21,10 @@ def project_dependencies_faster(S, A):
 
         double align_prob_i_to_i, align_prob_j_to_j
 
-        # S is a sparse matrix the in coordinate format
-        int[:] source_row = S.row
-        int[:] source_col = S.col
-        double[:] source_data = S.data
+        # S is a sparse matrix the in coordinate format, possibly a read-only view into a graph store
+        const int[:] source_row = S.row
+        const int[:] source_col = S.col
+        const double[:] source_data = S.data
         double source_edge_score
 
 
@@ -87,4 +91,144 @@ def project_dependencies_fast(double[:,:] S, A):
             # TODO how do nans compare here
             T[t_i, t_j] = max(val, T[t_i, t_j])
 
-    return np.array(T, copy=False)
\ No newline at end of file
+    return np.array(T, copy=False)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void project_pair_packed(const int[:] source_row, const int[:] source_col, const double[:] source_data,
+                              Py_ssize_t source_begin, Py_ssize_t source_end,
+                              const int[:] align_indptr, const int[:] align_indices, const double[:] align_data,
+                              Py_ssize_t indptr_begin, Py_ssize_t align_begin,
+                              double[:] out, Py_ssize_t out_begin, Py_ssize_t n_plus_one) noexcept nogil:
+    # the same projection as project_dependencies_faster, for a single sentence pair of the packed batch
+    cdef:
+        Py_ssize_t i, k, l, s_i, s_j, t_i, t_j, cell
+        double source_edge_score, value
+
+    for cell in range(out_begin, out_begin + n_plus_one * n_plus_one):
+        out[cell] = NAN
+
+    for i in range(source_begin, source_end):
+        s_i = source_row[i]
+        s_j = source_col[i]
+        source_edge_score = source_data[i]
+
+        # Alignments for s_i
+        for k in range(align_begin + align_indptr[indptr_begin + s_i], align_begin + align_indptr[indptr_begin + s_i + 1]):
+            t_i = align_indices[k]
+
+            # Alignments for s_j
+            for l in range(align_begin + align_indptr[indptr_begin + s_j],
+                           align_begin + align_indptr[indptr_begin + s_j + 1]):
+                t_j = align_indices[l]
+
+                if t_i == t_j:
+                    continue
+
+                value = source_edge_score * align_data[k] * align_data[l]
+                cell = out_begin + t_i * n_plus_one + t_j
+
+                # max() with the empty (NaN) cell as the second argument, just like above
+                if not out[cell] > value:
+                    out[cell] = value
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def project_dependencies_packed(const int[:] source_row, const int[:] source_col, const double[:] source_data,
+                                const int64_t[:] source_offsets,
+                                const int[:] align_indptr, const int[:] align_indices, const double[:] align_data,
+                                const int64_t[:] indptr_offsets, const int64_t[:] align_offsets,
+                                const int[:] target_sizes, double[:] out, const int64_t[:] out_offsets,
+                                int num_threads):
+    """Projects a batch of sentence pairs into a preallocated output buffer, in parallel across sentence pairs.
+
+    The source graphs (COO) and alignment matrices (CSR) of all pairs are concatenated, and the offset tables
+    (of length batch size + 1) mark where each pair begins: source_offsets into the source arrays, indptr_offsets
+    into align_indptr, align_offsets into align_indices and align_data, and out_offsets into out, where the
+    (n+1 x n+1) target graph of each pair is written in row-major order, n+1 given by target_sizes. CSR index
+    pointers are local to each pair. The GIL is released for the whole batch.
+
+    :param num_threads: number of OpenMP threads
+    """
+    cdef Py_ssize_t b
+
+    with nogil:
+        for b in prange(target_sizes.shape[0], num_threads=num_threads, schedule="dynamic"):
+            project_pair_packed(source_row, source_col, source_data, source_offsets[b], source_offsets[b + 1],
+                                align_indptr, align_indices, align_data, indptr_offsets[b], align_offsets[b],
+                                out, out_offsets[b], target_sizes[b])
+
+
+def project_dependencies_batch(source_graphs, alignment_matrices, num_threads=None):
+    """Projects many sentence pairs in a single call, see project_dependencies_packed.
+
+    :param source_graphs: list of source graphs (m+1 x m+1) as CooMatrix
+    :param alignment_matrices: list of word alignment matrices (m+1 x n+1) in CSR format
+    :param num_threads: number of OpenMP threads, defaults to the number of CPUs
+    :return: list of (n+1 x n+1) target graphs, views into a single output buffer
+    """
+    target_sizes = [A.shape[1] for A in alignment_matrices]
+
+    out_offsets = np.cumsum([0] + [n_plus_one * n_plus_one for n_plus_one in target_sizes], dtype=np.int64)
+    out = np.empty(out_offsets[-1], dtype=np.float64)
+
+    def packed(arrays, dtype):
+        return np.concatenate([np.asarray(array, dtype=dtype) for array in arrays]) if arrays else np.zeros(0, dtype)
+
+    def offsets(arrays):
+        return np.cumsum([0] + [len(array) for array in arrays], dtype=np.int64)
+
+    source_rows = [S.row for S in source_graphs]
+    align_indptrs = [A.indptr for A in alignment_matrices]
+    align_indices = [A.indices for A in alignment_matrices]
+
+    project_dependencies_packed(packed(source_rows, np.int32), packed([S.col for S in source_graphs], np.int32),
+                                packed([S.data for S in source_graphs], np.float64), offsets(source_rows),
+                                packed(align_indptrs, np.int32), packed(align_indices, np.int32),
+                                packed([A.data for A in alignment_matrices], np.float64),
+                                offsets(align_indptrs), offsets(align_indices),
+                                np.array(target_sizes, dtype=np.int32), out, out_offsets, num_threads or os.cpu_count())
+
+    return [out[out_offsets[b]:out_offsets[b + 1]].reshape(n_plus_one, n_plus_one)
+            for b, n_plus_one in enumerate(target_sizes)]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def project_dependencies_fused(source_graphs, alignment_matrices, source_weights=None):
+    """Projects all aligned sources onto a single target sentence and accumulates the voted weight matrix directly,
+    i.e., the NaN-ignoring sum over the sources of their (optionally weighted) target graphs, without materializing
+    the target graphs of the individual sources. Only the max-projection of the current source is kept.
+
+    :param source_graphs: list of source graphs (m+1 x m+1) as CooMatrix, one per source
+    :param alignment_matrices: list of word alignment matrices (m+1 x n+1) in CSR format, one per source
+    :param source_weights: list of per-source weights the target graphs are multiplied with, if any
+    :return: (n+1 x n+1) voted weight matrix, zero for cells without projections
+    """
+    n_plus_one = alignment_matrices[0].shape[1]
+    voted = np.zeros(n_plus_one * n_plus_one)
+    current = np.empty(n_plus_one * n_plus_one)
+
+    cdef:
+        double[:] voted_view = voted
+        double[:] current_view = current
+        const int[:] source_row, source_col, align_indptr, align_indices
+        const double[:] source_data, align_data
+        double weight
+        Py_ssize_t cell, cells = n_plus_one * n_plus_one, size = n_plus_one
+
+    for k in range(len(source_graphs)):
+        S, A = source_graphs[k], alignment_matrices[k]
+        source_row, source_col, source_data = S.row, S.col, S.data
+        align_indptr, align_indices, align_data = A.indptr, A.indices, A.data
+        weight = 1.0 if source_weights is None else source_weights[k]
+
+        with nogil:
+            project_pair_packed(source_row, source_col, source_data, 0, source_row.shape[0],
+                                align_indptr, align_indices, align_data, 0, 0, current_view, 0, size)
+            for cell in range(cells):
+                if current_view[cell] == current_view[cell]:  # not NaN
+                    voted_view[cell] += current_view[cell] * weight
+
+    return voted.reshape(n_plus_one, n_plus_one)
@@ -0,0 +1,217 @@
+import os
+from collections import Counter
+from pathlib import Path
+import numpy as np
+import utils.alignments as align
+from utils.coo_matrix_nocheck import CooMatrix
+
+
+def project_sentence(target_length, source_graph, source_pos_tags, walign_pairs, walign_probs,
+                     project_dependencies, binary=False, normalize_after=None, similarity=None):
+    """Projects POS tags and the dependency graph of a single source sentence onto its aligned target sentence.
+
+    :param target_length: number of tokens in the target sentence
+    :param source_graph: source graph (m+1 x m+1) as CooMatrix, dependents are rows and heads are columns
+    :param source_pos_tags: list of source POS tags ordered by source token id
+    :param walign_pairs: word alignment pairs, 0-indexed (source id, target id)
+    :param walign_probs: probabilities corresponding to the alignment pairs
+    :param project_dependencies: projection function taking the source graph and the alignment matrix
+    :param binary: use binary alignments instead of alignment probabilities
+    :param normalize_after: normalization applied to the target matrix, if any
+    :param similarity: language pair similarity factor applied to the target matrix, if any
+    :return: <POS vote counters indexed by target token id, (n+1 x n+1) target matrix> pair; the target matrix is a
+        CooMatrix for projectors that output head vectors, like DCA
+    """
+    m = source_graph.shape[0] - 1
+
+    P = align.project_token_labels(source_pos_tags, walign_pairs, walign_probs)
+
+    # the +1 in the dimensions accommodates for the pseudo-roots
+    A_sparse = align.get_alignment_matrix((m + 1, target_length + 1), walign_pairs, walign_probs, binary)
+    T = project_dependencies(source_graph, A_sparse)
+
+    if normalize_after is not None:
+        T = normalize_after(T)
+
+    if similarity is not None:
+        T *= similarity
+
+    return P, T
+
+
+def project_sentence_batch(batch, project_dependencies_batch, binary=False, normalize_after=None, similarity=None):
+    """Projects a batch of source sentences onto their aligned target sentences with a single call of the batch
+    projection function, see project_sentence.
+
+    :param batch: list of <target length, source graph, source POS tags, word alignment pairs, probabilities> tuples
+    :param project_dependencies_batch: projection function taking lists of source graphs and alignment matrices
+    :param binary: use binary alignments instead of alignment probabilities
+    :param normalize_after: normalization applied to the target matrices, if any
+    :param similarity: language pair similarity factor applied to the target matrices, if any
+    :return: list of <POS vote counters indexed by target token id, (n+1 x n+1) target matrix> pairs
+    """
+    Ps = [align.project_token_labels(source_pos_tags, walign_pairs, walign_probs)
+          for _, _, source_pos_tags, walign_pairs, walign_probs in batch]
+
+    source_graphs = [source_graph for _, source_graph, _, _, _ in batch]
+    alignment_matrices = [align.get_alignment_matrix((source_graph.shape[0], target_length + 1),
+                                                     walign_pairs, walign_probs, binary)
+                          for target_length, source_graph, _, walign_pairs, walign_probs in batch]
+    Ts = project_dependencies_batch(source_graphs, alignment_matrices)
+
+    if normalize_after is not None:
+        Ts = [normalize_after(T) for T in Ts]
+
+    if similarity is not None:
+        for T in Ts:
+            T *= similarity
+
+    return list(zip(Ps, Ts))
+
+
+def get_aligned_pair(target_sid, sentence_alignments, word_alignments):
+    """Looks up the source sentence and the word alignments for a target sentence.
+
+    :param target_sid: target sentence id
+    :param sentence_alignments: sentence alignments as read by utils.alignments.read_alignments
+    :param word_alignments: word alignments as read by utils.alignments.read_alignments
+    :return: <source sentence id, word alignment pairs, probabilities> or None if the target sentence is unmatched
+    """
+    if target_sid not in sentence_alignments:
+        return None
+
+    source_sid, _ = sentence_alignments[target_sid]
+
+    # unmatched = not in alignment or alignment empty
+    if word_alignments.get((target_sid, source_sid)) is None:
+        return None
+
+    walign_pairs, walign_probs = word_alignments[(target_sid, source_sid)]
+    return source_sid, walign_pairs, walign_probs
+
+
+def format_dummy_sentence(target_sentence):
+    """Formats the placeholder block for an unmatched target sentence, to maintain the number of lines/sentences.
+    """
+    return "_\n" * len(target_sentence) + "\n"
+
+
+def format_head_scores(rows, sparse=False):
+    """Formats the rows of a target matrix, one string per row.
+
+    :param rows: (n x n+1) target matrix rows
+    :param sparse: write head:score pairs for the non-NaN cells instead of all n+1 cells
+    :return: list of formatted rows
+    """
+    if not sparse:
+        # tolist() turns the whole matrix into Python floats at once, their repr is identical to str() of the cells
+        return [" ".join(map(repr, row)) for row in rows.tolist()]
+
+    mask = ~np.isnan(rows)
+    row_ends = np.cumsum(mask.sum(axis=1)).tolist()
+    pairs = ["%d:%r" % pair for pair in zip(np.nonzero(mask)[1].tolist(), rows[mask].tolist())]
+
+    return [" ".join(pairs[begin:end]) for begin, end in zip([0] + row_ends[:-1], row_ends)]
+
+
+def format_head_vector(T, token_ids):
+    """Formats the entries of a sparse target matrix as head:score pairs, one string per token.
+
+    :param T: (n+1 x n+1) target matrix as CooMatrix, e.g., the head vector of a DCA projection
+    :param token_ids: target token ids
+    :return: list of formatted rows, empty for tokens without entries
+    """
+    pairs = {token_id: [] for token_id in token_ids}
+    for dependent, head, score in sorted(zip(T.row.tolist(), T.col.tolist(), T.data.tolist())):
+        pairs[dependent].append("%d:%r" % (head, score))
+    return [" ".join(pairs[token_id]) for token_id in token_ids]
+
+
+def format_projected_sentence(source_language_name, target_sentence, P, T, sparse=False):
+    """Formats the projected POS votes and weight matrix rows for a target sentence, one line per token.
+
+    :param source_language_name: flags the lines with the source language
+    :param target_sentence: list of target tokens
+    :param P: POS vote counters indexed by target token id
+    :param T: (n+1 x n+1) target matrix, or a CooMatrix that is always written as head:score pairs
+    :param sparse: write head:score pairs for the non-NaN cells instead of all n+1 cells
+    :return: the sentence block
+    """
+    token_ids = [token.idx for token in target_sentence]
+    if isinstance(T, CooMatrix):
+        head_scores = format_head_vector(T, token_ids)
+    else:
+        head_scores = format_head_scores(T[token_ids], sparse)
+
+    lines = []
+    for token_id, token_head_scores in zip(token_ids, head_scores):
+        # get the POS projections for the current target token
+        # if there are no projections, propagate the dummy tag
+        projected_tags = P.get(token_id) if token_id in P else Counter({"_": 0})
+
+        lines.append("%s\t%s\t%s\n" % (source_language_name,
+                                        " ".join(["%s:%s" % t for t in projected_tags.most_common()]),
+                                        token_head_scores))
+    lines.append("\n")
+
+    return "".join(lines)
+
+
+class ProjectionWriter:
+    """
+    Writes projected sentences in the projection file format, collecting the formatted sentence blocks and
+    writing them through to the file in large chunks.
+
+    Given a path instead of a file handle, the writer owns the file: it writes to a temporary file, which is moved
+    into place on close, and removed when the writer is left with an exception, so that a failed run does not leave
+    a partial projection file behind.
+    """
+    def __init__(self, file, sparse=False, buffer_size=1 << 22):
+        self.output_file = None
+        if isinstance(file, (str, Path)):
+            self.output_file = Path(file)
+            self.temporary_file = self.output_file.with_name(self.output_file.name + ".tmp")
+            file = self.temporary_file.open("w")
+        self.file = file
+        self.sparse = sparse
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, block):
+        self.buffer.append(block)
+        self.buffered += len(block)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write_dummy_sentence(self, target_sentence):
+        self.write(format_dummy_sentence(target_sentence))
+
+    def write_projected_sentence(self, source_language_name, target_sentence, P, T):
+        self.write(format_projected_sentence(source_language_name, target_sentence, P, T, self.sparse))
+
+    def flush(self):
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.output_file is not None:
+            self.file.close()
+            os.replace(str(self.temporary_file), str(self.output_file))
+
+    def discard(self):
+        """Removes the temporary file of an owned file, without writing the projection file."""
+        self.file.close()
+        self.temporary_file.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.output_file is not None:
+            self.discard()
+        else:
+            self.close()
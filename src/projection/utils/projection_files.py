@@ -0,0 +1,267 @@
+import os
+import shutil
+import tempfile
+import warnings
+import zipfile
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from utils.coo_matrix_nocheck import CooMatrix
+
+
+class SentenceProjection:
+    """
+    Projections from a single source onto a single target sentence: per-token POS votes, and the projected
+    weight matrix as sparse edges (dependent token id, head token id, score), NaN cells left out.
+    """
+    __slots__ = ['language', 'pos_votes', 'deps', 'heads', 'scores']
+
+    def __init__(self, language, pos_votes, deps, heads, scores):
+        self.language = language
+        self.pos_votes = pos_votes  # per target token, list of (tag, vote) pairs in most-common order
+        self.deps = deps
+        self.heads = heads
+        self.scores = scores
+
+
+def parse_numbers(rows, counts):
+    """Parses the numbers of all rows at once, and checks that every row has the given count of numbers.
+
+    :param rows: strings of numbers separated by whitespace, head:score pairs counting as two numbers
+    :param counts: expected count of numbers per row
+    :return: array of all numbers, in order
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")  # older NumPy versions stop at the first malformed number with a warning
+            numbers = np.fromstring(" ".join(rows).replace(":", " "), sep=" ")
+    except (ValueError, DeprecationWarning):
+        numbers = None
+
+    if numbers is None or len(numbers) != sum(counts):
+        # find the row to blame
+        for token_id, (row, count) in enumerate(zip(rows, counts), 1):
+            row_numbers = row.replace(":", " ").split()
+            if len(row_numbers) != count:
+                raise ValueError("Row %d of the block has %d values instead of %d: %r" %
+                                 (token_id, len(row_numbers), count, row))
+            try:
+                np.array(row_numbers, dtype=np.float64)
+            except ValueError:
+                raise ValueError("Row %d of the block has a malformed value: %r" % (token_id, row)) from None
+        raise ValueError("Malformed head scores in a block of %d rows." % len(rows))
+
+    return numbers
+
+
+def parse_block_head_scores(rows):
+    """Parses the head scores of all tokens of a sentence block at once, from the full weight matrix rows or from
+    head:score pairs, with a single NumPy conversion of the whole column. Rows with a malformed value, or with other
+    than n+1 cells in a full weight matrix row, raise a ValueError.
+
+    :param rows: head scores parts of the lines of a sentence block, one per target token
+    :return: <dependent ids, head ids, scores> arrays, ordered by dependent and head, NaN scores left out
+    """
+    if any(":" in row for row in rows):
+        counts = [row.count(":") for row in rows]
+        pairs = parse_numbers(rows, [2 * count for count in counts]).reshape(-1, 2)
+        heads, scores = pairs[:, 0].astype(np.int32), pairs[:, 1]
+    elif any(row.strip() for row in rows):
+        counts = [len(rows) + 1] * len(rows)  # the full rows have a cell per target token and the root
+        scores = parse_numbers(rows, counts)
+        heads = np.tile(np.arange(len(rows) + 1, dtype=np.int32), len(rows))
+    else:
+        counts = [0] * len(rows)  # head:score pairs, none projected
+        heads, scores = np.zeros(0, dtype=np.int32), np.zeros(0)
+
+    deps = np.repeat(np.arange(1, len(rows) + 1, dtype=np.int32), counts)
+    not_nan = ~np.isnan(scores)
+
+    return deps[not_nan], heads[not_nan], scores[not_nan]
+
+
+def parse_text_block(lines):
+    """Parses a sentence block of a text projection file.
+
+    :param lines: the token lines of the block
+    :return: SentenceProjection, or None if the target sentence was unmatched for this source
+    """
+    if not lines or len(lines[0].split("\t")) != 3:
+        return None  # placeholder block
+
+    columns = [line.split("\t") for line in lines]
+
+    pos_votes = [[(pos, float(num)) for pos, num in [vote.rsplit(":", 1) for vote in source_pos_votes.split()]]
+                 for _, source_pos_votes, _ in columns]
+    deps, heads, scores = parse_block_head_scores([source_head_votes for _, _, source_head_votes in columns])
+
+    return SentenceProjection(columns[-1][0], pos_votes, deps, heads, scores)
+
+
+def read_text_projections(projection_file):
+    """Sentence generator for text projection files, as written by project.py.
+
+    :param projection_file: path to the projection file
+    :return: yields a SentenceProjection, or None for unmatched sentences, per target sentence
+    """
+    with Path(projection_file).open() as projection_file_handle:
+        lines = []
+        for line in projection_file_handle:
+            if line == "\n":
+                yield parse_text_block(lines)
+                lines = []
+            else:
+                lines.append(line.rstrip("\n"))
+
+
+def read_shard_projections(shard_file):
+    """Sentence generator for binary projection shards, as written by ShardWriter.
+
+    :param shard_file: path to the .npz shard
+    :return: yields a SentenceProjection, or None for unmatched sentences, per target sentence
+    """
+    with np.load(str(shard_file)) as shard:
+        language = str(shard["language"])
+        tags = shard["tags"].tolist()
+        matched = shard["matched"]
+        edge_offsets, pos_offsets = shard["edge_offsets"], shard["pos_offsets"]
+        edge_dep, edge_head, edge_score = shard["edge_dep"], shard["edge_head"], shard["edge_score"]
+        pos_token, pos_tag, pos_vote = shard["pos_token"], shard["pos_tag"], shard["pos_vote"]
+        sentence_lengths = shard["sentence_lengths"]
+
+    for sid in range(len(matched)):
+        if not matched[sid]:
+            yield None
+            continue
+
+        pos_votes = [[] for _ in range(sentence_lengths[sid])]
+        begin, end = pos_offsets[sid], pos_offsets[sid + 1]
+        for token_id, tag, vote in zip(pos_token[begin:end].tolist(), pos_tag[begin:end].tolist(),
+                                       pos_vote[begin:end].tolist()):
+            pos_votes[token_id - 1].append((tags[tag], vote))
+
+        begin, end = edge_offsets[sid], edge_offsets[sid + 1]
+        yield SentenceProjection(language, pos_votes, edge_dep[begin:end], edge_head[begin:end], edge_score[begin:end])
+
+
+def read_projections(projection_file):
+    """Sentence generator for projection files, binary shards (.npz) or text."""
+    if Path(projection_file).suffix == ".npz":
+        return read_shard_projections(projection_file)
+    return read_text_projections(projection_file)
+
+
+# the arrays of a shard that grow with the target, per sentence or per edge and POS vote, with their types
+SHARD_PARTS = {"sentence_lengths": np.int32, "matched": bool, "edge_lengths": np.int64, "pos_lengths": np.int64,
+               "edge_dep": np.int32, "edge_head": np.int32, "edge_score": np.float64,
+               "pos_token": np.int32, "pos_tag": np.int32, "pos_vote": np.float64}
+
+
+class ShardWriter:
+    """
+    Collects the projections of a single source onto all target sentences and writes them to a binary .npz shard:
+    sparse edge arrays, POS vote arrays with a tag vocabulary, and per-sentence offset tables. It has the same
+    interface as utils.projection.ProjectionWriter.
+
+    The arrays are written through to part files next to the shard in chunks of about buffer_size entries, and put
+    together into the shard on close. The shard is written to a temporary file first and then moved into place, and
+    when the writer is left with an exception, it is not written at all.
+    """
+    def __init__(self, shard_file, buffer_size=1 << 20):
+        self.shard_file = Path(shard_file)
+        self.buffer_size = buffer_size
+        self.language = ""
+        self.tags = {}
+        self.buffer = {name: [] for name in SHARD_PARTS}
+        self.buffered = 0
+        self.parts_directory = Path(tempfile.mkdtemp(prefix=self.shard_file.name + ".", suffix=".parts",
+                                                     dir=str(self.shard_file.parent)))
+        self.part_files = {name: (self.parts_directory / name).open("wb") for name in SHARD_PARTS}
+
+    def append(self, **arrays):
+        for name, array in arrays.items():
+            self.buffer[name].append(np.asarray(array, dtype=SHARD_PARTS[name]))
+            self.buffered += len(array)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def write_dummy_sentence(self, target_sentence):
+        self.append(sentence_lengths=[len(target_sentence)], matched=[False], edge_lengths=[0], pos_lengths=[0])
+
+    def write_projected_sentence(self, source_language_name, target_sentence, P, T):
+        self.language = source_language_name
+
+        token_ids = [token.idx for token in target_sentence]
+        if isinstance(T, CooMatrix):
+            # head vector, e.g., from DCA: the entries are the edges
+            order = np.lexsort((T.col, T.row))
+            deps, heads, scores = T.row[order], T.col[order], T.data[order]
+        else:
+            rows = T[token_ids]
+            not_nan = ~np.isnan(rows)
+            deps, heads = np.nonzero(not_nan)
+            deps, scores = np.array(token_ids)[deps], rows[not_nan]
+
+        pos_tokens, pos_tags, pos_votes = [], [], []
+        for token_id in token_ids:
+            # if there are no projections, propagate the dummy tag, just like the text output does
+            projected_tags = P.get(token_id) if token_id in P else Counter({"_": 0})
+            for tag, vote in projected_tags.most_common():
+                pos_tokens.append(token_id)
+                pos_tags.append(self.tags.setdefault(tag, len(self.tags)))
+                pos_votes.append(vote)
+
+        self.append(sentence_lengths=[len(target_sentence)], matched=[True],
+                    edge_lengths=[len(deps)], edge_dep=deps, edge_head=heads, edge_score=scores,
+                    pos_lengths=[len(pos_tokens)], pos_token=pos_tokens, pos_tag=pos_tags, pos_vote=pos_votes)
+
+    def flush(self):
+        for name, arrays in self.buffer.items():
+            if arrays:
+                np.concatenate(arrays).tofile(self.part_files[name])
+                arrays.clear()
+        self.buffered = 0
+
+    def read_part(self, name):
+        """The part file of an array, memory-mapped."""
+        part_file = self.parts_directory / name
+        if part_file.stat().st_size == 0:
+            return np.zeros(0, dtype=SHARD_PARTS[name])
+        return np.memmap(str(part_file), dtype=SHARD_PARTS[name], mode="r")
+
+    def close(self):
+        self.flush()
+        for part_file_handle in self.part_files.values():
+            part_file_handle.close()
+
+        arrays = {"language": np.array(self.language),
+                  "tags": np.array(sorted(self.tags, key=self.tags.get), dtype=str),
+                  "edge_offsets": np.cumsum(np.append(0, self.read_part("edge_lengths"))),
+                  "pos_offsets": np.cumsum(np.append(0, self.read_part("pos_lengths")))}
+        arrays.update({name: self.read_part(name) for name in SHARD_PARTS if not name.endswith("_lengths")})
+        arrays["sentence_lengths"] = self.read_part("sentence_lengths")
+
+        # the same layout as np.savez, but the arrays are copied from the part files in chunks
+        temporary_shard_file = self.shard_file.with_name(self.shard_file.name + ".tmp")
+        with zipfile.ZipFile(str(temporary_shard_file), "w", allowZip64=True) as shard_zip:
+            for name, array in arrays.items():
+                with shard_zip.open(name + ".npy", "w", force_zip64=True) as array_file_handle:
+                    np.lib.format.write_array(array_file_handle, np.asarray(array), allow_pickle=False)
+        del arrays  # the memory maps, before the part files are removed
+        os.replace(str(temporary_shard_file), str(self.shard_file))
+        shutil.rmtree(str(self.parts_directory))
+
+    def discard(self):
+        """Removes the part files, without writing the shard."""
+        for part_file_handle in self.part_files.values():
+            part_file_handle.close()
+        shutil.rmtree(str(self.parts_directory), ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,411 @@
+import json
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+from utils.alignment_store import file_signature
+from utils.projection_files import read_projections
+
+# per target sentence: length, number of contributing sources, number of unaligned token votes, and the stored
+# voting results: whether they are up to date, the tree score margin, and the heads (one per token, flat)
+# arc sums: keys (sentence, dependent, head) packed into int64 and sorted, summed scores and number of sources
+# POS sums: keys (sentence, token, tag) packed into int64 and sorted, summed votes, number of sources, and the first
+# vote for the tag, (source rank, position among the votes of the source) packed, which breaks the ties
+CACHE_ARRAYS = ("sentence_lengths", "contributors", "unaligned", "decoded", "margins", "heads",
+                "arc_keys", "arc_sums", "arc_counts",
+                "pos_keys", "pos_sums", "pos_counts", "pos_firsts")
+
+# per source: matched target sentences, and the projected arcs and POS votes with their target sentence ids
+CONTRIBUTION_ARRAYS = ("matched",
+                       "edge_sentence", "edge_dep", "edge_head", "edge_score",
+                       "pos_sentence", "pos_token", "pos_tag", "pos_vote", "pos_position")
+
+NO_FIRST = np.iinfo(np.int64).max
+
+
+def pack_keys(sentences, dependents, heads):
+    return (np.asarray(sentences, dtype=np.int64) << 32) | (np.asarray(dependents, dtype=np.int64) << 16) | \
+           np.asarray(heads, dtype=np.int64)
+
+
+def target_sentence_lengths(target_file):
+    """Numbers of tokens of the sentences of a CoNLL file, read as utils.conll.get_next_sentence would."""
+    lengths = []
+    length = 0
+    with Path(target_file).open() as target_file_handle:
+        for line in target_file_handle:
+            if line.strip():
+                length += 1
+            else:
+                lengths.append(length)
+                length = 0
+    if length:
+        lengths.append(length)
+    return lengths
+
+
+def read_contribution(projection_file, number_of_sentences, tags):
+    """Reads a projection file, text or binary shard, into the flat arrays of a source contribution.
+
+    :param projection_file: path to the projection file
+    :param number_of_sentences: number of target sentences the projection file must have
+    :param tags: POS tag vocabulary, tag -> id, extended with the new tags
+    :return: <source language, dict of contribution arrays, see CONTRIBUTION_ARRAYS> pair
+    """
+    language = None
+    matched = np.zeros(number_of_sentences, dtype=bool)
+    edge_sentences, edge_deps, edge_heads, edge_scores = [], [], [], []
+    pos_sentences, pos_tokens, pos_tags, pos_votes, pos_positions = [], [], [], [], []
+
+    sid = -1
+    for sid, projection in enumerate(read_projections(projection_file)):
+        if projection is None:
+            continue
+        matched[sid] = True
+        language = projection.language
+
+        edge_sentences.append(np.full(len(projection.deps), sid, dtype=np.int64))
+        edge_deps.append(projection.deps)
+        edge_heads.append(projection.heads)
+        edge_scores.append(projection.scores)
+
+        for token_id, token_pos_votes in enumerate(projection.pos_votes, 1):
+            for position, (tag, vote) in enumerate(token_pos_votes):
+                pos_sentences.append(sid)
+                pos_tokens.append(token_id)
+                pos_tags.append(tags.setdefault(tag, len(tags)))
+                pos_votes.append(vote)
+                pos_positions.append(position)
+
+    if sid + 1 != number_of_sentences:
+        raise ValueError("%s has %s sentences, the target has %s." % (projection_file, sid + 1, number_of_sentences))
+
+    def concatenate(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+    return language, {"matched": matched,
+                      "edge_sentence": concatenate(edge_sentences, np.int64),
+                      "edge_dep": concatenate(edge_deps, np.int64),
+                      "edge_head": concatenate(edge_heads, np.int64),
+                      "edge_score": concatenate(edge_scores, np.float64),
+                      "pos_sentence": np.array(pos_sentences, dtype=np.int64),
+                      "pos_token": np.array(pos_tokens, dtype=np.int64),
+                      "pos_tag": np.array(pos_tags, dtype=np.int64),
+                      "pos_vote": np.array(pos_votes, dtype=np.float64),
+                      "pos_position": np.array(pos_positions, dtype=np.int64)}
+
+
+def merge_sums(keys, sums, counts, new_keys, new_values, sign):
+    """Adds (sign 1) or subtracts (sign -1) values to or from running sums by key, and drops the keys that no source
+    contributes to anymore. The new values are added after the running sums, in their order, so that adding the
+    sources one by one sums them just like summing over all of them at once does.
+
+    :return: <keys, sums, counts, merged position of every input key, kept merged positions> 5-tuple
+    """
+    merged_keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    inverse = inverse.ravel()
+    merged_sums = np.bincount(inverse, weights=np.concatenate([sums, sign * new_values]), minlength=len(merged_keys))
+    merged_counts = np.bincount(inverse, weights=np.concatenate([counts, np.full(len(new_keys), sign)]),
+                                minlength=len(merged_keys)).astype(np.int64)
+    kept = merged_counts > 0
+    return merged_keys[kept], merged_sums[kept], merged_counts[kept], inverse, kept
+
+
+class VoteCache:
+    """
+    Incremental voting over a set of sources for a single target file. The cache directory keeps the contribution
+    of every source, the running sums of the projected arc scores and POS votes over all sources, and the last voting
+    results per target sentence. Adding or removing a source updates the running sums by its contribution only, and
+    invalidates the results of the sentences it contributes to, so that only these need to be decoded again. The arc
+    scores of a source are weighted by its source weight, if any, which is changed in place the same way.
+
+    The sources are ordered like the projection files of the last update, which breaks POS vote ties just like a fresh
+    vote over these files does. Sums after removing a source may differ from a fresh vote in the last bits, as the
+    contribution is subtracted from the running sums.
+
+    The metadata marks a complete cache: it is removed before the source files or arrays on disk change, and written
+    again by save() only after them, so a cache left behind by an interrupted run is started over.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = Path(cache_path)
+        self.meta = None
+        self.arrays = {}
+        self._token_offsets = None
+
+        if self.meta_file.is_file():
+            with self.meta_file.open() as meta_handle:
+                self.meta = json.load(meta_handle)
+            self.arrays = {name: np.load(str(self.cache_path / (name + ".npy"))) for name in CACHE_ARRAYS}
+
+    def __len__(self):
+        return len(self.arrays["sentence_lengths"])
+
+    @property
+    def token_offsets(self):
+        """Offsets of the sentences into the flat heads array."""
+        if self._token_offsets is None:
+            self._token_offsets = np.cumsum(np.append(0, self.arrays["sentence_lengths"])).tolist()
+        return self._token_offsets
+
+    @property
+    def sources(self):
+        """Paths of the sources in the cache, in their order."""
+        return [source["path"] for source in self.meta["sources"]]
+
+    @property
+    def meta_file(self):
+        return self.cache_path / "meta.json"
+
+    def source_file(self, rank):
+        return self.cache_path / "sources" / ("%d.npz" % rank)
+
+    def invalidate(self):
+        """Removes the metadata from disk, before the files of the cache change, until the next save()."""
+        if self.meta_file.is_file():
+            self.meta_file.unlink()
+
+    def reset(self, target_file, unit_vote_pos):
+        """Empties the cache, for a new target file."""
+        self.invalidate()
+        shutil.rmtree(str(self.cache_path / "sources"), ignore_errors=True)
+        (self.cache_path / "sources").mkdir(parents=True, exist_ok=True)
+
+        sentence_lengths = np.array(target_sentence_lengths(target_file), dtype=np.int64)
+        self.meta = {"target": {"path": str(Path(target_file).resolve()), **file_signature(target_file)},
+                     "unit_vote_pos": unit_vote_pos,
+                     "decoding": None,
+                     "tags": [],
+                     "sources": [],
+                     "next_rank": 0}
+        self.arrays = {"sentence_lengths": sentence_lengths,
+                       "decoded": np.zeros(len(sentence_lengths), dtype=bool),
+                       "margins": np.full(len(sentence_lengths), np.nan),
+                       "heads": np.zeros(sentence_lengths.sum(), dtype=np.int64)}
+        self._token_offsets = None
+        self.clear_sums()
+
+    def clear_sums(self):
+        number_of_sentences = len(self.arrays["sentence_lengths"])
+        self.arrays.update({"contributors": np.zeros(number_of_sentences, dtype=np.int64),
+                            "unaligned": np.zeros(number_of_sentences, dtype=np.int64),
+                            "arc_keys": np.zeros(0, dtype=np.int64),
+                            "arc_sums": np.zeros(0),
+                            "arc_counts": np.zeros(0, dtype=np.int64),
+                            "pos_keys": np.zeros(0, dtype=np.int64),
+                            "pos_sums": np.zeros(0),
+                            "pos_counts": np.zeros(0, dtype=np.int64),
+                            "pos_firsts": np.zeros(0, dtype=np.int64)})
+
+    def update(self, projection_files, target_file, unit_vote_pos, decoding, source_weights=None):
+        """Brings the cache to the given sources: removes the sources that are not among them, or whose files changed
+        since they were added, adds the new ones, and orders the sources like the projection files.
+
+        :param projection_files: paths to the projection files of the sources
+        :param target_file: path to the target CoNLL file, the cache starts over for another target
+        :param unit_vote_pos: unit votes for POS tag voting, the running sums are rebuilt if this changes
+        :param decoding: JSON-serializable description of the decoding, the stored results are dropped if it changes
+        :param source_weights: dict of source language -> weight of its arc scores, other sources get 1
+        :return: <removed paths, added paths> pair
+        """
+        if self.meta is None or self.meta["target"] != {"path": str(Path(target_file).resolve()),
+                                                        **file_signature(target_file)}:
+            self.reset(target_file, unit_vote_pos)
+
+        if self.meta["unit_vote_pos"] != unit_vote_pos:
+            self.meta["unit_vote_pos"] = unit_vote_pos
+            self.clear_sums()
+            for source in self.meta["sources"]:
+                self.accumulate(self.load_contribution(source["rank"]), 1, source["rank"], source["weight"])
+
+        if self.meta["decoding"] != decoding:
+            self.meta["decoding"] = decoding
+            self.arrays["decoded"][:] = False
+
+        wanted = {str(Path(projection_file).resolve()): projection_file for projection_file in projection_files}
+
+        removed = [source for source in self.meta["sources"]
+                   if source["path"] not in wanted or source["signature"] != file_signature(source["path"])]
+        for source in removed:
+            self.remove_source(source)
+
+        source_weights = source_weights or {}
+        for source in self.meta["sources"]:
+            if source_weights.get(source["language"], 1.0) != source["weight"]:
+                self.reweight_source(source, source_weights.get(source["language"], 1.0))
+
+        cached = set(self.sources)
+        added = [path for path in wanted if path not in cached]
+        for path in added:
+            self.add_source(wanted[path], source_weights)
+
+        # POS vote ties go to the source that comes first among the projection files, as in a fresh vote, so the
+        # ranks have to follow their order
+        positions = {path: position for position, path in enumerate(wanted)}
+        self.meta["sources"].sort(key=lambda source: positions[source["path"]])
+        ranks = [source["rank"] for source in self.meta["sources"]]
+        if ranks != sorted(ranks):
+            self.rerank_sources()
+
+        return [source["path"] for source in removed], added
+
+    def rerank_sources(self):
+        """Renumbers the sources in their order, and sums them up again in that order, as a fresh vote does. Only the
+        results of the sentences whose arc sums change are dropped."""
+        sources = self.meta["sources"]
+        self.invalidate()
+        for source in sources:
+            self.source_file(source["rank"]).rename(self.source_file(source["rank"]).with_suffix(".rerank"))
+        for rank, source in enumerate(sources):
+            self.source_file(source["rank"]).with_suffix(".rerank").rename(self.source_file(rank))
+            source["rank"] = rank
+        self.meta["next_rank"] = len(sources)
+
+        arrays = self.arrays
+        decoded, arc_keys, arc_sums = arrays["decoded"].copy(), arrays["arc_keys"], arrays["arc_sums"]
+        self.clear_sums()
+        for source in sources:
+            self.accumulate(self.load_contribution(source["rank"]), 1, source["rank"], source["weight"])
+
+        # the same sources project the same arcs, only the sums may differ in the last bits
+        decoded[arc_keys[arc_sums != arrays["arc_sums"]] >> 32] = False
+        arrays["decoded"] = decoded
+
+    def add_source(self, projection_file, source_weights):
+        tags = {tag: tag_id for tag_id, tag in enumerate(self.meta["tags"])}
+        language, contribution = read_contribution(projection_file, len(self), tags)
+        weight = source_weights.get(language, 1.0)
+        self.meta["tags"] = sorted(tags, key=tags.get)
+
+        rank = self.meta["next_rank"]
+        self.meta["next_rank"] += 1
+        self.invalidate()
+        # the ids are stored as int32, they fit into the 16 bits of the keys anyway
+        with self.source_file(rank).open("wb") as source_file_handle:
+            np.savez(source_file_handle, **{name: array.astype(np.int32) if array.dtype == np.int64 else array
+                                            for name, array in contribution.items()})
+
+        self.accumulate(contribution, 1, rank, weight)
+        self.meta["sources"].append({"path": str(Path(projection_file).resolve()), "rank": rank,
+                                     "signature": file_signature(projection_file),
+                                     "language": language, "weight": weight})
+
+    def remove_source(self, source):
+        self.meta["sources"].remove(source)
+        self.accumulate(self.load_contribution(source["rank"]), -1, source["rank"], source["weight"])
+        self.invalidate()
+        self.source_file(source["rank"]).unlink()
+
+    def reweight_source(self, source, weight):
+        """Replaces the weighted arc scores of a source in the running sums, its POS votes are not weighted."""
+        arrays = self.arrays
+        contribution = self.load_contribution(source["rank"])
+        keys = pack_keys(contribution["edge_sentence"], contribution["edge_dep"], contribution["edge_head"])
+        for sign, source_weight in ((-1, source["weight"]), (1, weight)):
+            arrays["arc_keys"], arrays["arc_sums"], arrays["arc_counts"], _, _ = \
+                merge_sums(arrays["arc_keys"], arrays["arc_sums"], arrays["arc_counts"], keys,
+                           contribution["edge_score"] * source_weight, sign)
+        arrays["decoded"][contribution["matched"]] = False
+        source["weight"] = weight
+
+    def load_contribution(self, rank):
+        with np.load(str(self.source_file(rank))) as contribution:
+            return {name: contribution[name].astype(np.int64) if contribution[name].dtype == np.int32
+                    else contribution[name] for name in CONTRIBUTION_ARRAYS}
+
+    def accumulate(self, contribution, sign, rank, weight=1.0):
+        """Adds (sign 1) or subtracts (sign -1) the contribution of a source to or from the running sums, its arc
+        scores weighted by the source weight, and invalidates the results of the sentences it contributes to.
+        """
+        arrays = self.arrays
+        matched = contribution["matched"]
+        arrays["contributors"] += sign * matched
+        arrays["decoded"][matched] = False
+
+        arrays["arc_keys"], arrays["arc_sums"], arrays["arc_counts"], _, _ = \
+            merge_sums(arrays["arc_keys"], arrays["arc_sums"], arrays["arc_counts"],
+                       pack_keys(contribution["edge_sentence"], contribution["edge_dep"], contribution["edge_head"]),
+                       contribution["edge_score"] * weight, sign)
+
+        votes = np.ceil(contribution["pos_vote"]) if self.meta["unit_vote_pos"] else contribution["pos_vote"]
+        pos_keys = pack_keys(contribution["pos_sentence"], contribution["pos_token"], contribution["pos_tag"])
+        old_firsts = arrays["pos_firsts"]
+        arrays["pos_keys"], arrays["pos_sums"], arrays["pos_counts"], inverse, kept = \
+            merge_sums(arrays["pos_keys"], arrays["pos_sums"], arrays["pos_counts"], pos_keys, votes, sign)
+
+        # the first vote of every tag: an added source can only come first for the tags it introduces, a removed
+        # source that came first hands over to the first vote among the remaining sources
+        firsts = np.full(len(kept), NO_FIRST)
+        np.minimum.at(firsts, inverse[:len(old_firsts)], old_firsts)
+        if sign > 0:
+            np.minimum.at(firsts, inverse[len(old_firsts):], (rank << 16) | contribution["pos_position"])
+        else:
+            firsts[(firsts >> 16) == rank] = NO_FIRST
+        arrays["pos_firsts"] = firsts[kept]
+
+        stale = arrays["pos_firsts"] == NO_FIRST
+        if stale.any():
+            stale_keys = arrays["pos_keys"][stale]
+            stale_firsts = np.full(len(stale_keys), NO_FIRST)
+            for source in self.meta["sources"]:
+                other = self.load_contribution(source["rank"])
+                other_keys = pack_keys(other["pos_sentence"], other["pos_token"], other["pos_tag"])
+                found = np.isin(other_keys, stale_keys)
+                np.minimum.at(stale_firsts, np.searchsorted(stale_keys, other_keys[found]),
+                              (source["rank"] << 16) | other["pos_position"][found])
+            arrays["pos_firsts"][stale] = stale_firsts
+
+        untagged = contribution["pos_tag"] == self.meta["tags"].index("_") if "_" in self.meta["tags"] else \
+            np.zeros(len(pos_keys), dtype=bool)
+        arrays["unaligned"] += sign * np.bincount(contribution["pos_sentence"][untagged], minlength=len(self))
+
+    def sentence_votes(self, sid):
+        """The votes of a target sentence over all sources in the cache, as vote_pos_and_deps.py would cast them.
+
+        :param sid: target sentence id
+        :return: <voted POS tags, number of unaligned token votes, number of contributing sources, <dependents,
+            heads, summed scores> arcs ordered by dependent and head, stored <heads, margin> or None> 5-tuple
+        """
+        arrays = self.arrays
+        sentence_length = int(arrays["sentence_lengths"][sid])
+        bounds = [sid << 32, (sid + 1) << 32]
+
+        # the tag with the most votes, ties go to the tag voted for first
+        begin, end = np.searchsorted(arrays["pos_keys"], bounds)
+        keys = arrays["pos_keys"][begin:end]
+        tokens = (keys >> 16) & 0xFFFF
+        order = np.lexsort((arrays["pos_firsts"][begin:end], -arrays["pos_sums"][begin:end], tokens))
+        winners = order[np.append(True, tokens[order][1:] != tokens[order][:-1])] if len(order) else order
+        pos_tags = ["_"] * sentence_length
+        for token_id, tag_id in zip(tokens[winners].tolist(), (keys[winners] & 0xFFFF).tolist()):
+            pos_tags[token_id - 1] = self.meta["tags"][tag_id]
+
+        begin, end = np.searchsorted(arrays["arc_keys"], bounds)
+        keys = arrays["arc_keys"][begin:end]
+        arcs = (keys >> 16) & 0xFFFF, keys & 0xFFFF, arrays["arc_sums"][begin:end]
+
+        stored = None
+        if arrays["decoded"][sid]:
+            offset = self.token_offsets[sid]
+            stored = ([-1] + arrays["heads"][offset:offset + sentence_length].tolist(),
+                      None if np.isnan(arrays["margins"][sid]) else float(arrays["margins"][sid]))
+
+        return pos_tags, int(arrays["unaligned"][sid]), int(arrays["contributors"][sid]), arcs, stored
+
+    def store_result(self, sid, heads, margin):
+        """Stores the decoded heads of a target sentence, root included, and its tree score margin or None."""
+        offset = self.token_offsets[sid]
+        self.arrays["heads"][offset:offset + len(heads) - 1] = heads[1:]
+        self.arrays["margins"][sid] = np.nan if margin is None else margin
+        self.arrays["decoded"][sid] = True
+
+    def save(self):
+        """Writes the running sums and results, the metadata last, as it marks a complete cache. The metadata is
+        written to a temporary file first and then moved over the old one."""
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.invalidate()
+        for name in CACHE_ARRAYS:
+            np.save(str(self.cache_path / (name + ".npy")), self.arrays[name])
+        temporary_meta_file = self.meta_file.with_suffix(".json.tmp")
+        with temporary_meta_file.open("w") as meta_file_handle:
+            json.dump(self.meta, meta_file_handle)
+        os.replace(str(temporary_meta_file), str(self.meta_file))
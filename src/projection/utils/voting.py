@@ -0,0 +1,198 @@
+from collections import Counter
+import copy
+import heapq
+import itertools
+import os
+import pickle
+import tempfile
+import string
+import warnings
+import numpy as np
+from utils.aggregation import aggregate
+
+
+def add_root_row(tensor):
+    first_row = np.ones([1, tensor.shape[1], tensor.shape[2]]) * np.nan
+    return np.vstack([first_row, tensor])
+
+
+def eliminate_all_nan_rows(M_proj):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        by_row = np.nanmax(M_proj, axis=1)
+        all_nan_rows = np.isnan(by_row)
+        M_proj[all_nan_rows] = np.nanmin(M_proj)
+
+
+def build_sentence_tensor(sentence_projections, sentence_length):
+    """Builds the (n+1 x n+1 x k) tensor of projected weights from the sparse edges of k sources, root row included.
+
+    :param sentence_projections: list of SentenceProjection objects of the contributing sources
+    :param sentence_length: number of target tokens n
+    :return: the tensor, NaN for cells without projections
+    """
+    tensor = np.full((sentence_length + 1, sentence_length + 1, len(sentence_projections)), np.nan)
+    for k, projection in enumerate(sentence_projections):
+        tensor[projection.deps, projection.heads, k] = projection.scores
+    return tensor
+
+
+def vote_weight_matrix(sentence_tensor, aggregator="sum", **params):
+    """Aggregates the weight matrices of the sources into a single matrix, see utils.aggregation.
+
+    :param sentence_tensor: (n+1 x n+1 x k) tensor of projected weights, NaN for cells without projections
+    :param aggregator: aggregator name, the sum by default
+    :param params: parameters of the aggregator
+    :return: (n+1 x n+1) voted weight matrix, 0 for cells without projections
+    """
+    return aggregate(sentence_tensor, aggregator, **params)
+
+
+def vote_arcs(sentence_projections, sentence_length, weights=None):
+    """Sums the projected weights of k sources over the projected arcs only, without building the dense tensor.
+
+    :param sentence_projections: list of SentenceProjection objects of the contributing sources
+    :param sentence_length: number of target tokens n
+    :param weights: k source weights the projected weights are multiplied by, if any
+    :return: <n+1, dependents, heads, summed scores> arcs, ordered by dependent and head
+    """
+    dependents = np.concatenate([projection.deps for projection in sentence_projections]).astype(np.int64)
+    heads = np.concatenate([projection.heads for projection in sentence_projections]).astype(np.int64)
+    scores = np.concatenate([projection.scores for projection in sentence_projections])
+
+    if weights is not None:
+        scores = scores * np.repeat(weights, [len(projection.scores) for projection in sentence_projections])
+
+    arcs, inverse = np.unique(dependents * (sentence_length + 1) + heads, return_inverse=True)
+    summed_scores = np.bincount(inverse.ravel(), weights=scores, minlength=len(arcs))
+
+    return sentence_length + 1, arcs // (sentence_length + 1), arcs % (sentence_length + 1), summed_scores
+
+
+def softmax_arcs(dependents, scores):
+    """Per-dependent softmax over the candidate heads of each dependent, for arcs ordered by dependent."""
+    if not len(scores):
+        return scores
+    firsts = np.flatnonzero(np.append(True, dependents[1:] != dependents[:-1]))
+    groups = np.repeat(np.arange(len(firsts)), np.diff(np.append(firsts, len(scores))))
+    exp_scores = np.exp(scores - np.maximum.reduceat(scores, firsts)[groups])
+    return exp_scores / np.add.reduceat(exp_scores, firsts)[groups]
+
+
+def vote_pos_tags(sentence_projections, sentence_length, pos_vote_caster):
+    """Votes for the POS tag of each target token over the contributing sources.
+
+    :param sentence_projections: list of SentenceProjection objects of the contributing sources
+    :param sentence_length: number of target tokens n
+    :param pos_vote_caster: applied to each single vote, e.g., for unit votes
+    :return: <list of voted POS tags, number of unaligned token votes> pair
+    """
+    pos_tags = []
+    number_of_unaligned_tokens = 0
+
+    for i in range(sentence_length):
+        overall_pos_votes = Counter()
+        for projection in sentence_projections:
+            source_pos_counter = Counter()
+            for pos, num in projection.pos_votes[i]:
+                source_pos_counter.update({pos: pos_vote_caster(num)})
+                if pos == "_":
+                    number_of_unaligned_tokens += 1
+            # add single source counts to the overall pool
+            overall_pos_votes.update(source_pos_counter)
+        pos_tags.append(overall_pos_votes.most_common(1)[0][0])
+
+    return pos_tags, number_of_unaligned_tokens
+
+
+def mean_coverage(number_of_sources, sentence_length, number_of_unaligned_tokens):
+    """Share of the token votes of all sources, including the unmatched ones, that come from aligned tokens."""
+    return ((number_of_sources * sentence_length) - number_of_unaligned_tokens) / \
+           (number_of_sources * sentence_length)
+
+
+def format_voted_sentence(target_sentence, decoded_heads, pos_tags, pretagged=False, scorer=None):
+    """Assigns the decoded heads and the voted POS tags to the target tokens, and formats the sentence.
+
+    :param target_sentence: list of target tokens, modified in place
+    :param decoded_heads: list of heads, one per target token
+    :param pos_tags: list of voted POS tags, one per target token
+    :param pretagged: keep the preassigned target POS tags instead of the voted tags
+    :param scorer: utils.score.TokenScorer, updated with the original vs. the assigned tokens, if given
+    :return: the CoNLL block of the sentence
+    """
+    sentence_string = ""
+    for jt, token in enumerate(target_sentence):
+        old_token = copy.copy(token)  # for evaluation
+
+        # get the decoded head
+        token.head = decoded_heads[jt]
+
+        # get the voted POS tag
+        if not pretagged:
+            token.cpos = "PUNCT" if token.form in string.punctuation else pos_tags[jt]
+
+        # evaluation TODO Makes sense only if the target language is one of the source languages
+        if scorer is not None:
+            scorer.update(old_token, token)
+
+        sentence_string += token.__str__()  # we don't need the weights anymore
+        sentence_string += "\n"
+
+    return sentence_string
+
+
+class TopSentences:
+    """
+    Selects the k best formatted sentences by score, as sorting all sentences by descending score with a stable sort
+    and taking the first k would. Only the k best sentences are kept, in a bounded heap; if k is larger than the spill
+    size, the sentences are written to disk instead, in sorted runs of at most spill size sentences, which are merged
+    when the selection is read.
+    """
+    def __init__(self, k, spill_size=None, spill_dir=None):
+        self.k = k
+        self.spill_size = spill_size if spill_size is not None and spill_size < k else None
+        self.spill_dir = spill_dir
+        self.heap = []  # items: (score, -arrival, sentence string), the worst sentence on top
+        self.runs = []  # spilled run files, sorted best first
+        self.arrivals = itertools.count()
+
+    def add(self, sentence_string, score):
+        item = (score, -next(self.arrivals), sentence_string)
+
+        if self.spill_size is not None:
+            self.heap.append(item)
+            if len(self.heap) == self.spill_size:
+                self.spill()
+        elif len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif self.k > 0:
+            heapq.heappushpop(self.heap, item)
+
+    def spill(self):
+        run_file, run_path = tempfile.mkstemp(prefix="vote.", suffix=".run", dir=self.spill_dir)
+        with os.fdopen(run_file, "wb") as run_file_handle:
+            for item in sorted(self.heap, reverse=True)[:self.k]:
+                pickle.dump(item, run_file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(run_path)
+        self.heap = []
+
+    @staticmethod
+    def read_run(run_path):
+        with open(run_path, "rb") as run_file_handle:
+            while True:
+                try:
+                    yield pickle.load(run_file_handle)
+                except EOFError:
+                    return
+
+    def __iter__(self):
+        """Yields the selected sentence strings, best first."""
+        runs = [self.read_run(run_path) for run_path in self.runs] + [sorted(self.heap, reverse=True)]
+        for _, _, sentence_string in itertools.islice(heapq.merge(*runs, reverse=True), self.k):
+            yield sentence_string
+
+    def close(self):
+        for run_path in self.runs:
+            os.remove(run_path)
+        self.runs = []
@@ -1,168 +1,299 @@
 import argparse
 import numpy as np
-from collections import Counter
 import utils.conll as conll
 # import mst.cle as cle
-import string
+import os
 import sys
 import time
-import copy
 from pathlib import Path
 import utils.score as score
-from dependency_decoding import chu_liu_edmonds
-import warnings
+from collections import deque
+import threading
+from mst.decoding import decode_kbest, decoders, sparse_decoders
 import math
+import multiprocessing
 import utils.normalize as norm
 import utils.is_projective as proj
-import operator
+from utils.projection_files import read_projections
+from utils.vote_cache import VoteCache
+from utils.aggregation import aggregators, read_source_weights
+from utils.voting import eliminate_all_nan_rows, build_sentence_tensor, vote_weight_matrix, vote_pos_tags, \
+    mean_coverage, format_voted_sentence, vote_arcs, softmax_arcs, TopSentences
 
 
-def add_root_row(tensor):
-    first_row = np.ones([1, tensor.shape[1], tensor.shape[2]]) * np.nan
-    return np.vstack([first_row, tensor])
-
-
-def eliminate_all_nan_rows(M_proj):
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        by_row = np.nanmax(M_proj, axis=1)
-        all_nan_rows = np.isnan(by_row)
-        M_proj[all_nan_rows] = np.nanmin(M_proj)
-
-
-def vote_weight_matrix(sentence_tensor):
-    """
-    TODO
-    :param sentence_tensor:
-    :return:
-    """
-    return np.nansum(sentence_tensor, axis=2)
-
-start_time = time.time()  # timing the script
-
-parser = argparse.ArgumentParser(description="Voting and CLE decoding on projected labels and weight matrices.")
-
-parser.add_argument("--target", required=True, help="target CoNLL file", type=Path)
-parser.add_argument("--projections", required=True, help="path to vote files", type=Path, nargs="+")
-parser.add_argument("--stop_after", required=False, help="stop after n sentences")
-parser.add_argument('--unit_vote_pos', required=True, choices=[0, 1], help="use unit votes for POS tag voting", type=int)
-parser.add_argument('--pretagged', action='store_true', help="use preassigned target POS tags instead of voted tags")
-parser.add_argument('--dump_npz', action='store_true', help="dump NPZ debug files")
-parser.add_argument('--skip_untagged', action='store_true', help="skip sentences with untagged tokens")
-parser.add_argument('--decode', action='store_true', help="perform CLE decoding")
-parser.add_argument("--select_top", required=True, help="take n best sentences by mean coverage", type=int)
-
-args = parser.parse_args()
-
-# TODO
+# pos vote casts by --unit_vote_pos TODO
 pos_vote_casts = {1: math.ceil,
                   0: lambda x: x}
-pos_vote_caster = pos_vote_casts[args.unit_vote_pos]
-
-target_file_handle = args.target.open()
-
-token_count = 0
-sentence_count = 0
-scorer = score.TokenScorer()  # for scoring
-
-# current sentence information: tags, dependency labels, tensor, and source languages list
-current_pos_tags = []
-# current_dep_labels = []
-current_sentence_tensor = []
-current_sentence_source_languages = []
-current_number_of_unaligned_tokens = 0
-current_sentence_string = ""
-
-all_output_sentences = []  # items: (sentence_string, mean_coverage)
-
-skip_sentence = False  # skip sentences with empty sources
-vote_handles = [projection_file.open() for projection_file in args.projections]
-
-
-for lines in zip(*vote_handles):
-
-    if lines[0] != "\n" and not skip_sentence:
-        current_sentence_source_languages.clear()  # TODO: This is redundant! Should be ordered set.
-
-        # voting for tags, dependency labels and heads
-        overall_pos_votes = Counter()
-        # overall_label_votes = Counter()
-        overall_head_votes = None
-
-        projection_weights_per_token = []
-        current_sentence_tensor.append(projection_weights_per_token)
 
-        # iterate through blocks provided by singled-out sources
-        for source in lines:
-            labels_and_heads = source.split("\t")
-            # assert len(labels_and_heads) == 3
-            if len(labels_and_heads) != 3:
-                continue  # skip empty source
+# settings of the voting, set in the main process and in every worker of the voting pool by init_voting
+voting = {}
 
-            # get POS and dependencies parts
-            source_language_name, source_pos_votes, source_head_votes = labels_and_heads
-            current_sentence_source_languages.append(source_language_name)
 
-            # turn POS part & label part into Counters
-            source_pos_votes = source_pos_votes.split()
-            source_pos_counter = Counter()
-            # source_label_votes = source_label_votes.split()
-            source_label_counter = Counter()
+def init_voting(args, source_weights):
+    """Sets the settings of the voting, the command line arguments and the source weights of --source_weights."""
+    voting["args"] = args
+    voting["source_weights"] = source_weights
+    voting["pos_vote_caster"] = pos_vote_casts[args.unit_vote_pos]
 
-            for vote in source_pos_votes:
-                pos, num = vote.split(":")
-                source_pos_counter.update({pos: pos_vote_caster(float(num))})
-                if pos == "_":
-                    current_number_of_unaligned_tokens += 1
 
-            #for vote in source_label_votes:
-            #    label, num = vote.split(":")
-            #    source_label_counter.update({label: int(num)})
+def aggregation_params(contributing_projections):
+    """Parameters of the --aggregate aggregator for the sources of a sentence."""
+    args = voting["args"]
+    if args.aggregate == "weighted":
+        return {"weights": [voting["source_weights"].get(projection.language, 1.0)
+                            for projection in contributing_projections]}
+    if args.aggregate == "threshold":
+        return {"threshold": args.threshold}
+    return {}
 
-            # add single source counts to the overall pool
-            overall_pos_votes.update(source_pos_counter)
-            # overall_label_votes.update(source_label_counter)
 
-            # collect heads for current source
-            head_scores = list(map(float, source_head_votes.strip().split()))
-            for i, val in enumerate(head_scores):
-                if i >= len(projection_weights_per_token):
-                    projection_weights_per_token.append([])
-                projection_weights_per_token[i].append(val)
+def vote_and_decode(task):
+    """Votes the POS tags and the weight matrix of a sentence over its contributing sources, and decodes it. Runs in
+    the pool.
 
-        if not len(projection_weights_per_token):  # if none of the source languages contributed any projections
-            skip_sentence = True
-            continue
-
-        current_pos_tags.append(overall_pos_votes.most_common(1)[0][0])
-        # current_dep_labels.append(overall_label_votes.most_common(1)[0][0])
-
-        # skip sentences with at least one placeholder "_" POS tag (or dependency label?)
-        if args.skip_untagged and current_pos_tags[-1] == "_":  # or current_dep_labels[-1] == "_": TODO everything gets skipped if dep=="_"!
-            skip_sentence = True
-
-    elif lines[0] == "\n":
-
-        current_sentence = conll.get_next_sentence(target_file_handle)  # has to be run even if skip_sentence == True!
-
-        its_mean_coverage = ((len(vote_handles) * len(current_sentence)) - current_number_of_unaligned_tokens) / \
-                            (len(vote_handles) * len(current_sentence))
-
-        if not skip_sentence:
+    :param task: <sentence length, number of sources, contributing projections, votes from the vote cache or None>
+        4-tuple
+    :return: <POS tags, mean coverage, decoded heads or None if the sentence is skipped, tree score margin or None,
+        projection tensor and source languages for dump_npz or None> 5-tuple
+    """
+    sentence_length, number_of_sources, contributing_projections, cached_votes = task
+    args, pos_vote_caster = voting["args"], voting["pos_vote_caster"]
+
+    # skip sentences if none of the source languages contributed any projections, there is nothing to vote on
+    number_of_contributors = cached_votes[2] if cached_votes is not None else len(contributing_projections)
+    if not number_of_contributors:
+        return None, None, None, None, None
+
+    if cached_votes is not None:
+        # the votes are summed over the sources in the cache, the results are stored unless a source changed
+        current_pos_tags, current_number_of_unaligned_tokens, _, summed_arcs, stored = cached_votes
+    else:
+        # voting for tags
+        current_pos_tags, current_number_of_unaligned_tokens = vote_pos_tags(contributing_projections,
+                                                                             sentence_length, pos_vote_caster)
+        summed_arcs, stored = None, None
+
+    its_mean_coverage = mean_coverage(number_of_sources, sentence_length, current_number_of_unaligned_tokens)
+
+    # skip sentences with at least one placeholder "_" POS tag
+    if args.skip_untagged and "_" in current_pos_tags:
+        return current_pos_tags, its_mean_coverage, None, None, None
+
+    if stored is not None:
+        stored_heads, stored_margin = stored
+        return current_pos_tags, its_mean_coverage, stored_heads, stored_margin, None
+
+    current_sentence_tensor = None
+    if summed_arcs is not None:
+        arcs_dependents, arcs_heads, arcs_scores = summed_arcs
+        if args.decoder in sparse_decoders:
+            current_sentence_matrix = (sentence_length + 1, arcs_dependents, arcs_heads,
+                                       softmax_arcs(arcs_dependents, arcs_scores))
+        else:
+            # the summed weight matrix, zero where no source projected an arc, just like the sum over the tensor
+            current_sentence_matrix = np.zeros((sentence_length + 1, sentence_length + 1))
+            current_sentence_matrix[arcs_dependents, arcs_heads] = arcs_scores
+            current_sentence_matrix = norm.softmax(current_sentence_matrix)
+            eliminate_all_nan_rows(current_sentence_matrix)
+    elif args.decoder in sparse_decoders and args.aggregate not in ("sum", "weighted"):
+        # aggregate over the tensor, but only keep the projected arcs as candidates
+        current_sentence_tensor = build_sentence_tensor(contributing_projections, sentence_length)
+        voted_matrix = vote_weight_matrix(current_sentence_tensor, args.aggregate,
+                                          **aggregation_params(contributing_projections))
+        arcs_dependents, arcs_heads = np.nonzero(~np.isnan(current_sentence_tensor).all(axis=2))
+        current_sentence_matrix = (sentence_length + 1, arcs_dependents, arcs_heads,
+                                   softmax_arcs(arcs_dependents, voted_matrix[arcs_dependents, arcs_heads]))
+    elif args.decoder in sparse_decoders:
+        # sum the source language weights over the projected arcs only, then softmax over the candidate
+        # heads of each dependent, the decoder attaches dependents without candidates to the root
+        arcs_length, arcs_dependents, arcs_heads, arcs_scores = \
+            vote_arcs(contributing_projections, sentence_length, **aggregation_params(contributing_projections))
+        current_sentence_matrix = (arcs_length, arcs_dependents, arcs_heads, softmax_arcs(arcs_dependents, arcs_scores))
+    else:
+        # construct a 3-dim tensor where each slice along the third dimension corresponds
+        # to a weight matrix for a given source language
+        current_sentence_tensor = build_sentence_tensor(contributing_projections, sentence_length)
+
+        # unify the source language matrices into a single a matrix
+        # first we aggregate, the sum by default, then per-row normalize using softmax
+        current_sentence_matrix = norm.softmax(vote_weight_matrix(current_sentence_tensor, args.aggregate,
+                                                                  **aggregation_params(contributing_projections)))
+        eliminate_all_nan_rows(current_sentence_matrix)
+
+    # the raw projections are dumped by the writer stage, which numbers the sentences
+    dump = None
+    if args.dump_npz:
+        if current_sentence_tensor is None:
+            current_sentence_tensor = build_sentence_tensor(contributing_projections, sentence_length)
+        dump = current_sentence_tensor, [projection.language for projection in contributing_projections]
+
+    if not args.decode:
+        return current_pos_tags, its_mean_coverage, [-1] + [0] * sentence_length, None, dump
+
+    if args.kbest > 1:
+        kbest = decode_kbest(current_sentence_matrix, args.kbest)
+        margin = kbest[0][0] - kbest[1][0] if len(kbest) > 1 else math.inf
+        return current_pos_tags, its_mean_coverage, kbest[0][1], margin, dump
+
+    # decoded_heads = cle.mdst(current_sentence_matrix)  # do the MST magic TODO Change to new CLE!!!
+    return current_pos_tags, its_mean_coverage, decoders[args.decoder](current_sentence_matrix), None, dump
+
+
+def main():
+    start_time = time.time()  # timing the script
+
+    parser = argparse.ArgumentParser(description="Voting and CLE decoding on projected labels and weight matrices.")
+
+    parser.add_argument("--target", required=True, help="target CoNLL file", type=Path)
+    parser.add_argument("--projections", required=True, help="path to vote files, text or binary .npz shards",
+                        type=Path, nargs="+")
+    parser.add_argument("--stop_after", required=False, help="stop after n sentences")
+    parser.add_argument('--unit_vote_pos', required=True, choices=[0, 1], help="use unit votes for POS tag voting",
+                        type=int)
+    parser.add_argument('--pretagged', action='store_true',
+                        help="use preassigned target POS tags instead of voted tags")
+    parser.add_argument('--dump_npz', action='store_true', help="dump NPZ debug files")
+    parser.add_argument('--skip_untagged', action='store_true', help="skip sentences with untagged tokens")
+    parser.add_argument('--decode', action='store_true', help="perform CLE decoding")
+    parser.add_argument("--decoder", required=False, choices=decoders.keys(), default="cle",
+                        help="decoding engine: non-projective CLE, CLE over the projected arcs only, or projective "
+                             "Eisner")
+    parser.add_argument("--aggregate", required=False, choices=aggregators.keys(), default="sum",
+                        help="aggregation of the source weight matrices before the softmax, see utils.aggregation")
+    parser.add_argument("--threshold", required=False, type=float, default=0.1,
+                        help="lowest source weight that counts for --aggregate threshold")
+    parser.add_argument("--source_weights", required=False, type=Path,
+                        help="file with a \"source target weight\" triple per line for --aggregate weighted, other "
+                             "sources get 1, e.g., the source reliability table of source_reliability.py")
+    parser.add_argument("--select_top", required=True, help="take n best sentences by --rank_by", type=int)
+    parser.add_argument("--kbest", required=False, type=int, default=1,
+                        help="decode the k best trees with the sparse CLE decoder, the best tree is output and the "
+                             "others give the tree score margin")
+    parser.add_argument("--rank_by", required=False, choices=["coverage", "margin"], default="coverage",
+                        help="rank sentences for --select_top by mean coverage, or by the score margin between the two "
+                             "best trees (needs --kbest 2 or more)")
+    parser.add_argument("--spill_size", required=False, type=int,
+                        help="keep at most n selected sentences in memory, spill the selection to disk beyond that")
+    parser.add_argument("--spill_dir", required=False, help="directory for the spilled selection, defaults to the "
+                                                            "system temporary directory", type=Path)
+    parser.add_argument("--processes", required=False, help="number of voting and decoding processes, defaults to all "
+                                                             "CPUs", type=int)
+    parser.add_argument("--chunksize", required=False, help="number of sentences sent to a voting process at once",
+                        type=int, default=64)
+    parser.add_argument("--vote_cache", required=False, type=Path,
+                        help="keep the source contributions, the running vote sums and the results in this "
+                             "directory, so that later runs with added or removed sources only revote and decode the "
+                             "sentences these sources contribute to")
+
+    args = parser.parse_args()
+
+    if args.rank_by == "margin" and not (args.decode and args.kbest > 1):
+        parser.error("--rank_by margin needs --decode and --kbest 2 or more")
+    if args.aggregate == "weighted" and not args.source_weights:
+        parser.error("--aggregate weighted needs --source_weights")
+    if args.vote_cache and args.aggregate not in ("sum", "weighted"):
+        parser.error("--vote_cache keeps running sums, it only works with --aggregate sum or weighted")
+    if args.vote_cache and args.dump_npz:
+        parser.error("--dump_npz needs the projections of every source, it does not work with --vote_cache")
+
+    target_file_handle = args.target.open()
+
+    sentence_count = 0
+    scorer = score.TokenScorer()  # for scoring
+
+    source_weights = {}
+    if args.source_weights:
+        # the target language is the first part of the target filename, as for the --dump_npz files
+        target_language_name = args.target.name.split('.', 1)[0]
+        source_weights = read_source_weights(args.source_weights, target_language_name)
+        if not source_weights:
+            print("No source weights for target %s in %s, all sources weigh 1" % (target_language_name,
+                                                                                  args.source_weights), file=sys.stderr)
+
+    init_voting(args, source_weights)
+
+    # the best sentences by mean coverage or tree score margin, for --select_top
+    selected_sentences = TopSentences(args.select_top, spill_size=args.spill_size, spill_dir=args.spill_dir)
+
+    # with a vote cache, only the contributions of the added and removed sources are summed up, and only the
+    # sentences they contribute to are decoded
+    vote_cache = None
+    if args.vote_cache:
+        vote_cache = VoteCache(args.vote_cache)
+        removed_sources, added_sources = vote_cache.update(args.projections, args.target, args.unit_vote_pos,
+                                                           {"decode": args.decode, "decoder": args.decoder,
+                                                            "kbest": args.kbest},
+                                                           source_weights if args.aggregate == "weighted" else {})
+        print("Vote cache: %s sources removed, %s added, %s of %s sentences without stored results" %
+              (len(removed_sources), len(added_sources), len(vote_cache) - vote_cache.arrays["decoded"].sum(),
+               len(vote_cache)), file=sys.stderr)
+
+    # the sentences are voted and decoded in a pool of processes: a reader stage yields a task per target sentence,
+    # and the results come back in order to the writer stage below; the reader stays at most in_flight sentences
+    # ahead of it, a few chunks per process, or a single sentence without a pool
+    processes = args.processes or os.cpu_count()
+    voting_pool = None
+    if processes > 1:
+        voting_pool = multiprocessing.Pool(processes, initializer=init_voting, initargs=(args, source_weights))
+        in_flight = threading.Semaphore(2 * args.chunksize * processes)
+    else:
+        in_flight = threading.Semaphore(1)
+    read_sentences_queue = deque()  # items: target sentences, in the order of the tasks
+    stop_reading = threading.Event()
+
+    def read_sentences():
+        """Reader stage: reads the target sentences and yields them with their contributing projections, or with
+        their votes from the vote cache."""
+        if vote_cache is not None:
+            for sid in range(len(vote_cache)):
+                in_flight.acquire()
+                if stop_reading.is_set():
+                    return
+
+                current_sentence = conll.get_next_sentence(target_file_handle)
+
+                read_sentences_queue.append(current_sentence)
+                yield len(current_sentence), len(vote_cache.sources), None, vote_cache.sentence_votes(sid)
+            return
+
+        # one sentence block per source at a time: SentenceProjection, or None if the target sentence is unmatched
+        projection_readers = [read_projections(projection_file) for projection_file in args.projections]
+
+        for sentence_projections in zip(*projection_readers):
+            in_flight.acquire()
+            if stop_reading.is_set():
+                return
+
+            # has to be run even if the sentence is skipped!
+            current_sentence = conll.get_next_sentence(target_file_handle)
+
+            # skip sentences with empty sources
+            contributing_projections = [projection for projection in sentence_projections if projection is not None]
+
+            read_sentences_queue.append(current_sentence)
+            yield len(current_sentence), len(projection_readers), contributing_projections, None
+
+    if voting_pool is not None:
+        voting_results = voting_pool.imap(vote_and_decode, read_sentences(), args.chunksize)
+    else:
+        voting_results = map(vote_and_decode, read_sentences())
+
+    # writer stage: numbers the voted sentences, assigns them their heads and tags, and scores, formats and selects
+    # them
+    for sid, (current_pos_tags, its_mean_coverage, decoded_heads, margin, dump) in enumerate(voting_results):
+        current_sentence = read_sentences_queue.popleft()
+        in_flight.release()
+
+        if decoded_heads is not None:
 
             sentence_count += 1
 
-            # construct a 3-dim tensor where each slice along the third dimension corresponds
-            # to a weight matrix for a given source language
-            current_sentence_tensor = add_root_row(np.array(current_sentence_tensor))
-
-            # unify the source language matrices into a single a matrix
-            # first we sum, then per-row normalize using softmax
-            current_sentence_matrix = norm.softmax(vote_weight_matrix(current_sentence_tensor))
-            eliminate_all_nan_rows(current_sentence_matrix)
+            if vote_cache is not None:
+                vote_cache.store_result(sid, decoded_heads, margin)
 
             # dump the raw projections into a file, for debug purposes
-            if args.dump_npz:
+            if dump is not None:
+                current_sentence_tensor, current_sentence_source_languages = dump
                 raw_projections_filename = "{}.{}".format(args.target.name.split('.', 1)[0], sentence_count)
                 np.savez(raw_projections_filename,
                          projection_tensor=current_sentence_tensor,
@@ -170,59 +301,31 @@ for lines in zip(*vote_handles):
                          heads=[token.head for token in current_sentence],
                          tokens=[token.form for token in current_sentence])
 
-            if args.decode:
-                # decoded_heads = cle.mdst(current_sentence_matrix)  # do the MST magic TODO Change to new CLE!!!
-                decoded_heads, tree_score = chu_liu_edmonds(current_sentence_matrix)
-                decoded_heads = decoded_heads[1:]
-            else:
-                decoded_heads = [0 for _ in current_sentence]
-
-            # FIXME Dummy to get stats for number of contributing languages
-            #print(current_sentence_tensor.shape[2], proj.is_projective(decoded_heads))
-            #current_sentence_tensor = []
-            #continue
-
-            jt = 0
-            for token in current_sentence:
-                old_token = copy.copy(token)  # for evaluation
-
-                # get the decoded head
-                token.head = decoded_heads[jt]
-                # token.head = np.argmax(current_sentence_matrix[jt, ])  # placeholder, per-token voting
-
-                # get the voted POS tag and dependency label
-                # token.deprel = current_dep_labels[jt]
-                if not args.pretagged:
-                    token.cpos = "PUNCT" if token.form in string.punctuation else current_pos_tags[jt]
-
-                # evaluation TODO Makes sense only if the target language is one of the source languages
-                scorer.update(old_token, token)
-
-                # print(token, " ".join(map(str, current_sentence_matrix[jt, ])))
-                current_sentence_string += token.__str__()  # we don't need the weights anymore
-                jt += 1
-                current_sentence_string += "\n"
-
-            all_output_sentences.append((current_sentence_string, its_mean_coverage))
-
-        skip_sentence = False  # we don't yet know whether to skip the next one or not, so reset the flag
-
-        current_sentence_tensor = []
-        current_pos_tags = []
-        current_dep_labels = []
-        current_number_of_unaligned_tokens = 0
-        current_sentence_string = ""
+            sentence_string = format_voted_sentence(current_sentence, decoded_heads[1:], current_pos_tags,
+                                                    pretagged=args.pretagged, scorer=scorer)
+            selected_sentences.add(sentence_string, margin if args.rank_by == "margin" else its_mean_coverage)
 
         if args.stop_after and int(args.stop_after) == sentence_count:
             break
 
-# assert all(h.read() == "" for h in vote_handles), "Projections differ in size"
+    if voting_pool is not None:
+        # wake up the reader if it waits for a free slot, so that it sees the stop and the pool can shut down
+        stop_reading.set()
+        in_flight.release()
+        voting_pool.terminate()
+
+    if vote_cache is not None:
+        vote_cache.save()
+
+    # assert all(h.read() == "" for h in vote_handles), "Projections differ in size"
 
-all_output_sentences.sort(key=operator.itemgetter(1), reverse=True)
+    for sentence_string in selected_sentences:
+        print(sentence_string)
+    selected_sentences.close()
 
-for i in range(0, args.select_top):
-    print(all_output_sentences[i][0])
+    print("Scores:", " ".join(map(str, scorer.get_score_list())), file=sys.stderr)
+    print("Execution time: %s sec" % (time.time() - start_time), file=sys.stderr)
 
 
-print("Scores:", " ".join(map(str, scorer.get_score_list())), file=sys.stderr)
-print("Execution time: %s sec" % (time.time() - start_time), file=sys.stderr)
+if __name__ == "__main__":
+    main()